@@ -2,141 +2,412 @@
 #  Thai Mural Restoration System - Flask Backend
 #  🟡 Function: รับภาพจากเว็บ → สร้าง mask, edge map → split patch →
 #  รันโมเดล inpainting → รวมภาพกลับ → ส่งผลลัพธ์กลับเป็น base64
+#  (ทุกขั้นตอนทำในหน่วยความจำใน worker เบื้องหลัง ไม่มีการเขียนไฟล์ชั่วคราว)
 # ============================================================
 
-import os, io, base64, shutil, sys, time
-from flask import Flask, request, jsonify, send_from_directory
-from PIL import Image
+import os, io, base64, json, time, threading
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory, stream_with_context
 import numpy as np
 import cv2
-import shutil
+from PIL import Image                       # ✅ อ่านขนาดภาพจาก header ก่อนถอดรหัส (admission control)
 from auto_mask import multi_box_auto_mask   # ✅ โมดูลสร้าง mask อัตโนมัติจากกล่อง (bounding box)
-from test import run_inference              # ✅ ฟังก์ชันรันโมเดล inpainting (แทน subprocess)
+from src.engine import InferenceEngine      # ✅ โมเดล inpainting ที่โหลดค้างไว้ในหน่วยความจำ (แทน main(mode=2))
+from tiling import restore_image, preview_image, create_edge_map, tile_origins  # ✅ แบ่ง tile → รันโมเดล → blending ในหน่วยความจำ
+from jobs import JobManager, Overloaded     # ✅ คิวงาน + worker pool แยกสถานะตาม job id
+from sessions import SessionStore           # ✅ ภาพที่อัปโหลดครั้งเดียว + แก้กรอบแบบเพิ่ม/ลบ
+from tile_cache import TileCache            # ✅ cache ผลลัพธ์ราย tile ใช้ร่วมกันทุก request
+import metrics                              # ✅ เวลาแต่ละขั้นตอน / ตัวนับ tile สำหรับ /metrics
+from tile_executor import TileExecutor      # ✅ รัน tile บน worker process หลายตัว (CPU หลาย core)
+from scheduler import BatchScheduler        # ✅ รวม tile จากหลายงานเป็น batch เดียวต่อการรันโมเดล
 
 # ---------- ตั้งค่า Flask ----------
 app = Flask(__name__, static_folder="static", static_url_path="")
 
-# ---------- โฟลเดอร์เก็บไฟล์ ----------
-SAVE_DIR = "runtime"           # โฟลเดอร์ชั่วคราวสำหรับเก็บไฟล์ระหว่างประมวลผล
-MODEL_TEST_DIR = "checkpoints/test"  # โฟลเดอร์ที่โมเดลจะใช้ทดสอบ input/output
-os.makedirs(SAVE_DIR, exist_ok=True)
-
-# ---------- ตัวแปรสถานะ Progress ----------
-progress_status = {"progress": 0, "message": "idle"}
-
-def set_progress(value, message=""):
-    """ตั้งค่าความคืบหน้าการประมวลผล"""
-    progress_status["progress"] = int(value)
-    progress_status["message"] = message
-
-def reset_progress():
-    """รีเซ็ต progress หลังทำงานเสร็จ"""
-    progress_status["progress"] = 0
-    progress_status["message"] = "idle"
-
-@app.route("/status", methods=["GET"])
-def status():
-    """ส่งสถานะ progress กลับให้ฝั่งเว็บเพื่อติดตามการทำงาน"""
-    return jsonify(progress_status)
+# ---------- ขนาด tile ----------
+# tile ใหญ่ขึ้น = รอยต่อน้อยลง, self attention ไม่สร้างเมทริกซ์ N x N แล้ว
+# แต่ถ้าใช้ tile ใหญ่มาก (เช่น 1024) ควรตั้ง ATTENTION_CHUNK ใน config.yml ด้วย
+PATCH_SIZE = int(os.environ.get("PATCH_SIZE", "512"))   # ขนาด tile ที่ส่งเข้าโมเดล (หารด้วย 8 ลงตัว)
+PATCH_OVERLAP = 64             # จำนวนพิกเซลที่ tile ติดกันซ้อนทับกัน (stride = 512 - 64)
+
+# ---------- ภาพตัวอย่างแบบเร็ว (coarse net อย่างเดียว) ----------
+PREVIEW_SCALE = 0.5            # ย่อภาพก่อนทำ preview (1 = ขนาดเต็ม)
+
+# ---------- โหลดโมเดลครั้งเดียวตอนเริ่มเซิร์ฟเวอร์ ----------
+# ใช้ซ้ำทุก request และจะโหลดใหม่เฉพาะเมื่อไฟล์ checkpoint เปลี่ยน
+engine = InferenceEngine("checkpoints/config.yml")
+
+# ---------- warmup ตอนเริ่มเซิร์ฟเวอร์ ----------
+# รัน tile ตัวอย่างผ่านโมเดลก่อนรับงานจริง (/readyz จะตอบ 200 หลัง warmup เสร็จ)
+WARMUP = os.environ.get("WARMUP", "1") != "0"
+warmup_error = None
+
+def start_warmup():
+    """เริ่ม warmup ใน thread เบื้องหลัง (เรียกครั้งเดียวก่อนเริ่มรับ request)"""
+    def run():
+        global warmup_error
+        try:
+            if executor is not None:
+                executor.wait_ready()   # worker แต่ละตัว warmup ของตัวเองตอนเริ่ม
+            else:
+                engine.warmup(PATCH_SIZE)
+        except Exception as e:
+            warmup_error = str(e)
+            raise
+    threading.Thread(target=run, name="warmup", daemon=True).start()
+
+# ---------- cache ผลลัพธ์ราย tile ----------
+# tile ที่ภาพ/mask/edge/checkpoint เหมือนเดิมทุกบิต ใช้ผลเดิมแทนการรันโมเดล
+# ชั้นหน่วยความจำจำกัดด้วยขนาดรวม: tile 512 x 512 BGR ใช้ ~768KB → 96MB ≈ 128 tile
+# ค่านี้เป็นต่อ process: serve.py --workers N ใช้ได้ถึง N เท่า (แชร์กันได้ผ่าน cache บนดิสก์)
+TILE_CACHE_MEMORY_MB = float(os.environ.get("TILE_CACHE_MEMORY_MB", "96"))  # 0 = ไม่เก็บในหน่วยความจำ
+TILE_CACHE_DIR = os.environ.get("TILE_CACHE_DIR")           # โฟลเดอร์ cache บนดิสก์ (ไม่ตั้ง = ไม่ใช้ดิสก์)
+TILE_CACHE_DISK_BYTES = 2 * 1024 ** 3                       # ขนาดรวมสูงสุดบนดิสก์
+tile_cache = TileCache(None, TILE_CACHE_DIR, TILE_CACHE_DISK_BYTES,
+                       max_bytes=int(TILE_CACHE_MEMORY_MB * 1024 ** 2))
+
+# ---------- worker process สำหรับรัน tile ----------
+# เครื่อง CPU หลาย core: แบ่ง batch ของ tile ไปหลาย process แต่ละตัวใช้ torch thread จำนวนจำกัด
+# (แทนที่ทุกงานจะแย่ง intra-op thread ชุดเดียวกันใน process นี้)
+TILE_WORKERS = int(os.environ.get("TILE_WORKERS", "0"))                 # 0 = รันโมเดลใน process นี้
+TILE_WORKER_THREADS = int(os.environ.get("TILE_WORKER_THREADS", "0"))   # torch thread ต่อ worker (0 = core / worker)
+TILE_WORKER_PIN = os.environ.get("TILE_WORKER_PIN", "0") == "1"         # ผูก worker กับกลุ่ม core (Linux)
+executor = None
+
+def start_executor():
+    """fork worker (เรียกก่อนเริ่ม thread อื่นทั้งหมด เช่น warmup / Flask)"""
+    global executor
+    executor = TileExecutor(engine, TILE_WORKERS, TILE_WORKER_THREADS or None, TILE_WORKER_PIN,
+                            warmup_size=PATCH_SIZE if WARMUP else None)
+
+# ---------- รวม batch ข้ามงาน (เมื่อรันโมเดลใน process นี้) ----------
+# tile จากทุกงานที่กำลังทำเข้าคิวเดียว → รันโมเดลครั้งละไม่เกิน BATCH_MAX_SIZE tile
+# tile แรกในคิวรอ tile อื่นได้ไม่เกิน BATCH_MAX_WAIT_MS
+BATCH_SCHEDULER = os.environ.get("BATCH_SCHEDULER", "1") != "0"
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "0"))             # 0 = engine.batch_size (TEST_BATCH_SIZE / อัตโนมัติ)
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+scheduler = BatchScheduler(engine, BATCH_MAX_SIZE or None, BATCH_MAX_WAIT_MS / 1000.0) if BATCH_SCHEDULER else None
+
+def tile_runner():
+    """ตัวรัน tile ที่ส่งให้ tiling: worker process > batch scheduler > รันตรงในงานนั้น (None)"""
+    return executor or scheduler
+
+# ---------- คิวงานเบื้องหลัง ----------
+# แต่ละงานมี job id และ progress ของตัวเอง ผู้ใช้หลายคนจึงไม่ทับกัน
+MAX_WORKERS = 2                # จำนวนงานฟื้นฟูที่รันพร้อมกันได้
+
+# ---------- admission control ----------
+# ต้นทุนของงาน ≈ พิกเซลของภาพ (ภาพ/mask/edge/ผลลัพธ์ที่ถือไว้) + พิกเซลของ tile ที่ต้องรันโมเดล
+# งานที่รับไว้ (รอ + กำลังรัน) รวมกันเกิน MAX_QUEUE_MEGAPIXELS หรือรอคิวเกิน MAX_QUEUED_JOBS
+# → ตอบ 429 + Retry-After ทันที, งานเดียวที่ใหญ่เกินทั้งหมด → 413
+# ผลลัพธ์ที่เก็บไว้ให้ดึงภายหลัง (BGR 3 ไบต์/พิกเซล) นับรวมใน MAX_QUEUE_MEGAPIXELS ด้วย
+# ถ้างานใหม่ไม่พอดีจะทิ้งผลเก่าสุดก่อน และรวมกันไม่เกิน MAX_RESULT_MEGABYTES เสมอ
+MAX_QUEUE_MEGAPIXELS = float(os.environ.get("MAX_QUEUE_MEGAPIXELS", "200"))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "16"))
+MAX_RESULT_MEGABYTES = float(os.environ.get("MAX_RESULT_MEGABYTES", "256"))
+JOB_DEADLINE = float(os.environ.get("JOB_DEADLINE", "600"))  # วินาที นับจากรับงาน (0 = ไม่จำกัด) client ตั้งเองได้ด้วย deadline=
+jobs = JobManager(max_workers=MAX_WORKERS, max_cost=int(MAX_QUEUE_MEGAPIXELS * 1e6) or None,
+                  max_queued=MAX_QUEUED_JOBS or None,
+                  max_result_bytes=int(MAX_RESULT_MEGABYTES * 1024 ** 2), bytes_per_cost=3)
+# ขนาดภาพอ่านจาก header ก่อนถอดรหัส (image_shape) ภาพใหญ่เกินถูกปฏิเสธที่ admission
+# จึงไม่ใช้ขีดจำกัด decompression bomb ของ PIL (ภาพ > ~179MP จะอ่าน header ไม่ได้)
+Image.MAX_IMAGE_PIXELS = None
+SSE_KEEPALIVE = 15             # วินาที ส่ง comment กัน proxy ตัดการเชื่อมต่อ SSE
+
+# ---------- session แก้ไขภาพ (อัปโหลดครั้งเดียว) ----------
+MAX_SESSIONS = 8               # จำนวนภาพที่เก็บไว้ฝั่ง server (LRU)
+SESSION_TTL = 1800             # วินาที ลบ session ที่ไม่ได้ใช้นานเกินนี้
+sessions = SessionStore(max_sessions=MAX_SESSIONS, ttl=SESSION_TTL)
+
+# ---------- gauge ที่อ่านค่าตอน /metrics ถูกเรียก ----------
+metrics.Gauge("mural_queue_depth", "Jobs waiting for a worker.", function=lambda: jobs.count("queued"))
+metrics.Gauge("mural_jobs_running", "Jobs currently running.", function=lambda: jobs.count("running"))
+metrics.Gauge("mural_admitted_cost_pixels", "Estimated cost of admitted jobs that have not finished.",
+              function=jobs.active_cost)
+metrics.Gauge("mural_retained_result_bytes", "Bytes of results and previews kept for finished jobs.",
+              function=jobs.retained_bytes)
+metrics.Gauge("mural_model_memory_bytes", "Memory held by the resident inpainting model.",
+              function=engine.memory_bytes)
+metrics.Gauge("mural_sessions", "Editing sessions kept in memory.", function=lambda: len(sessions.sessions))
+metrics.Gauge("mural_tile_cache_items", "Tiles held in the in-memory tile cache.",
+              function=lambda: tile_cache.stats()["items"])
+metrics.Gauge("mural_tile_cache_bytes", "Bytes held by the in-memory tile cache (per process).",
+              function=lambda: tile_cache.stats()["bytes"])
+metrics.Gauge("mural_tile_cache_disk_bytes", "Bytes used by the on-disk tile cache.",
+              function=lambda: tile_cache.stats()["disk_bytes"])
+
+# ---------- รูปแบบไฟล์ผลลัพธ์ที่ client เลือกได้ ----------
+# format → (นามสกุล, mimetype, พารามิเตอร์ของ cv2.imencode)
+IMAGE_FORMATS = {
+    "png":  (".png",  "image/png",  cv2.IMWRITE_PNG_COMPRESSION),
+    "jpeg": (".jpg",  "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "jpg":  (".jpg",  "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
 
 
 # ============================================================
 #  🔹 ส่วน Utilities (ฟังก์ชันช่วยเหลือ)
 # ============================================================
 
-def dataurl_to_pil(data_url: str) -> Image.Image:
-    """แปลง base64 DataURL จากหน้าเว็บให้เป็นภาพ PIL"""
+def dataurl_to_bytes(data_url: str) -> bytes:
+    """แปลง base64 DataURL (API แบบเดิม) ให้เป็นไบต์ของไฟล์ภาพ"""
     header, encoded = data_url.split(",", 1)
-    raw = base64.b64decode(encoded)
-    return Image.open(io.BytesIO(raw))
-
-def create_edge_map(img_np):
-    """สร้าง edge map ด้วย Canny edge detection"""
-    gray = cv2.cvtColor(img_np, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 100, 200)
-    edge_white = np.zeros_like(edges)
-    edge_white[edges > 0] = 255     # พื้นหลังขาว เส้นขอบดำ
-    return edge_white
-
-def save_patches_triplet(img_np, mask_np, edge_np,
-                         dir_img, dir_mask, dir_edge,
-                         prefix="patch", size=512, stride=256):
-    """
-    🔸 แบ่งภาพออกเป็น patch ย่อย (512x512) สำหรับการประมวลผล
-    - บันทึกภาพต้นฉบับ, mask และ edge เป็นชุด
-    - stride = ระยะเลื่อน patch (256 พิกเซล)
-    """
-    h, w = img_np.shape[:2]
-    os.makedirs(dir_img, exist_ok=True)
-    os.makedirs(dir_mask, exist_ok=True)
-    os.makedirs(dir_edge, exist_ok=True)
-    count = 0
-
-    for y in range(0, h, stride):
-        for x in range(0, w, stride):
-            img_patch  = img_np[y:y+size, x:x+size]
-            mask_patch = mask_np[y:y+size, x:x+size]
-            edge_patch = edge_np[y:y+size, x:x+size]
-
-            # ถ้า patch ขนาดไม่ครบ 512x512 → เติมขอบ (padding)
-            ph, pw = img_patch.shape[:2]
-            if ph < size or pw < size:
-                padded_img  = np.zeros((size, size, 3), dtype=img_np.dtype)
-                padded_mask = np.zeros((size, size), dtype=mask_np.dtype)
-                padded_edge = np.zeros((size, size), dtype=edge_np.dtype)
-                padded_img[:ph, :pw]  = img_patch
-                padded_mask[:ph, :pw] = mask_patch
-                padded_edge[:ph, :pw] = edge_patch
-                img_patch, mask_patch, edge_patch = padded_img, padded_mask, padded_edge
-
-            # บันทึก patch แต่ละชุด
-            cv2.imwrite(os.path.join(dir_img,  f"{prefix}_{count+1:03d}.png"), img_patch)
-            cv2.imwrite(os.path.join(dir_mask, f"{prefix}_{count+1:03d}.png"), mask_patch)
-            cv2.imwrite(os.path.join(dir_edge, f"{prefix}_{count+1:03d}.png"), edge_patch)
-            count += 1
-
-    return count, (h, w)
-
-def reassemble_patches_with_blending(patch_dir, full_size, size=512, stride=256):
-    """
-    🔸 รวม patch ที่ประมวลผลแล้วกลับมาเป็นภาพใหญ่
-    - ใช้การเฉลี่ยน้ำหนัก (blending) เพื่อลบรอยต่อระหว่าง patch
-    """
-    h, w = full_size
-    canvas = np.zeros((h, w, 3), dtype=np.float32)
-    weight = np.zeros((h, w, 3), dtype=np.float32)
-
-    patch_files = sorted(os.listdir(patch_dir))
-    idx = 0
-
-    for y in range(0, h, stride):
-        for x in range(0, w, stride):
-            if idx >= len(patch_files):
-                break
-            patch = cv2.imread(os.path.join(patch_dir, patch_files[idx]))
-            if patch is None:
-                idx += 1
-                continue
-            ph, pw = patch.shape[:2]
-            patch = patch[:min(ph, h-y), :min(pw, w-x)]
-            canvas[y:y+patch.shape[0], x:x+patch.shape[1]] += patch.astype(np.float32)
-            weight[y:y+patch.shape[0], x:x+patch.shape[1]] += 1.0
-            idx += 1
+    return base64.b64decode(encoded)
+
+def decode_image(raw) -> np.ndarray:
+    """ถอดรหัสไฟล์ภาพ (PNG/JPEG/WebP/...) จากไบต์เป็น numpy BGR โดยตรงด้วย OpenCV"""
+    img_bgr = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+    if img_bgr is None:
+        raise ValueError("cannot decode image")
+    return img_bgr
+
+def image_shape(raw):
+    """
+    🔸 ขนาดภาพ (h, w) จาก header ของไฟล์ ยังไม่ถอดรหัสพิกเซล (ใช้ตัดสินรับงานก่อน decode)
+    - EXIF orientation 5-8 (หมุน 90°) สลับกว้าง/สูง เหมือน cv2.imdecode ที่หมุนภาพให้
+    """
+    try:
+        with Image.open(io.BytesIO(raw)) as im:
+            w, h = im.size
+            # ใช้ EXIF ที่ open() อ่านไว้แล้ว (im.getexif() ของ PNG ถอดรหัสทั้งภาพ)
+            exif = Image.Exif()
+            if "exif" in im.info:
+                exif.load(im.info["exif"])
+            orientation = exif.get(0x0112, 1)
+    except OSError as e:
+        raise ValueError(f"cannot read image header: {e}")
+    return (w, h) if orientation in (5, 6, 7, 8) else (h, w)
+
+def encode_image(img_bgr, fmt="png", quality=None, compression=None):
+    """
+    🔸 เข้ารหัสผลลัพธ์ตามที่ client เลือก
+    - png: compression 0-9 (ยิ่งน้อยยิ่งเร็ว ไฟล์ใหญ่ขึ้น)
+    - jpeg / webp: quality 1-100 (webp > 100 = lossless)
+    คืนค่า (ไบต์, mimetype)
+    """
+    fmt = fmt.lower()
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"unsupported format: {fmt}")
+    ext, mimetype, flag = IMAGE_FORMATS[fmt]
+    value = compression if fmt == "png" else quality
+    params = [flag, int(value)] if value is not None else []
+    ok, buf = cv2.imencode(ext, img_bgr, params)
+    if not ok:
+        raise ValueError(f"cannot encode image as {fmt}")
+    return buf, mimetype
+
+def parse_boxes(rectangles):
+    """แปลงกรอบจากหน้าเว็บ {x, y, width, height} เป็น (x1, y1, x2, y2)"""
+    boxes = []
+    for r in rectangles:
+        x1, y1 = int(r["x"]), int(r["y"])
+        x2, y2 = x1 + int(r["width"]), y1 + int(r["height"])
+        boxes.append((x1, y1, x2, y2))
+    return boxes
+
+def estimate_cost(shape, boxes, image=True):
+    """
+    🔸 ต้นทุนโดยประมาณของงาน (หน่วยพิกเซล) ก่อนสร้าง mask จริง
+    - tile ที่ต้องรัน = tile ที่ทับกับกรอบใดกรอบหนึ่ง (mask อยู่ภายในกรอบเสมอ)
+    - image=False: ไม่นับภาพ (เช่น ภาพของ session ที่เก็บไว้อยู่แล้ว)
+    """
+    h, w = shape[:2]
+    tiles = sum(1 for y, x in tile_origins(h, w, PATCH_SIZE, PATCH_OVERLAP)
+                if any(x1 < x + PATCH_SIZE and x < x2 and y1 < y + PATCH_SIZE and y < y2
+                       for x1, y1, x2, y2 in boxes))
+    return (h * w if image else 0) + tiles * PATCH_SIZE * PATCH_SIZE
+
+def read_deadline():
+    """deadline ของงาน (time.time()) จาก query/form deadline=วินาที หรือ JOB_DEADLINE (None = ไม่จำกัด)"""
+    seconds = request.values.get("deadline", JOB_DEADLINE, type=float)
+    if seconds < 0:
+        raise ValueError("deadline must be >= 0 seconds")
+    return time.time() + seconds if seconds else None
+
+def overloaded_response(e):
+    """Overloaded → 429 + Retry-After (ลองใหม่ได้) หรือ 413 (งานใหญ่เกินความจุทั้งหมด)"""
+    body = {"success": False, "message": str(e)}
+    if e.retry_after is None:
+        return jsonify(body), 413
+    body["retry_after"] = e.retry_after
+    return jsonify(body), 429, {"Retry-After": str(e.retry_after)}
+
+def run_preview(job, img_bgr, mask_np, scale):
+    """
+    🔸 ขั้นแรกของงานที่ขอ preview: รันเฉพาะ InpaintCoarseNet บนภาพที่ย่อแล้ว
+    → เก็บไว้ใน job.preview และส่ง event "preview" ให้หน้าเว็บดึงไปแสดงก่อนผลเต็ม
+    """
+    start_time = time.time()
+    job.set_progress(25, "กำลังสร้างภาพตัวอย่าง...", stage="preview")
+    with metrics.stage("preview"):
+        preview_img, stats = preview_image(engine, img_bgr, mask_np, scale,
+                                           size=PATCH_SIZE, overlap=PATCH_OVERLAP, cache=tile_cache,
+                                           executor=tile_runner(), check=job.check)
+    job.preview = preview_img
+    elapsed = time.time() - start_time
+    print(f"[{job.id}] preview ใช้เวลา: {elapsed:.2f} วินาที")
+    job.emit("preview", {
+        "width": preview_img.shape[1],
+        "height": preview_img.shape[0],
+        "scale": scale,
+        "time": elapsed,
+        "tiles": stats["run"],
+    })
+
+def run_restoration(job, img_bgr, boxes, preview_scale=None):
+    """
+    🔸 ขั้นตอนหลักของระบบ (รันใน worker เบื้องหลัง):
+       1. สร้าง mask & edge
+       2. (ถ้าขอ preview) รัน coarse net บนภาพย่อ → job.preview
+       3. แบ่ง patch → ส่งเข้าโมเดล (coarse + refine)
+       4. รวมผลลัพธ์กลับ → เก็บไว้ใน job.result
+    """
+    start_time = time.time()     # เริ่มจับเวลา
+    job.set_progress(5, "เริ่มประมวลผลภาพ...", stage="decode")
+
+    # ----------- สร้าง mask จากกรอบที่ผู้ใช้เลือก -----------
+    with metrics.stage("mask"):
+        mask_np = multi_box_auto_mask(img_bgr, boxes)
+    job.set_progress(20, "สร้าง mask สำเร็จ", stage="mask")
 
-    weight[weight == 0] = 1
-    merged = (canvas / weight).astype(np.uint8)
-    return merged
+    # ----------- ภาพตัวอย่างแบบเร็ว (ถ้าขอไว้) -----------
+    if preview_scale is not None:
+        run_preview(job, img_bgr, mask_np, preview_scale)
 
-def clear_and_copy(src_dir, dst_dir):
+    # ----------- สร้าง edge map -----------
+    with metrics.stage("edge"):
+        edge_np = create_edge_map(img_bgr)
+    job.set_progress(40, "เตรียมข้อมูลให้โมเดล", stage="edge")
+
+    # ----------- แบ่ง patch → รันโมเดล → รวม patch กลับ (ในหน่วยความจำ) -----------
+    def on_tile(done, total):
+        job.set_progress(40 + 45 * done / total, f"ประมวลผลแพตช์ {done}/{total}",
+                         stage="tiles", done=done, total=total)
+
+    result_img, stats = restore_image(
+        engine, img_bgr, mask_np, edge_np,
+        size=PATCH_SIZE,
+        overlap=PATCH_OVERLAP,
+        progress=on_tile,
+        cache=tile_cache,
+        executor=tile_runner(),
+        check=job.check
+    )
+    job.set_progress(85, "โมเดลประมวลผลเสร็จ", stage="blend")
+
+    elapsed = time.time() - start_time
+    print(f"[{job.id}] ใช้เวลา: {elapsed:.2f} วินาที")
+
+    job.result = result_img
+    job.info = {
+        "time": elapsed,
+        "summary": f"Processed {stats['run']} of {stats['tiles']} patches "
+                   f"({stats['cached']} from cache) in {elapsed:.2f} seconds",
+    }
+
+def run_session(job, session, preview_scale=None):
+    """
+    🔸 งานของ session: คำนวณใหม่เฉพาะ tile ที่ mask เปลี่ยนจากรอบก่อน
+    tile อื่นใช้ผลลัพธ์เดิมที่เก็บไว้ใน session
     """
-    🔸 ลบโฟลเดอร์ปลายทางเก่า แล้วคัดลอกไฟล์จาก src → dst
-    ใช้ก่อนรันโมเดล เพื่อเคลียร์ input เดิมออก
+    start_time = time.time()
+    job.set_progress(5, "กำลังปรับ mask ตามกรอบที่แก้ไข...", stage="mask")
+
+    def on_tile(done, total):
+        job.set_progress(20 + 65 * done / total, f"ประมวลผลแพตช์ {done}/{total}",
+                         stage="tiles", done=done, total=total)
+
+    def on_mask(mask_np):
+        if preview_scale is not None:
+            run_preview(job, session.image, mask_np, preview_scale)
+
+    stats = session.restore(engine, size=PATCH_SIZE, overlap=PATCH_OVERLAP,
+                            progress=on_tile, on_mask=on_mask, cache=tile_cache, executor=tile_runner(),
+                            check=job.check)
+    job.set_progress(85, "โมเดลประมวลผลเสร็จ", stage="blend")
+
+    elapsed = time.time() - start_time
+    print(f"[{job.id}] session {session.id} ใช้เวลา: {elapsed:.2f} วินาที")
+
+    job.result = session.result
+    job.info = {
+        "time": elapsed,
+        "session_id": session.id,
+        "summary": f"Processed {stats['run']} of {stats['damaged']} damaged patches "
+                   f"({stats['reused']} reused) in {elapsed:.2f} seconds",
+    }
+
+def result_dataurl(result_img):
+    """แปลงผลลัพธ์ (BGR) เป็น PNG base64 DataURL (สำหรับ /process แบบเดิม)"""
+    with metrics.stage("encode"):
+        buf, _ = encode_image(result_img, "png")
+    return "data:image/png;base64," + base64.b64encode(buf).decode("utf-8")
+
+def read_upload():
     """
-    if os.path.exists(dst_dir):
-        shutil.rmtree(dst_dir)
-    os.makedirs(dst_dir, exist_ok=True)
-    for f in os.listdir(src_dir):
-        shutil.copy(os.path.join(src_dir, f), dst_dir)
+    🔸 อ่านภาพ + กรอบจาก request รองรับ 3 แบบ
+       1. multipart/form-data: ไฟล์ "image" + ฟิลด์ "rectangles" (JSON)
+       2. raw body (Content-Type: image/*): กรอบอยู่ใน query "rectangles" หรือ header X-Rectangles
+       3. JSON แบบเดิม: {"image": DataURL, "rectangles": [...]}
+    คืนค่า (ไบต์ของไฟล์ภาพ, รายการกรอบ)
+    """
+    if "image" in request.files:
+        raw = request.files["image"].read()
+        rectangles = json.loads(request.form.get("rectangles", "[]"))
+    elif request.mimetype.startswith("image/") or request.mimetype == "application/octet-stream":
+        raw = request.get_data(cache=False)
+        rectangles = json.loads(request.args.get("rectangles") or request.headers.get("X-Rectangles", "[]"))
+    else:
+        data = request.get_json()
+        raw = dataurl_to_bytes(data["image"])
+        rectangles = data["rectangles"]
+    return raw, rectangles
+
+def read_preview_scale():
+    """
+    🔸 ตัวเลือก preview จาก query/form: preview=1 และ preview_scale (0-1, ค่าเริ่มต้น PREVIEW_SCALE)
+    คืนค่า scale หรือ None ถ้าไม่ได้ขอ preview
+    """
+    if request.values.get("preview", "0").lower() in ("", "0", "false", "no"):
+        return None
+    scale = request.values.get("preview_scale", PREVIEW_SCALE, type=float)
+    if not 0 < scale <= 1:
+        raise ValueError("preview_scale must be in (0, 1]")
+    return scale
+
+def submit_from_request(allow_preview=True):
+    """
+    รับข้อมูลจาก Frontend → จองที่ในคิวจากขนาดใน header → ถอดรหัสเป็น numpy (BGR) → ส่งเข้าคิว
+    (เกินความจุ → Overloaded ก่อนถอดรหัสภาพ)
+    """
+    raw, rectangles = read_upload()
+    boxes = parse_boxes(rectangles)
+    preview_scale = read_preview_scale() if allow_preview else None
+    job = jobs.reserve(estimate_cost(image_shape(raw), boxes), read_deadline())
+    try:
+        with metrics.stage("decode"):
+            img_bgr = decode_image(raw)
+    except ValueError:
+        jobs.release(job)
+        raise
+    del raw
+    return jobs.start(job, run_restoration, img_bgr, boxes, preview_scale)
+
+def send_image(img_bgr):
+    """
+    🔸 ส่งภาพ (BGR) กลับเป็นไฟล์ไบนารีตาม query
+    - format=png|jpeg|webp, quality=1-100 (jpeg/webp), compression=0-9 (png)
+    """
+    fmt = request.args.get("format", "png").lower()
+    try:
+        with metrics.stage("encode"):
+            buf, mimetype = encode_image(img_bgr, fmt,
+                                         quality=request.args.get("quality", type=int),
+                                         compression=request.args.get("compression", type=int))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return send_file(io.BytesIO(buf), mimetype=mimetype, max_age=0,
+                     download_name="restored_mural" + IMAGE_FORMATS[fmt][0])
 
 
 # ============================================================
@@ -149,102 +420,266 @@ def index():
     return send_from_directory(app.static_folder, "home.html")
 
 
-@app.route("/process", methods=["POST"])
-def process():
+@app.route("/jobs", methods=["POST"])
+def create_job():
     """
-    🔸 ขั้นตอนหลักของระบบ:
-       1. รับภาพจากหน้าเว็บ (base64)
-       2. สร้าง mask & edge
-       3. แบ่ง patch → ส่งเข้าโมเดล
-       4. รวมผลลัพธ์กลับ → ส่งกลับไปหน้าเว็บ
+    ส่งงานฟื้นฟูภาพเข้าคิว แล้วคืน job id ทันที (ไม่บล็อก HTTP thread)
+    - preview=1: สร้างภาพตัวอย่างแบบเร็วก่อน (event "preview" → GET /jobs/<id>/preview) แล้วตามด้วยผลเต็ม
+    - deadline=วินาที: ยกเลิกงานถ้ายังไม่เสร็จภายในเวลานี้ (ค่าเริ่มต้น JOB_DEADLINE)
+    - เกินความจุ → 429 + Retry-After
     """
     try:
-        start_time = time.time()     # เริ่มจับเวลา
-        set_progress(0)
+        job = submit_from_request()
+    except Overloaded as e:
+        return overloaded_response(e)
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"success": False, "message": f"bad request: {e}"}), 400
+    return jsonify({"success": True, "job_id": job.id}), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET", "DELETE"])
+def job_status(job_id):
+    """
+    สถานะ/ความคืบหน้าของงาน หรือยกเลิกงาน (DELETE)
+    - งานที่รอคิวจบทันที (200), งานที่กำลังรันหยุดหลัง batch ของ tile ที่กำลังรัน (202)
+    - งานที่จบแล้ว → 409
+    """
+    if request.method == "DELETE":
+        job = jobs.cancel(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": "job not found"}), 404
+        if job.status in ("done", "error"):
+            return jsonify({"success": False, "message": "job already finished", **job.to_dict()}), 409
+        return jsonify({"success": True, **job.to_dict()}), 200 if job.status == "cancelled" else 202
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    🔸 Server-Sent Events: ส่ง event ความคืบหน้า (ทุกขั้นตอน/ทุก batch ของ tile) ทันทีที่เกิดขึ้น
+    - รองรับ Last-Event-ID เมื่อ EventSource เชื่อมต่อใหม่
+    - ปิด stream หลังส่ง event "done", "error" หรือ "cancelled"
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "job not found"}), 404
+    last_seq = int(request.headers.get("Last-Event-ID", 0) or 0)
+
+    def stream():
+        seq = last_seq
+        while True:
+            events = job.events_after(seq, timeout=SSE_KEEPALIVE)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for seq, kind, data in events:
+                yield f"id: {seq}\nevent: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                if kind in job.TERMINAL_EVENTS:
+                    return
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        # ----------- รับข้อมูลจาก Frontend -----------
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """
+    🔸 ผลลัพธ์ของงานที่เสร็จแล้วเป็นไฟล์ภาพไบนารี
+    - query: format=png|jpeg|webp, quality=1-100 (jpeg/webp), compression=0-9 (png)
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "job not found"}), 404
+    if job.status == "error":
+        return jsonify({"success": False, "message": job.error}), 500
+    if job.status == "cancelled":
+        return jsonify({"success": False, "message": job.error, **job.to_dict()}), 410
+    if job.status != "done":
+        return jsonify({"success": False, "message": "job not finished", **job.to_dict()}), 409
+    return send_image(job.result)
+
+
+@app.route("/jobs/<job_id>/preview", methods=["GET"])
+def job_preview(job_id):
+    """
+    🔸 ภาพตัวอย่างแบบเร็ว (coarse net บนภาพย่อ) พร้อมหลัง event "preview" ก่อนผลเต็ม
+    - query เหมือน /jobs/<id>/result
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "job not found"}), 404
+    if job.preview is None:
+        return jsonify({"success": False, "message": "preview not ready", **job.to_dict()}), 409
+    return send_image(job.preview)
+
+
+@app.route("/sessions", methods=["POST"])
+def create_session():
+    """
+    🔸 อัปโหลดภาพครั้งเดียว (รูปแบบเดียวกับ POST /jobs) → ได้ session id
+    - กรอบที่ส่งมาด้วย (ถ้ามี) ถูกเพิ่มเข้า session และส่งงานรอบแรกเข้าคิวทันที (คืน job_id)
+    - เกินความจุ → 429 + Retry-After (ไม่สร้าง session และไม่ถอดรหัสภาพ)
+    """
+    try:
+        raw, rectangles = read_upload()
+        boxes = parse_boxes(rectangles)
+        preview_scale = read_preview_scale()
+        deadline = read_deadline()
+        shape = image_shape(raw)
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"success": False, "message": f"bad request: {e}"}), 400
+    try:
+        job = jobs.reserve(estimate_cost(shape, boxes), deadline)
+    except Overloaded as e:
+        return overloaded_response(e)
+    try:
+        with metrics.stage("decode"):
+            img_bgr = decode_image(raw)
+    except ValueError as e:
+        jobs.release(job)
+        return jsonify({"success": False, "message": f"bad request: {e}"}), 400
+    del raw
+    session = sessions.create(img_bgr)
+    added = session.edit(add=boxes)
+    jobs.start(job, run_session, session, preview_scale)
+    return jsonify({"success": True, "job_id": job.id, "added": added, **session.to_dict()}), 201
+
+
+@app.route("/sessions/<session_id>", methods=["GET", "DELETE"])
+def session_info(session_id):
+    """ข้อมูล session (ขนาดภาพ + กรอบปัจจุบัน) หรือลบ session"""
+    if request.method == "DELETE":
+        if not sessions.delete(session_id):
+            return jsonify({"success": False, "message": "session not found"}), 404
+        return jsonify({"success": True})
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"success": False, "message": "session not found"}), 404
+    return jsonify({"success": True, **session.to_dict()})
+
+
+@app.route("/sessions/<session_id>/boxes", methods=["POST"])
+def edit_session(session_id):
+    """
+    🔸 ส่งเฉพาะการเปลี่ยนแปลงของกรอบ แล้วส่งงานเข้าคิว
+    - JSON: {"add": [{x, y, width, height}, ...], "remove": [box_id, ...]}
+    - คืน job_id (ผลลัพธ์ดึงจาก /jobs/<id>/result) และ id ของกรอบที่เพิ่ม (ใช้ลบภายหลัง)
+    - เกินความจุ → 429 + Retry-After (กรอบของ session ไม่เปลี่ยน)
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"success": False, "message": "session not found"}), 404
+    try:
         data = request.get_json()
-        image_dataurl = data["image"]
-        rectangles    = data["rectangles"]
-        set_progress(5, "เริ่มประมวลผลภาพ...")
-
-        # แปลง base64 → numpy array (BGR)
-        img_pil = dataurl_to_pil(image_dataurl).convert("RGB")
-        img_np  = np.array(img_pil)
-        img_bgr = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
-
-        # ----------- สร้าง mask จากกรอบที่ผู้ใช้เลือก -----------
-        boxes = []
-        for r in rectangles:
-            x1, y1 = int(r["x"]), int(r["y"])
-            x2, y2 = x1 + int(r["width"]), y1 + int(r["height"])
-            boxes.append((x1, y1, x2, y2))
-        mask_np = multi_box_auto_mask(img_bgr, boxes)
-        set_progress(20, "สร้าง mask สำเร็จ")
+        add = parse_boxes(data.get("add", []))
+        remove = [int(box_id) for box_id in data.get("remove", [])]
+        preview_scale = read_preview_scale()
+        deadline = read_deadline()
+        current = session.snapshot()
+        # tile ที่ต้องคำนวณใหม่อยู่รอบกรอบที่เพิ่มและกรอบที่ลบ
+        cost = estimate_cost(session.shape, add + [current[box_id] for box_id in remove if box_id in current],
+                             image=False)
+        job = jobs.reserve(cost, deadline)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return jsonify({"success": False, "message": f"bad request: {e}"}), 400
+    try:
+        added = session.edit(add=add, remove=remove)
+    except KeyError as e:
+        jobs.release(job)
+        return jsonify({"success": False, "message": f"bad request: {e}"}), 400
+    jobs.start(job, run_session, session, preview_scale)
+    return jsonify({"success": True, "job_id": job.id, "added": added, **session.to_dict()}), 202
 
-        # ----------- สร้าง edge map -----------
-        edge_np = create_edge_map(img_bgr)
 
-        # บันทึกไฟล์ชั่วคราว
-        cv2.imwrite(os.path.join(SAVE_DIR, "original.png"), img_bgr)
-        cv2.imwrite(os.path.join(SAVE_DIR, "mask.png"), mask_np)
-        cv2.imwrite(os.path.join(SAVE_DIR, "edge.png"), edge_np)
-
-        # ----------- แบ่งภาพออกเป็น patch -----------
-        n_patches, full_size = save_patches_triplet(
-            img_bgr, mask_np, edge_np,
-            os.path.join(SAVE_DIR, "patches_img"),
-            os.path.join(SAVE_DIR, "patches_mask"),
-            os.path.join(SAVE_DIR, "patches_edge"),
-            prefix="patch",
-            size=512,
-            stride=256
-        )
-        set_progress(40, f"แบ่งภาพเป็น {n_patches} แพตช์")
-
-        # ----------- คัดลอกไปโฟลเดอร์ของโมเดล -----------
-        clear_and_copy(os.path.join(SAVE_DIR, "patches_img"),  os.path.join(MODEL_TEST_DIR, "input"))
-        clear_and_copy(os.path.join(SAVE_DIR, "patches_mask"), os.path.join(MODEL_TEST_DIR, "mask"))
-        clear_and_copy(os.path.join(SAVE_DIR, "patches_edge"), os.path.join(MODEL_TEST_DIR, "edge"))
-        set_progress(60, "เตรียมข้อมูลให้โมเดล")
-
-        # ----------- รันโมเดล restoration/inpainting -----------
-        run_inference()
-        set_progress(85, "โมเดลประมวลผลเสร็จ")
-
-        # ----------- รวม patch กลับเป็นภาพเต็ม -----------
-        merged_dir = os.path.join(MODEL_TEST_DIR, "merged_output")
-        result_img = reassemble_patches_with_blending(merged_dir, full_size, size=512, stride=256)
-
-        # ----------- แปลงผลลัพธ์เป็น Base64 เพื่อนำไปแสดง -----------
-        _, buf = cv2.imencode(".png", result_img)
-        b64 = base64.b64encode(buf).decode("utf-8")
-        result_url = "data:image/png;base64," + b64
-
-        elapsed = time.time() - start_time
-        print(f"ใช้เวลา: {elapsed:.2f} วินาที")
-
-        set_progress(100, "เสร็จสิ้น")
-
-        # ส่งผลลัพธ์กลับเป็น JSON
-        return jsonify({
-            "success": True,
-            "message": f"Processed {n_patches} patches in {elapsed:.2f} seconds",
-            "time": elapsed,
-            "result": result_url
-        })
-
-    finally:
-        # ----------- ล้างไฟล์ชั่วคราวหลังทำงานเสร็จ -----------
-        reset_progress()
-        if os.path.exists(SAVE_DIR):
-            shutil.rmtree(SAVE_DIR)
-            os.makedirs(SAVE_DIR, exist_ok=True)
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """liveness: process ยังทำงานอยู่ (ไม่ขึ้นกับสถานะโมเดล)"""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    🔸 readiness: พร้อมรับงานเมื่อโหลดโมเดลแล้วและ warmup เสร็จ (ไม่พร้อม → 503)
+    """
+    runner = executor or engine
+    body = {
+        "model_loaded": engine.model is not None,
+        "warm": runner.warm,
+        "warmup_time": runner.warmup_time,
+        "tile_workers": TILE_WORKERS,
+        "queue_depth": jobs.count("queued"),
+        "admitted_cost": jobs.active_cost(),
+        "retained_result_bytes": jobs.retained_bytes(),
+    }
+    if warmup_error is not None:
+        return jsonify({"status": "error", "error": warmup_error, **body}), 503
+    if engine.model is None or (WARMUP and not runner.warm):
+        return jsonify({"status": "warming", **body}), 503
+    return jsonify({"status": "ready", **body})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    🔸 ค่าวัดของระบบในรูปแบบ Prometheus text format
+    - mural_stage_seconds{stage=decode|mask|edge|preview|tiling|blend|encode}, mural_forward_seconds_per_tile
+    - ตัวนับ tile (ประมวลผล/ข้าม/ใช้ซ้ำ/cache) และเกจ (คิว, หน่วยความจำโมเดล, cache)
+    """
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/process", methods=["POST"])
+def process():
+    """
+    🔸 API แบบเดิม (synchronous): ส่งงานเข้าคิวเดียวกันแล้วรอจนเสร็จ
+    - เกินความจุ → 429 + Retry-After, เลย deadline → 504
+    """
+    try:
+        job = submit_from_request(allow_preview=False)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"success": False, "message": f"bad request: {e}"}), 400
+    job.wait()
+    # ผลลัพธ์ส่งกลับใน response นี้แล้ว ไม่มีใครดึงซ้ำ → ไม่เก็บไว้ใน jobs
+    jobs.discard(job)
+    if job.status == "cancelled":
+        return jsonify({"success": False, "message": job.error}), 504 if job.cancelled == "deadline" else 409
+    if job.status != "done":
+        return jsonify({"success": False, "message": job.error}), 500
+    return jsonify({
+        "success": True,
+        "message": job.info["summary"],
+        "time": job.info["time"],
+        "result": result_dataurl(job.result)
+    })
 
 
 # ============================================================
 #  🔹 ส่วนรันเซิร์ฟเวอร์ Flask
 # ============================================================
 
+def start_background():
+    """fork tile worker (ถ้าตั้ง TILE_WORKERS) แล้วเริ่ม warmup (ถ้าเปิด) ก่อนรับ request แรก"""
+    if TILE_WORKERS > 0:
+        start_executor()
+    if WARMUP:
+        start_warmup()
+
+# เริ่มตอน import เพื่อให้ /readyz พร้อมได้ไม่ว่าจะรันแบบไหน (python app.py, flask run, WSGI server)
+# ยกเว้น serve.py (ตั้ง MURAL_PREFORK=1) ที่ warmup ใน master เองแล้วค่อย fork worker:
+# ต้องไม่มี thread อื่นเริ่มก่อน fork
+if os.environ.get("MURAL_PREFORK") != "1":
+    start_background()
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    # เซิร์ฟเวอร์สำหรับพัฒนา (process เดียว) ใช้งานจริงให้รัน serve.py (pre-fork หลาย worker)
+    # ปิด reloader เพื่อไม่ให้โหลดโมเดลซ้ำสองรอบ (process แม่ + process ลูก)
+    app.run(debug=True, use_reloader=False)
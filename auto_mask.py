@@ -2,26 +2,27 @@ import cv2
 import numpy as np
 import os
 
+GRABCUT_MAX_AREA = 150 * 150   # กรอบที่พื้นที่ไม่เกินนี้ใช้ GrabCut ที่ใหญ่กว่าใช้ threshold
+
 # ============================================================
 # Utility: Connected Components Filter
 # ============================================================
 def _cc_filter(mask, min_area=0, keep_small=True): 
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8) 
-    keep = np.zeros_like(mask)
+    if keep_small:  # เก็บทุกวัตถุ → ผลคือทุก pixel ที่ไม่ใช่ 0 ไม่ต้องแยกวัตถุ
+        return np.where(mask > 0, 255, 0).astype(np.uint8)
 
-    for i in range(1, num_labels):  # ข้าม background (label 0)
-        area = stats[i, cv2.CC_STAT_AREA]
-        if area >= min_area:
-            keep[labels == i] = 255
-        elif keep_small:  # ถ้าเลือกเก็บจุดเล็กด้วย
-            keep[labels == i] = 255
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8) 
 
-    return keep
+    # ตัดสินทีละวัตถุจาก stats แล้วเติมทั้งภาพด้วยการ index ตาราง (lut) ครั้งเดียว
+    lut = np.where(stats[:, cv2.CC_STAT_AREA] >= min_area, 255, 0).astype(np.uint8)
+    lut[0] = 0  # background (label 0)
+    return lut[labels]
 #ฟังก์ชั่นนี้ทำหน้าที่กรองส่วนที่เล็กๆ ด้วย Connected Components
 #แยกแต่ละวัตถุที่เชื่อมกันในmask ออกมา
 #num_labals จำนวนวัตถุทั้งหมด รวม background
 #labels แผนที่ของ pixel 
 #stats เก็บข้อมูลแต่ละวัตถุ
+#lut[i] = ค่าของวัตถุ i ในผลลัพธ์ (255 = เก็บ, 0 = ตัดทิ้ง)
 
 # ============================================================
 # Method 1: Threshold-based Masking (เร็วมาก)
@@ -60,10 +61,14 @@ def box_to_mask_threshold(img, box, min_area=40):
 # ============================================================
 # Method 2: GrabCut-based Masking (ละเอียดแต่ช้ากว่า)
 # ============================================================
-def box_to_mask_grabcut_full(img, box, iters=2, min_area=40):
+def box_to_mask_grabcut_full(img, box, iters=2, min_area=40, margin=None):
     """
     ใช้ GrabCut สำหรับสร้าง mask แบบละเอียด โดยเหมาะกับพื้นที่เล็ก
     ถ้าเกิด error (พื้นที่แคบเกิน) จะ fallback ไปใช้ threshold แทน
+    - margin: ตัดภาพเหลือกรอบ + margin (pixel) ก่อนรัน GrabCut (เร็วขึ้นมากบนภาพใหญ่)
+      None = ใช้ทั้งภาพ (ค่าเริ่มต้น) เพราะโมเดลสีของ background และน้ำหนักความต่อเนื่อง
+      ของ GrabCut คิดจากทั้งภาพ crop ที่เล็กจึงให้ mask ต่างออกไป (บางกรอบว่างทั้งกรอบ)
+      ตรวจความต่างได้ด้วย python scripts/mask_check.py grabcut --margin N
     """
     h, w = img.shape[:2]
     x1, y1, x2, y2 = map(int, box)
@@ -73,29 +78,38 @@ def box_to_mask_grabcut_full(img, box, iters=2, min_area=40):
     if x2 - x1 < 2 or y2 - y1 < 2:#กว้างสูง น้อยกว่า 2 pixel ไม่ประมวลผล
         return np.zeros((h, w), np.uint8)
 
-    mask = np.zeros((h, w), np.uint8)
-    rect = (x1, y1, x2 - x1, y2 - y1) #พิกัดกรอบ
+    # บริเวณที่ GrabCut ใช้ (pixel นอกกรอบในบริเวณนี้เป็นตัวอย่าง background)
+    if margin is None:
+        cx1, cy1, cx2, cy2 = 0, 0, w, h
+    else:
+        cx1, cy1 = max(0, x1 - margin), max(0, y1 - margin)
+        cx2, cy2 = min(w, x2 + margin), min(h, y2 + margin)
+    crop = img[cy1:cy2, cx1:cx2]
+
+    mask = np.zeros(crop.shape[:2], np.uint8)
+    rect = (x1 - cx1, y1 - cy1, x2 - x1, y2 - y1) #พิกัดกรอบใน crop
     bgdModel = np.zeros((1, 65), np.float64) #พื้นหลัง
     fgdModel = np.zeros((1, 65), np.float64) #วัตถุ
 
     try:
         # GrabCut algorithm (iterative refinement)
-        cv2.grabCut(img, mask, rect, bgdModel, fgdModel, iters, cv2.GC_INIT_WITH_RECT)
+        cv2.grabCut(crop, mask, rect, bgdModel, fgdModel, iters, cv2.GC_INIT_WITH_RECT)
     except cv2.error:
         # ถ้า error (เช่น พื้นที่แคบมาก) → ใช้ threshold method แทน
         return box_to_mask_threshold(img, box, min_area=min_area)
 
     # เก็บเฉพาะ pixel ที่เป็น foreground หรือ foreground ที่ยังไม่แน่ใจ
+    # และจำกัด mask ให้อยู่ในกรอบที่เลือกเท่านั้น (นอกกรอบ GrabCut ตั้งเป็น background อยู่แล้ว)
+    mask = mask[y1 - cy1:y2 - cy1, x1 - cx1:x2 - cx1]
     out = np.where((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
 
-    # กรอง noise ออก
+    # กรอง noise ออก (เฉพาะในกรอบ ไม่ต้องทำทั้งภาพ)
     out = _cc_filter(out, min_area=min_area)
 
-    # จำกัด mask ให้อยู่ในกรอบที่เลือกเท่านั้น
-    roi = np.zeros((h, w), np.uint8)
-    roi[y1:y2, x1:x2] = 255
-    out = cv2.bitwise_and(out, roi)
-    return out
+    # รวม mask กลับไปในขนาดเต็มภาพ
+    full = np.zeros((h, w), np.uint8)
+    full[y1:y2, x1:x2] = out
+    return full
 
 
 # ============================================================
@@ -117,6 +131,24 @@ def soften_and_expand_mask(mask, dilate_size=7, blur_size=11):
     return mask
 
 
+# ============================================================
+# Single box: เลือกวิธีตามขนาดกรอบ
+# ============================================================
+def box_to_mask(img, box):
+    """
+    สร้าง mask ดิบ (ยังไม่ soften) ของกรอบเดียว ขนาดเต็มภาพ
+    - พื้นที่ใหญ่ → ใช้วิธี Threshold (เร็ว)
+    - พื้นที่เล็ก → ใช้ GrabCut (ละเอียด)
+    """
+    x1, y1, x2, y2 = box
+    area = abs((x2 - x1) * (y2 - y1))
+
+    if area > GRABCUT_MAX_AREA:   # ถ้าพื้นที่ใหญ่ → ใช้ threshold (เร็วกว่า)
+        return box_to_mask_threshold(img, (x1, y1, x2, y2), min_area=10)
+    else:                  # ถ้าพื้นที่เล็ก → ใช้ grabcut (แม่นกว่า)
+        return box_to_mask_grabcut_full(img, (x1, y1, x2, y2), iters=2, min_area=5)
+
+
 # ============================================================
 # Main: Fast Multi-box Auto Mask
 # ============================================================
@@ -131,17 +163,9 @@ def fast_multi_box_auto_mask(img, boxes):
     h, w = img.shape[:2]
     final_mask = np.zeros((h, w), np.uint8)
 
-    for (x1, y1, x2, y2) in boxes:
-        area = abs((x2 - x1) * (y2 - y1))
-
-        # เลือกวิธีตามขนาดกรอบ
-        if area > 150 * 150:   # ถ้าพื้นที่ใหญ่ → ใช้ threshold (เร็วกว่า)
-            local = box_to_mask_threshold(img, (x1, y1, x2, y2), min_area=10)
-        else:                  # ถ้าพื้นที่เล็ก → ใช้ grabcut (แม่นกว่า)
-            local = box_to_mask_grabcut_full(img, (x1, y1, x2, y2), iters=2, min_area=5)
-
+    for box in boxes:
         # รวม mask ของแต่ละกล่องเข้าด้วยกัน
-        final_mask = cv2.bitwise_or(final_mask, local)
+        final_mask = cv2.bitwise_or(final_mask, box_to_mask(img, box))
 
     # ปรับขอบ mask ให้เนียน
     final_mask = soften_and_expand_mask(final_mask, dilate_size=7, blur_size=11)
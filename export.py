@@ -0,0 +1,97 @@
+# ============================================================
+#  Thai Mural Restoration System - Export Inference Checkpoint
+#  🟡 Function: แปลง checkpoint สำหรับเทรน (InpaintingModel_gen.pth) เป็นไฟล์
+#  สำหรับใช้งานจริง (InpaintingModel_gen_infer.pth): มีเฉพาะ generator,
+#  ชื่อ key ไม่มี "module." แล้ว, เลือกเก็บเป็น fp16/bf16 ได้ และโหลดแบบ mmap ได้
+#
+#  และ (--frozen) กราฟ generator ที่ trace + freeze แล้วสำหรับขนาด tile/batch คงที่
+#
+#  ใช้งาน:
+#    python export.py --path ./checkpoints                 # float32 (zero-copy ตอนโหลดบน CPU)
+#    python export.py --path ./checkpoints --dtype float16 # ไฟล์เล็กลงครึ่งหนึ่ง (upcast ตอนโหลด)
+#    python export.py --path ./checkpoints --frozen --batch-sizes 1 4
+# ============================================================
+
+import os
+import time
+import argparse
+
+import torch
+
+from src.models import STORAGE_DTYPES, export_inference_checkpoint
+
+
+def export_frozen(args):
+    """
+    🔸 export กราฟ generator แบบ frozen (TorchScript) จากน้ำหนักที่ engine โหลดอยู่
+    - หนึ่งไฟล์ต่อ (batch size, โหมด full/coarse) ใช้ได้เฉพาะ input ขนาดนั้นพอดี
+    - เทียบเวลากับโหมด eager และความต่างของผลลัพธ์
+    """
+    from src.engine import InferenceEngine
+
+    engine = InferenceEngine(os.path.join(args.path, "config.yml"))
+    paths = engine.export_frozen(args.batch_sizes, args.tile_size)
+    graphs = engine._load_frozen()      # เทียบกับกราฟที่เพิ่ง export แม้ FROZEN_GRAPH จะปิดอยู่
+
+    for n in args.batch_sizes:
+        images = torch.rand(n, 3, args.tile_size, args.tile_size)
+        edges = torch.rand(n, 1, args.tile_size, args.tile_size)
+        masks = (torch.rand(n, 1, args.tile_size, args.tile_size) > 0.5).float()
+        for coarse in (False, True):
+            timings = {}
+            outputs = {}
+            for label, frozen in (("eager", {}), ("frozen", graphs)):
+                saved, engine.frozen = engine.frozen, frozen
+                engine.inpaint(images, edges, masks, coarse)   # รอบแรกไม่นับเวลา
+                start = time.time()
+                outputs[label] = engine.inpaint(images, edges, masks, coarse)
+                timings[label] = time.time() - start
+                engine.frozen = saved
+            diff = (outputs["eager"] - outputs["frozen"]).abs().max().item()
+            print("  batch %d %-6s eager %.3fs -> frozen %.3fs (max diff %.2e)" % (
+                n, "coarse" if coarse else "full", timings["eager"], timings["frozen"], diff))
+    for path in paths:
+        print("wrote " + path)
+    if not engine.config.FROZEN_GRAPH:
+        print("FROZEN_GRAPH is 0 in config.yml: set it to 1 to serve these graphs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="export a generator-only inference checkpoint")
+    parser.add_argument("--path", "--checkpoints", default="./checkpoints",
+                        help="checkpoints folder containing InpaintingModel_gen.pth")
+    parser.add_argument("--name", default="InpaintingModel", help="model name (checkpoint prefix)")
+    parser.add_argument("--dtype", default="float32", choices=list(STORAGE_DTYPES),
+                        help="storage dtype of floating point weights")
+    parser.add_argument("--output", help="output file (default: <path>/<name>_gen_infer.pth)")
+    parser.add_argument("--frozen", action="store_true",
+                        help="export frozen TorchScript generator graphs instead of a checkpoint")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1],
+                        help="batch sizes to freeze (with --frozen)")
+    parser.add_argument("--tile-size", type=int, default=512, help="tile size to freeze (with --frozen)")
+    args = parser.parse_args()
+
+    if args.frozen:
+        return export_frozen(args)
+
+    src_path = os.path.join(args.path, args.name + "_gen.pth")
+    dst_path = args.output or os.path.join(args.path, args.name + "_gen_infer.pth")
+    if not os.path.exists(src_path):
+        raise SystemExit("checkpoint not found: " + src_path)
+
+    export_inference_checkpoint(src_path, dst_path, args.dtype)
+
+    # ----------- เทียบขนาดไฟล์และเวลาโหลด -----------
+    def load_time(path, **kwargs):
+        start = time.time()
+        torch.load(path, map_location="cpu", **kwargs)
+        return time.time() - start
+
+    print("wrote %s (%s)" % (dst_path, args.dtype))
+    print("  size: %.1f MB -> %.1f MB" % (os.path.getsize(src_path) / 1e6, os.path.getsize(dst_path) / 1e6))
+    print("  torch.load: %.3fs -> %.3fs (mmap)" % (load_time(src_path),
+                                                 load_time(dst_path, mmap=True, weights_only=True)))
+
+
+if __name__ == "__main__":
+    main()
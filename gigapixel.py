@@ -0,0 +1,297 @@
+# ============================================================
+#  Thai Mural Restoration System - Gigapixel Streaming Restoration
+#  🟡 Function: ฟื้นฟูภาพสแกนผนังขนาดใหญ่มาก (ใหญ่กว่า RAM) โดย
+#  อ่านภาพต้นฉบับทีละหน้าต่าง (TIFF/npy แบบ memory-map) → สร้าง mask/edge เฉพาะส่วน →
+#  รันโมเดลทีละ batch → สะสมผลลงใน canvas บนดิสก์ (np.memmap) →
+#  เขียนผลลัพธ์เป็น tiled pyramidal TIFF
+#
+#  ตัวอย่าง:
+#    python gigapixel.py --input wall.tif --boxes boxes.json --output restored.tif
+#  boxes.json = [[x1, y1, x2, y2], ...] หรือ [{"x", "y", "width", "height"}, ...] แบบหน้าเว็บ
+# ============================================================
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import cv2
+from auto_mask import GRABCUT_MAX_AREA, box_to_mask, soften_and_expand_mask
+from tiling import create_edge_map, tile_origins, tiles_region, TileBlender
+
+MASK_CONTEXT = 64       # พิกเซลรอบกรอบที่ mask อาจไม่เป็นศูนย์หลัง dilate/blur (ใช้เลือก tile)
+SOFTEN_CONTEXT = 16     # พิกเซลที่อ่านเพิ่มรอบบริเวณตอน soften (dilate 7 + blur 11 มองไกลสุด 8 px)
+GRABCUT_CONTEXT = 1024  # พิกเซลรอบกรอบเล็กที่ GrabCut ใช้เป็นตัวอย่าง background
+EDGE_CONTEXT = 16       # พิกเซลรอบ tile ที่อ่านเพิ่มตอนทำ Canny เพื่อไม่ให้เกิดเส้นขอบปลอมที่ขอบ tile
+
+
+# ============================================================
+#  🔹 อ่านภาพต้นฉบับแบบไม่โหลดทั้งภาพ
+# ============================================================
+
+class ImageSource:
+    """
+    🔸 ภาพต้นฉบับที่อ่านได้ทีละหน้าต่าง
+    - .tif/.tiff ที่ไม่บีบอัด → tifffile.memmap (zero-copy)
+    - .tif/.tiff ที่บีบอัดหรือเป็น tile → tifffile + zarr (ถ้าติดตั้ง zarr)
+    - .npy → np.load(mmap_mode="r")
+    - ไฟล์อื่น (png/jpg) → cv2.imread ทั้งภาพ (ไม่ประหยัดหน่วยความจำ)
+    ภาพ TIFF/npy ถือว่าเป็น RGB ส่วน read() คืนค่าเป็น BGR เสมอ
+    """
+    def __init__(self, path):
+        self.path = path
+        ext = os.path.splitext(path)[1].lower()
+        self.bgr = False
+        if ext in (".tif", ".tiff"):
+            self.data = self._open_tiff(path)
+        elif ext == ".npy":
+            self.data = np.load(path, mmap_mode="r")
+        else:
+            self.data = cv2.imread(path, cv2.IMREAD_COLOR)
+            if self.data is None:
+                raise ValueError(f"cannot read image: {path}")
+            self.bgr = True
+        self.h, self.w = self.data.shape[:2]
+
+    @staticmethod
+    def _open_tiff(path):
+        import tifffile
+        try:
+            return tifffile.memmap(path, mode="r")
+        except ValueError:
+            pass
+        try:
+            import zarr
+        except ImportError:
+            raise ValueError(f"{path} is compressed or not memory-mappable; "
+                             "install zarr or convert it to an uncompressed TIFF")
+        return zarr.open(tifffile.imread(path, aszarr=True, level=0), mode="r")
+
+    def read(self, y0, y1, x0, x1):
+        """อ่านหน้าต่าง [y0:y1, x0:x1] เป็น BGR uint8 (ตัดให้อยู่ในภาพ)"""
+        y0, x0 = max(0, y0), max(0, x0)
+        y1, x1 = min(self.h, y1), min(self.w, x1)
+        win = np.asarray(self.data[y0:y1, x0:x1])
+        if win.ndim == 2:
+            return cv2.cvtColor(win, cv2.COLOR_GRAY2BGR)
+        win = win[..., :3]
+        if self.bgr:
+            return np.ascontiguousarray(win)
+        return cv2.cvtColor(win, cv2.COLOR_RGB2BGR)
+
+
+# ============================================================
+#  🔹 mask / edge แบบทีละส่วน
+# ============================================================
+
+def build_mask(source, boxes, path, grabcut_context=GRABCUT_CONTEXT):
+    """
+    🔸 สร้าง mask ทั้งภาพเป็น np.memmap บนดิสก์ (1 ไบต์/พิกเซล) ให้ตรงกับ multi_box_auto_mask
+       1. mask ดิบของแต่ละกรอบด้วย box_to_mask เดิม อ่านภาพเฉพาะหน้าต่างรอบกรอบ
+          - กรอบเล็ก (GrabCut) ใช้หน้าต่าง กรอบ + grabcut_context เพราะโมเดลสี background
+            ของ GrabCut คิดจากทั้งหน้าต่าง หน้าต่างแคบ (64 px) ได้ mask ว่างบางกรอบ
+            ภาพที่เล็กกว่าหน้าต่างจึงได้ผลเท่ากับทั้งภาพทุกพิกเซล
+          - กรอบใหญ่ (threshold) ใช้เฉพาะพิกเซลในกรอบ
+       2. soften ทีละบริเวณ (กรอบ + MASK_CONTEXT) จาก mask ดิบที่รวมทุกกรอบแล้ว
+          อ่านเผื่อ SOFTEN_CONTEXT ให้ dilate/blur เห็นพิกเซลข้างเคียงเหมือนทำทั้งภาพ
+    ตรวจกับ multi_box_auto_mask ได้ด้วย python scripts/mask_check.py gigapixel
+    คืนค่า (mask, รายการกรอบของบริเวณที่ mask อาจไม่เป็นศูนย์)
+    """
+    h, w = source.h, source.w
+    raw = np.memmap(path + ".raw", dtype=np.uint8, mode="w+", shape=(h, w))
+    regions = []
+    for (x1, y1, x2, y2) in boxes:
+        x1, x2 = sorted([int(x1), int(x2)]); y1, y2 = sorted([int(y1), int(y2)])
+        cy0, cx0 = max(0, y1 - MASK_CONTEXT), max(0, x1 - MASK_CONTEXT)
+        cy1, cx1 = min(h, y2 + MASK_CONTEXT), min(w, x2 + MASK_CONTEXT)
+        if cy1 <= cy0 or cx1 <= cx0:
+            continue
+        pad = grabcut_context if (x2 - x1) * (y2 - y1) <= GRABCUT_MAX_AREA else 0
+        wy0, wx0 = max(0, y1 - pad), max(0, x1 - pad)
+        wy1, wx1 = min(h, y2 + pad), min(w, x2 + pad)
+        if wy1 > wy0 and wx1 > wx0:
+            local = box_to_mask(source.read(wy0, wy1, wx0, wx1), (x1 - wx0, y1 - wy0, x2 - wx0, y2 - wy0))
+            np.bitwise_or(raw[wy0:wy1, wx0:wx1], local, out=raw[wy0:wy1, wx0:wx1])
+        regions.append((cy0, cx0, cy1, cx1))
+
+    mask = np.memmap(path, dtype=np.uint8, mode="w+", shape=(h, w))
+    for cy0, cx0, cy1, cx1 in regions:
+        py0, px0 = max(0, cy0 - SOFTEN_CONTEXT), max(0, cx0 - SOFTEN_CONTEXT)
+        py1, px1 = min(h, cy1 + SOFTEN_CONTEXT), min(w, cx1 + SOFTEN_CONTEXT)
+        soft = soften_and_expand_mask(np.asarray(raw[py0:py1, px0:px1]), dilate_size=7, blur_size=11)
+        mask[cy0:cy1, cx0:cx1] = soft[cy0 - py0:cy1 - py0, cx0 - px0:cx1 - px0]
+    del raw
+    os.remove(path + ".raw")
+    return mask, regions
+
+def read_edge(source, y, x, size):
+    """Canny edge ของ tile ที่ (y, x) โดยอ่านขอบเผื่อ EDGE_CONTEXT พิกเซล (เติมศูนย์ถ้าเกินภาพ)"""
+    y0, x0 = max(0, y - EDGE_CONTEXT), max(0, x - EDGE_CONTEXT)
+    win = source.read(y0, y + size + EDGE_CONTEXT, x0, x + size + EDGE_CONTEXT)
+    edge = create_edge_map(win)[y - y0:y - y0 + size, x - x0:x - x0 + size]
+    return _pad(edge, size)
+
+def _pad(patch, h, w=None):
+    """เติมศูนย์ให้ patch มีขนาด h x w (w = h ถ้าไม่ระบุ)"""
+    w = h if w is None else w
+    ph, pw = patch.shape[:2]
+    if ph == h and pw == w:
+        return patch
+    padded = np.zeros((h, w) + patch.shape[2:], dtype=patch.dtype)
+    padded[:ph, :pw] = patch
+    return padded
+
+def select_tiles(mask, regions, origins, size):
+    """เลือกเฉพาะ tile ที่ทับกรอบของ mask และมีพิกเซลเสียหายจริง (อ่าน mask ทีละ tile)"""
+    selected = []
+    for y, x in origins:
+        hit = any(y < ry1 and y + size > ry0 and x < rx1 and x + size > rx0
+                  for ry0, rx0, ry1, rx1 in regions)
+        if hit and mask[y:y+size, x:x+size].any():
+            selected.append((y, x))
+    return selected
+
+
+# ============================================================
+#  🔹 เขียนผลลัพธ์เป็น tiled pyramidal TIFF
+# ============================================================
+
+def _tiles_rgb(arr, tile):
+    """อ่าน array (BGR) ทีละ tile ตามลำดับแถว → RGB ขนาด tile เต็ม (เติมศูนย์ที่ขอบ)"""
+    th, tw = tile
+    for y in range(0, arr.shape[0], th):
+        for x in range(0, arr.shape[1], tw):
+            yield _pad(np.ascontiguousarray(arr[y:y+th, x:x+tw, ::-1]), th, tw)
+
+def _downsample(src, path, band=1024):
+    """ย่อภาพลงครึ่งหนึ่งทีละแถบ (INTER_AREA) เก็บเป็น memmap ระดับถัดไปของ pyramid"""
+    h, w = max(1, src.shape[0] // 2), max(1, src.shape[1] // 2)
+    dst = np.memmap(path, dtype=np.uint8, mode="w+", shape=(h, w, 3))
+    for top in range(0, h, band // 2):
+        bottom = min(h, top + band // 2)
+        dst[top:bottom] = cv2.resize(np.asarray(src[top * 2:bottom * 2]), (w, bottom - top), interpolation=cv2.INTER_AREA)
+    return dst
+
+def write_pyramid_tiff(out_path, image, workdir, levels=4, tile=(256, 256), compression="zlib"):
+    """
+    🔸 เขียน image (BGR memmap) เป็น BigTIFF แบบ tile + pyramid (SubIFDs)
+    - แต่ละระดับเล็กลงครึ่งหนึ่ง อ่าน/เขียนทีละ tile ไม่โหลดทั้งภาพ
+    """
+    import tifffile
+    pyramid = [image]
+    for level in range(1, levels):
+        if min(pyramid[-1].shape[:2]) < 2 * tile[0]:
+            break
+        pyramid.append(_downsample(pyramid[-1], os.path.join(workdir, f"level{level}.u8")))
+
+    with tifffile.TiffWriter(out_path, bigtiff=True) as tif:
+        for level, arr in enumerate(pyramid):
+            tif.write(_tiles_rgb(arr, tile), shape=arr.shape, dtype=np.uint8, tile=tile,
+                      photometric="rgb", compression=compression,
+                      subifds=len(pyramid) - 1 if level == 0 else None,
+                      subfiletype=1 if level > 0 else 0)
+
+
+# ============================================================
+#  🔹 Pipeline หลัก
+# ============================================================
+
+def restore_large(engine, src_path, boxes, out_path, size=512, overlap=64, batch_size=None,
+                  workdir=None, levels=4, progress=None, grabcut_context=GRABCUT_CONTEXT):
+    """
+    🔸 ฟื้นฟูภาพขนาดใหญ่แบบ streaming
+       1. สร้าง mask เป็น memmap จากกรอบ (อ่านภาพเฉพาะรอบกรอบ)
+       2. เลือก tile ที่มีบริเวณเสียหาย → อ่าน img/edge ทีละ tile → รันโมเดลทีละ batch
+       3. สะสมผลใน canvas/weight แบบ np.memmap บนดิสก์ (เฉพาะกรอบของ tile ที่ประมวลผล)
+       4. คัดลอกภาพต้นฉบับลง memmap ผลลัพธ์ทีละแถบ → วางพิกเซลที่ฟื้นฟูแล้ว → เขียน TIFF
+    หน่วยความจำสูงสุดขึ้นกับขนาด tile/batch และแถบที่อ่าน ไม่ขึ้นกับขนาดภาพ
+    - grabcut_context: พิกเซลรอบกรอบเล็กที่ GrabCut ใช้ (ดู build_mask)
+    คืนค่า stats = {"tiles", "run", "skipped"}
+    """
+    source = ImageSource(src_path)
+    h, w = source.h, source.w
+    tmp = tempfile.mkdtemp(prefix="muralnet_", dir=workdir)
+    try:
+        mask, regions = build_mask(source, boxes, os.path.join(tmp, "mask.u8"), grabcut_context)
+        all_origins = tile_origins(h, w, size, overlap)
+        origins = select_tiles(mask, regions, all_origins, size)
+        stats = {"tiles": len(all_origins), "run": len(origins), "skipped": len(all_origins) - len(origins)}
+
+        # ----------- ภาพผลลัพธ์ = สำเนาต้นฉบับบนดิสก์ (คัดลอกทีละแถบ) -----------
+        result = np.memmap(os.path.join(tmp, "result.u8"), dtype=np.uint8, mode="w+", shape=(h, w, 3))
+        for top in range(0, h, size):
+            result[top:top + size] = source.read(top, top + size, 0, w)
+
+        if origins:
+            region = tiles_region(origins, (h, w), size)
+            rh, rw = region[2] - region[0], region[3] - region[1]
+            canvas = np.memmap(os.path.join(tmp, "canvas.f32"), dtype=np.float32, mode="w+", shape=(rh, rw, 3))
+            weight = np.memmap(os.path.join(tmp, "weight.f32"), dtype=np.float32, mode="w+", shape=(rh, rw))
+            blender = TileBlender(region, size, overlap, canvas=canvas, weight=weight)
+
+            engine.reload_if_changed()
+            if batch_size is None:
+                batch_size = engine.batch_size(size)
+            for start in range(0, len(origins), batch_size):
+                batch = origins[start:start + batch_size]
+                outputs = engine.inpaint_tiles([_pad(source.read(y, y + size, x, x + size), size) for y, x in batch],
+                                               [_pad(np.asarray(mask[y:y+size, x:x+size]), size) for y, x in batch],
+                                               [read_edge(source, y, x, size) for y, x in batch])
+                for out, (y, x) in zip(outputs, batch):
+                    blender.add(out, y, x)
+                if progress is not None:
+                    progress(start + len(batch), len(origins))
+
+            blender.paste_into(result, mask)
+            del blender, canvas, weight
+
+        write_pyramid_tiff(out_path, result, tmp, levels=levels)
+        del result, mask
+        return stats
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_boxes(path):
+    """อ่านกรอบจากไฟล์ JSON รองรับทั้ง [x1, y1, x2, y2] และ {x, y, width, height}"""
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    boxes = []
+    for r in items:
+        if isinstance(r, dict):
+            x1, y1 = int(r["x"]), int(r["y"])
+            boxes.append((x1, y1, x1 + int(r["width"]), y1 + int(r["height"])))
+        else:
+            boxes.append(tuple(int(v) for v in r))
+    return boxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="streaming restoration for very large mural scans")
+    parser.add_argument('--input', type=str, required=True, help='source image (uncompressed TIFF / .npy for streaming)')
+    parser.add_argument('--boxes', type=str, required=True, help='JSON file with damage boxes')
+    parser.add_argument('--output', type=str, required=True, help='output tiled pyramidal TIFF')
+    parser.add_argument('--config', type=str, default='./checkpoints/config.yml', help='model config (default: ./checkpoints/config.yml)')
+    parser.add_argument('--overlap', type=int, default=64, help='tile overlap in pixels')
+    parser.add_argument('--batch-size', type=int, default=None, help='tiles per forward (default: automatic)')
+    parser.add_argument('--levels', type=int, default=4, help='pyramid levels in the output TIFF')
+    parser.add_argument('--grabcut-context', type=int, default=GRABCUT_CONTEXT, help='pixels around small boxes used as GrabCut background')
+    parser.add_argument('--workdir', type=str, default=None, help='folder for the disk-backed canvas (default: system temp)')
+    args = parser.parse_args()
+
+    from src.engine import InferenceEngine
+    engine = InferenceEngine(args.config)
+
+    def on_tile(done, total):
+        print(f"tiles {done}/{total}")
+
+    stats = restore_large(engine, args.input, load_boxes(args.boxes), args.output,
+                          overlap=args.overlap, batch_size=args.batch_size,
+                          workdir=args.workdir, levels=args.levels, progress=on_tile,
+                          grabcut_context=args.grabcut_context)
+    print(f"Processed {stats['run']} of {stats['tiles']} patches -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# ============================================================
+#  Thai Mural Restoration System - Background Jobs
+#  🟡 Function: รับงานฟื้นฟูภาพเข้าคิว → รันใน worker pool ขนาดจำกัด →
+#  เก็บสถานะ/ผลลัพธ์แยกตาม job id (แทน progress_status แบบ global เดิม)
+#  และเก็บ event ความคืบหน้าไว้ให้ endpoint SSE ส่งต่อให้หน้าเว็บ
+#
+#  admission control: งานแต่ละงานมีต้นทุนโดยประมาณ (cost) ถ้าต้นทุนรวมของงานที่รับไว้
+#  (รอคิว + กำลังรัน) หรือจำนวนงานที่รอเกินกำหนด งานใหม่ถูกปฏิเสธทันที (Overloaded)
+#  แทนที่จะต่อคิวยาวจนหน่วยความจำหมด / ผู้ใช้รอโดยไม่รู้ว่าจะได้ผลเมื่อไร
+#  ผลลัพธ์ของงานที่เสร็จแล้วที่ยังเก็บไว้ใช้ความจุเดียวกัน (ทิ้งผลเก่าสุดก่อนปฏิเสธงานใหม่)
+# ============================================================
+
+import math
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# เหตุผลที่งานถูกยกเลิก → ข้อความใน job.error
+CANCEL_MESSAGES = {"client": "cancelled by client", "deadline": "deadline exceeded"}
+
+
+class Overloaded(Exception):
+    """
+    ปฏิเสธงานใหม่เพราะเกินความจุ
+    - retry_after: วินาทีโดยประมาณที่ควรรอก่อนส่งใหม่
+      (None = งานนี้ใหญ่เกินความจุทั้งหมด ส่งใหม่ก็ไม่ผ่าน)
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """งานถูกยกเลิกกลางทาง (ผู้ใช้สั่ง หรือเลย deadline) ยกขึ้นจาก Job.check()"""
+
+
+class Job:
+    """
+    🔸 งานฟื้นฟูภาพหนึ่งงาน
+    - status: queued → running → done / error / cancelled
+    - cost: ต้นทุนโดยประมาณที่ใช้ตัดสินรับงาน (หน่วยเดียวกับ JobManager.max_cost)
+    - deadline: เวลา (time.time()) ที่งานต้องเสร็จ ไม่งั้นถูกยกเลิก (None = ไม่จำกัด)
+    - progress / message: ความคืบหน้าล่าสุดของงานนี้เท่านั้น
+    - preview: ภาพตัวอย่างแบบเร็ว (ถ้าขอไว้) พร้อมก่อน result
+    - events: รายการ (seq, ชนิด, ข้อมูล) ทุกครั้งที่สถานะเปลี่ยน สำหรับ stream แบบ SSE
+    """
+    TERMINAL_EVENTS = ("done", "error", "cancelled")
+
+    def __init__(self, cost=0, deadline=None):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.progress = 0
+        self.message = "queued"
+        self.result = None
+        self.preview = None
+        self.info = {}
+        self.error = None
+        self.cost = cost
+        self.deadline = deadline
+        self.cancelled = None          # เหตุผลที่ถูกยกเลิก (key ของ CANCEL_MESSAGES)
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self._work = None              # (fn, args, kwargs) ที่รอรัน ปล่อยทิ้งเมื่อเริ่มรันหรือถูกยกเลิก
+        self._cond = threading.Condition()
+        self._done = threading.Event()
+
+    def set_progress(self, value, message="", **extra):
+        """ตั้งค่าความคืบหน้าของงานนี้ แล้วส่ง event "progress" (extra เช่น stage, done, total)"""
+        self.progress = int(value)
+        self.message = message
+        self.emit("progress", {"progress": self.progress, "message": message, **extra})
+
+    def emit(self, kind, data):
+        """เพิ่ม event ใหม่และปลุก stream ที่รออยู่"""
+        with self._cond:
+            self.events.append((len(self.events) + 1, kind, data))
+            self._cond.notify_all()
+
+    def events_after(self, seq, timeout=None):
+        """
+        คืน event ที่ seq มากกว่าค่าที่ให้มา ถ้ายังไม่มีจะรอได้ไม่เกิน timeout วินาที
+        (คืน list ว่างเมื่อหมดเวลา เพื่อให้ผู้เรียกส่ง keep-alive ได้)
+        """
+        with self._cond:
+            if len(self.events) <= seq:
+                self._cond.wait(timeout)
+            return self.events[seq:]
+
+    def check(self):
+        """
+        🔸 จุดตรวจระหว่างทำงาน (เช่น ระหว่าง batch ของ tile): ถูกสั่งยกเลิกหรือเลย deadline
+        → ยก JobCancelled ให้งานหยุดตรงนั้น
+        """
+        if self.cancelled is None and self.deadline is not None and time.time() > self.deadline:
+            self.cancelled = "deadline"
+        if self.cancelled is not None:
+            raise JobCancelled(CANCEL_MESSAGES[self.cancelled])
+
+    def result_bytes(self):
+        """ขนาด (ไบต์) ของ result + preview ที่งานนี้ถืออยู่"""
+        return sum(getattr(image, "nbytes", 0) for image in (self.result, self.preview))
+
+    def wait(self, timeout=None):
+        """รอจนงานจบ (เสร็จ / error / ถูกยกเลิก) คืนค่า True ถ้าจบทันเวลา"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        d = {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+        }
+        d.update(self.info)
+        if self.error is not None:
+            d["error"] = self.error
+        return d
+
+
+class JobManager:
+    """
+    🔸 คิวงาน + worker pool
+    - max_workers: จำนวนงานที่รันพร้อมกันได้สูงสุด
+    - max_result_bytes / ttl: ขนาดรวม (result + preview) และอายุของงานที่เสร็จแล้วที่เก็บไว้ให้ดึงผลลัพธ์
+      เกินแล้วทิ้งงานเก่าสุดก่อน (None = ไม่จำกัดขนาด)
+    - max_cost: ต้นทุนรวมของงานที่รับไว้ (รอคิว + กำลังรัน) + ผลลัพธ์ที่เก็บไว้ สูงสุด (None = ไม่จำกัด)
+    - max_queued: จำนวนงานที่รอคิวได้สูงสุด (None = ไม่จำกัด)
+    - bytes_per_cost: ไบต์ของผลลัพธ์ต่อหนึ่งหน่วย cost (เช่น 3 เมื่อ cost นับเป็นพิกเซล BGR)
+    """
+    RETRY_AFTER_DEFAULT = 5        # วินาที เมื่อยังไม่มีงานที่เสร็จให้ประมาณอัตรา
+    RETRY_AFTER_MAX = 300
+
+    def __init__(self, max_workers=2, max_result_bytes=None, ttl=3600, max_cost=None, max_queued=None,
+                 bytes_per_cost=1):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="restore")
+        self.max_workers = max_workers
+        self.max_result_bytes = max_result_bytes
+        self.ttl = ttl
+        self.max_cost = max_cost
+        self.max_queued = max_queued
+        self.bytes_per_cost = bytes_per_cost
+        self.rate = None           # ต้นทุนต่อวินาทีของงานหนึ่งงาน (ค่าเฉลี่ยถ่วงของงานที่เสร็จล่าสุด)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def reserve(self, cost=0, deadline=None):
+        """
+        🔸 ขั้นแรกของการส่งงาน: ตรวจความจุแล้วจองที่ในคิว (ยังไม่รัน) คืน Job ที่ status = queued
+        - เกินความจุ → Overloaded (ไม่สร้างงาน)
+        - ใช้แยกจาก start() เมื่อต้องแก้สถานะอื่น (เช่น กรอบของ session) หลังรู้ว่ารับงานแล้ว
+        """
+        with self.lock:
+            if self.max_cost is not None and cost > self.max_cost:
+                metrics.JOBS_REJECTED.labels(reason="too_large").inc()
+                raise Overloaded("job too large: estimated cost %d exceeds the limit %d" % (cost, self.max_cost))
+            active = [job for job in self.jobs.values() if job.finished is None]
+            used = sum(job.cost for job in active)
+            queued = sum(1 for job in active if job.status == "queued")
+            # ผลลัพธ์ที่เก็บไว้นับรวมในความจุ: ถ้างานที่ยังไม่จบเหลือที่ให้งานนี้ ทิ้งผลเก่าสุดจนพอดี
+            room = None
+            if self.max_cost is not None and used + cost <= self.max_cost:
+                room = self.max_cost - used - cost
+            retained = self._prune(room)
+            over_cost = self.max_cost is not None and used + cost + retained / self.bytes_per_cost > self.max_cost
+            if over_cost or (self.max_queued is not None and queued >= self.max_queued):
+                # ต้องรอจนงานที่รับไว้ลดลงพอให้งานนี้เข้าได้ (หรืออย่างน้อยหนึ่งงานเสร็จ)
+                need = used + cost - self.max_cost if over_cost else min((job.cost for job in active), default=cost)
+                metrics.JOBS_REJECTED.labels(reason="busy").inc()
+                raise Overloaded("server busy: %d jobs admitted (%d queued)" % (len(active), queued),
+                                 self._retry_after(need))
+            job = Job(cost, deadline)
+            self.jobs[job.id] = job
+        return job
+
+    def start(self, job, fn, *args, **kwargs):
+        """ส่งงานที่จองไว้เข้า pool: fn จะถูกเรียกเป็น fn(job, *args, **kwargs) ใน worker thread"""
+        job._work = (fn, args, kwargs)
+        self.pool.submit(self._run, job)
+        return job
+
+    def submit(self, fn, *args, cost=0, deadline=None, **kwargs):
+        """reserve + start ในขั้นเดียว (เกินความจุ → Overloaded)"""
+        return self.start(self.reserve(cost, deadline), fn, *args, **kwargs)
+
+    def discard(self, job):
+        """ลบงานที่จบแล้วพร้อมผลลัพธ์ทันที (เช่น /process ที่ส่งผลกลับไปแล้ว ไม่มีใครดึงซ้ำ)"""
+        with self.lock:
+            if job.finished is not None:
+                self.jobs.pop(job.id, None)
+
+    def release(self, job):
+        """คืนที่ของงานที่จองไว้แต่ไม่ได้ start (เช่น request ผิดรูปแบบหลังจอง)"""
+        with self.lock:
+            if job.status == "queued" and job._work is None:
+                self.jobs.pop(job.id, None)
+
+    def cancel(self, job_id, reason="client"):
+        """
+        🔸 ยกเลิกงาน คืน Job (None = ไม่พบ)
+        - งานที่รอคิว: จบทันที และปล่อยข้อมูลนำเข้า (ภาพ) ที่ถือไว้
+        - งานที่กำลังรัน: หยุดที่ job.check() ครั้งถัดไป (ระหว่าง batch ของ tile)
+        - งานที่จบแล้ว: ไม่เปลี่ยนแปลง
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished is not None:
+                return job
+            if job.cancelled is None:
+                job.cancelled = reason
+            if job.status != "queued":
+                return job
+            job._work = None
+            self._set_cancelled(job)
+        self._finish(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def count(self, status):
+        """จำนวนงานที่อยู่ในสถานะ status (เช่น "queued" = ความยาวคิว)"""
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job.status == status)
+
+    def active_cost(self):
+        """ต้นทุนรวมของงานที่รับไว้และยังไม่จบ"""
+        with self.lock:
+            return sum(job.cost for job in self.jobs.values() if job.finished is None)
+
+    def retained_bytes(self):
+        """ขนาดรวมของผลลัพธ์ (result + preview) ที่งานที่จบแล้วเก็บไว้"""
+        with self.lock:
+            return sum(job.result_bytes() for job in self.jobs.values() if job.finished is not None)
+
+    def _retry_after(self, need):
+        """วินาทีโดยประมาณจนต้นทุนที่ค้างลดลง need หน่วย (จากอัตราของงานที่เสร็จล่าสุด)"""
+        if not self.rate:
+            return self.RETRY_AFTER_DEFAULT
+        seconds = math.ceil(need / (self.rate * self.max_workers))
+        return int(min(max(seconds, 1), self.RETRY_AFTER_MAX))
+
+    def _set_cancelled(self, job):
+        job.status = "cancelled"
+        job.error = CANCEL_MESSAGES[job.cancelled]
+        job.message = "cancelled"
+        # ผลลัพธ์ที่ทำไปครึ่งทางไม่มีใครใช้ ปล่อยหน่วยความจำทันที
+        job.result = None
+        job.preview = None
+        metrics.JOBS_CANCELLED.labels(reason=job.cancelled).inc()
+
+    def _run(self, job):
+        with self.lock:
+            if job.status != "queued":
+                return          # ถูกยกเลิกระหว่างรอคิว
+            fn, args, kwargs = job._work
+            job._work = None
+            job.status = "running"
+        job.started = time.time()
+        try:
+            job.check()         # เลย deadline ระหว่างรอคิว → ไม่ต้องเริ่ม
+            job.set_progress(0, "running", stage="start")
+            fn(job, *args, **kwargs)
+            job.set_progress(100, "เสร็จสิ้น", stage="done")
+            job.status = "done"
+            self._observe_rate(job)
+        except JobCancelled:
+            self._set_cancelled(job)
+        except Exception as e:
+            traceback.print_exc()
+            job.status = "error"
+            job.error = str(e)
+            job.message = "error"
+        finally:
+            del fn, args, kwargs
+            self._finish(job)
+
+    def _finish(self, job):
+        with self.lock:
+            job.finished = time.time()
+            self._prune()
+        job._done.set()
+        job.emit(job.status, job.to_dict())
+
+    def _observe_rate(self, job):
+        elapsed = time.time() - job.started
+        if job.cost and elapsed > 0:
+            rate = job.cost / elapsed
+            self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+
+    def _prune(self, room=None):
+        """
+        ลบงานที่เสร็จแล้ว (เก่าสุดก่อน) ที่หมดอายุ หรือจนผลลัพธ์ที่เก็บไว้ไม่เกิน max_result_bytes
+        และไม่เกิน room หน่วย cost (ถ้าให้มา) คืนขนาดรวมที่เหลือเป็นไบต์ (เรียกภายใต้ self.lock)
+        """
+        now = time.time()
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        retained = sum(j.result_bytes() for j in finished)
+        for job in finished:
+            if (now - job.finished > self.ttl
+                    or (self.max_result_bytes is not None and retained > self.max_result_bytes)
+                    or (room is not None and retained > room * self.bytes_per_cost)):
+                del self.jobs[job.id]
+                retained -= job.result_bytes()
+        return retained
@@ -0,0 +1,230 @@
+# ============================================================
+#  Thai Mural Restoration System - Metrics
+#  🟡 Function: ตัวนับ / เกจ / histogram แบบเบา ๆ (ไม่ต้องพึ่ง prometheus_client)
+#  แล้วแสดงผลเป็น Prometheus text format ที่ endpoint /metrics
+# ============================================================
+
+import threading
+import time
+from contextlib import contextmanager
+
+# ขอบบนของ bucket (วินาที) ครอบคลุมตั้งแต่ขั้นตอนเล็ก ๆ (decode) จนถึงทั้งภาพขนาดใหญ่
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                     for k, v in labels)
+    return "{" + inner + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    🔸 ฐานของ metric แต่ละชนิด
+    - labelnames: ชื่อ label ที่ต้องระบุผ่าน .labels(...) (ไม่มี = ใช้ metric ตรง ๆ ได้เลย)
+    """
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.labelnames:
+            self.labels()   # metric ที่ไม่มี label แสดงค่า 0 ได้ตั้งแต่เริ่ม
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self.lock:
+            child = self.children.get(key)
+            if child is None:
+                child = self.children[key] = self._new_child()
+            return child
+
+    def _default(self):
+        return self.labels()
+
+    def samples(self):
+        """คืนรายการ (ชื่อ, labels, ค่า) สำหรับ render"""
+        with self.lock:
+            children = list(self.children.items())
+        for key, child in children:
+            yield from child.samples(self.name, key)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.kind)]
+        for name, labels, value in self.samples():
+            lines.append("%s%s %s" % (name, _format_labels(labels), _format_value(value)))
+        return "\n".join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Counter(_Metric):
+    """ตัวนับที่เพิ่มขึ้นอย่างเดียว (ชื่อควรลงท้ายด้วย _total)"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """
+    ค่าที่ขึ้นลงได้
+    - function: ถ้าให้มา จะเรียกตอน render เพื่ออ่านค่าล่าสุด (เช่น ความยาวคิว)
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, function=None):
+        self.function = function
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, (), self.function()
+            return
+        yield from super().samples()
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            yield name + "_bucket", labels + (("le", _format_value(bound)),), cumulative
+        yield name + "_bucket", labels + (("le", "+Inf"),), count
+        yield name + "_sum", labels, total
+        yield name + "_count", labels, count
+
+
+class Histogram(_Metric):
+    """นับการกระจายของค่า (เช่น เวลาแต่ละขั้นตอน) แยกตาม bucket"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class Registry:
+    """รวม metric ทั้งหมดเพื่อ render เป็นข้อความเดียว"""
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ============================================================
+#  🔹 metric ของระบบฟื้นฟูภาพ
+# ============================================================
+
+STAGE_SECONDS = Histogram(
+    "mural_stage_seconds", "Time spent in each restoration stage.", ["stage"])
+FORWARD_SECONDS = Histogram(
+    "mural_forward_seconds_per_tile", "Generator forward time per tile (batch time / batch size).",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+TILES_PROCESSED = Counter(
+    "mural_tiles_processed_total", "Tiles run through the generator.")
+TILES_SKIPPED = Counter(
+    "mural_tiles_skipped_total", "Tiles skipped because they contain no damaged pixels.")
+TILES_REUSED = Counter(
+    "mural_tiles_reused_total", "Tiles reused from an editing session because their mask did not change.")
+CACHE_HITS = Counter(
+    "mural_tile_cache_hits_total", "Tiles served from the tile result cache.")
+CACHE_MISSES = Counter(
+    "mural_tile_cache_misses_total", "Tile cache lookups that had to run the generator.")
+BATCH_SIZE = Histogram(
+    "mural_batch_size", "Tiles per generator forward formed by the batch scheduler.",
+    buckets=(1, 2, 4, 8, 16, 32))
+BATCH_WAIT_SECONDS = Histogram(
+    "mural_batch_wait_seconds", "Time a tile request waited in the batch scheduler queue.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+JOBS_REJECTED = Counter(
+    "mural_jobs_rejected_total", "Jobs refused by admission control (busy = 429, too_large = 413).", ["reason"])
+JOBS_CANCELLED = Counter(
+    "mural_jobs_cancelled_total", "Jobs cancelled by the client or for missing their deadline.", ["reason"])
+
+
+def stage(name):
+    """จับเวลาขั้นตอน name: ใช้เป็น with stage("decode"): ..."""
+    return STAGE_SECONDS.labels(stage=name).time()
@@ -0,0 +1,184 @@
+# ============================================================
+#  Thai Mural Restoration System - INT8 Quantization
+#  🟡 Function: สร้าง generator แบบ int8 (post-training static quantization)
+#  สำหรับเซิร์ฟเวอร์ที่มีแต่ CPU แล้วรายงานความแม่นยำเทียบกับ fp32
+#
+#  1) calibration: รัน tile ตัวอย่าง (เช่น dataset/flist/val) ผ่าน generator
+#     เพื่อเก็บช่วงค่าของ activation แล้วแปลงเป็น int8
+#  2) report: เทียบ PSNR / SSIM ของ fp32 กับ int8 บน tile ที่ไม่ได้ใช้ calibrate
+#     (เช่น dataset/flist/test) เพื่อตัดสินใจว่าจะเปิด INT8: 1 ใน config.yml หรือไม่
+#
+#  ใช้งาน:
+#    python quantize.py --calib dataset/flist/val --eval dataset/flist/test
+#    python quantize.py --eval dataset/flist/test --report-only   # วัดไฟล์ int8 ที่มีอยู่แล้ว
+#
+#  โฟลเดอร์ tile มีโครงสร้างเดียวกับที่ gendataset.py สร้าง: images/ masks/ edges/
+#  (ชื่อไฟล์ตรงกัน, ถ้าไม่มี edges/ จะสร้างจากภาพด้วย Canny)
+# ============================================================
+
+import os
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from tiling import create_edge_map
+
+
+def load_tiles(folder, limit=None, size=512):
+    """
+    🔸 อ่าน tile (ภาพ, mask, edge) จากโฟลเดอร์แบบ gendataset.py
+    - คืนค่า: list ของ (ชื่อไฟล์, BGR uint8, mask uint8, edge uint8)
+    """
+    image_dir = os.path.join(folder, "images")
+    names = sorted(n for n in os.listdir(image_dir) if n.lower().endswith((".png", ".jpg", ".jpeg")))
+    if limit:
+        names = names[:limit]
+
+    tiles = []
+    for name in names:
+        img = cv2.imread(os.path.join(image_dir, name))
+        mask = cv2.imread(os.path.join(folder, "masks", name), cv2.IMREAD_GRAYSCALE)
+        if img is None or mask is None:
+            print("skipping %s (image or mask missing)" % name)
+            continue
+        if img.shape[:2] != (size, size):
+            img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+            mask = cv2.resize(mask, (size, size), interpolation=cv2.INTER_NEAREST)
+        edge_path = os.path.join(folder, "edges", name)
+        edge = cv2.imread(edge_path, cv2.IMREAD_GRAYSCALE) if os.path.exists(edge_path) else None
+        if edge is None or edge.shape != mask.shape:
+            edge = create_edge_map(img)
+        tiles.append((name, img, mask, edge))
+    if not tiles:
+        raise SystemExit("no tiles found in " + image_dir)
+    return tiles
+
+
+def batches(tiles, batch_size):
+    for i in range(0, len(tiles), batch_size):
+        chunk = tiles[i:i + batch_size]
+        yield chunk, [t[1] for t in chunk], [t[2] for t in chunk], [t[3] for t in chunk]
+
+
+def calibrate(engine, tiles, batch_size, tile_size):
+    """
+    🔸 calibration + แปลงเป็น int8 แล้วบันทึกกราฟ full/coarse ลงโฟลเดอร์ checkpoint
+    - คืนค่า: path ของไฟล์ที่บันทึก
+    """
+    from src.frozen import save_frozen
+    from src.quantize import Int8Calibrator, freeze_int8, int8_path
+
+    generator = engine.model.inpaint_model.generator
+    generator = getattr(generator, "module", generator)
+
+    calibrator = Int8Calibrator(generator, tile_size)
+    start = time.time()
+    for _, img_tiles, mask_tiles, edge_tiles in batches(tiles, batch_size):
+        calibrator.observe(*engine.to_tensors(img_tiles, mask_tiles, edge_tiles))
+    print("calibrated on %d tiles in %.1fs (%s backend)" % (len(tiles), time.time() - start, calibrator.backend))
+
+    quantized = calibrator.convert()
+    paths = []
+    for coarse in (False, True):
+        path = int8_path(engine.config.PATH, coarse)
+        save_frozen(freeze_int8(quantized, tile_size, coarse), path, engine.checkpoint_stamp)
+        paths.append(path)
+        print("wrote " + path)
+    return paths
+
+
+def report(engine, tiles, batch_size):
+    """
+    🔸 เทียบ fp32 กับ int8 บน tile ชุดทดสอบ (ภาพต้นฉบับ = ground truth)
+    - PSNR / SSIM ของแต่ละโหมดเทียบ ground truth และส่วนต่าง (int8 - fp32)
+    - PSNR ของ int8 เทียบ fp32 โดยตรง และเวลาต่อ tile
+    """
+    from skimage.metrics import structural_similarity
+
+    int8 = engine.int8
+    if not int8:
+        raise SystemExit("no int8 graphs built from the current checkpoint, run calibration first")
+
+    results = {}
+    for coarse in sorted(int8):
+        mode = "coarse" if coarse else "full"
+        scores = {"fp32": {"psnr": [], "ssim": []}, "int8": {"psnr": [], "ssim": []}, "int8_vs_fp32_psnr": []}
+        timings = {"fp32": 0.0, "int8": 0.0}
+        for _, img_tiles, mask_tiles, edge_tiles in batches(tiles, batch_size):
+            outputs = {}
+            for label, graphs in (("fp32", {}), ("int8", int8)):
+                engine.int8 = graphs
+                start = time.time()
+                outputs[label] = engine.inpaint_tiles(img_tiles, mask_tiles, edge_tiles, coarse_only=coarse)
+                timings[label] += time.time() - start
+            engine.int8 = int8
+
+            for i, truth in enumerate(img_tiles):
+                for label in ("fp32", "int8"):
+                    out = outputs[label][i]
+                    scores[label]["psnr"].append(cv2.PSNR(truth, out))
+                    scores[label]["ssim"].append(structural_similarity(truth, out, channel_axis=2, data_range=255))
+                scores["int8_vs_fp32_psnr"].append(cv2.PSNR(outputs["fp32"][i], outputs["int8"][i]))
+
+        summary = {
+            "tiles": len(tiles),
+            "fp32": {k: float(np.mean(v)) for k, v in scores["fp32"].items()},
+            "int8": {k: float(np.mean(v)) for k, v in scores["int8"].items()},
+            "int8_vs_fp32_psnr": float(np.mean(scores["int8_vs_fp32_psnr"])),
+            "seconds_per_tile": {k: v / len(tiles) for k, v in timings.items()},
+        }
+        summary["delta"] = {k: summary["int8"][k] - summary["fp32"][k] for k in ("psnr", "ssim")}
+        results[mode] = summary
+
+        print("== %s (%d held-out tiles)" % (mode, len(tiles)))
+        print("   %-6s %8s %8s %10s" % ("", "PSNR", "SSIM", "s/tile"))
+        for label in ("fp32", "int8"):
+            print("   %-6s %8.2f %8.4f %10.3f" % (label, summary[label]["psnr"], summary[label]["ssim"],
+                                                   summary["seconds_per_tile"][label]))
+        print("   delta  %+8.2f %+8.4f %9.2fx" % (summary["delta"]["psnr"], summary["delta"]["ssim"],
+                                                 timings["fp32"] / max(timings["int8"], 1e-9)))
+        print("   int8 vs fp32 PSNR: %.2f dB" % summary["int8_vs_fp32_psnr"])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="int8 post-training quantization of the generator")
+    parser.add_argument("--path", "--checkpoints", default="./checkpoints", help="checkpoints folder (config.yml)")
+    parser.add_argument("--calib", help="calibration tiles folder (images/, masks/, edges/)")
+    parser.add_argument("--calib-tiles", type=int, default=64, help="number of calibration tiles to use")
+    parser.add_argument("--eval", help="held-out tiles folder for the accuracy report")
+    parser.add_argument("--eval-tiles", type=int, default=100, help="number of held-out tiles to use")
+    parser.add_argument("--tile-size", type=int, default=512, help="tile height and width")
+    parser.add_argument("--batch-size", type=int, default=4, help="tiles per forward")
+    parser.add_argument("--report", help="also write the report as JSON to this file")
+    parser.add_argument("--report-only", action="store_true", help="skip calibration, report on existing int8 graphs")
+    args = parser.parse_args()
+
+    if not args.report_only and not args.calib:
+        parser.error("--calib is required unless --report-only")
+    if args.report_only and not args.eval:
+        parser.error("--report-only needs --eval")
+
+    from src.engine import InferenceEngine
+
+    engine = InferenceEngine(os.path.join(args.path, "config.yml"))
+    if engine.config.DEVICE.type != "cpu":
+        raise SystemExit("int8 quantization targets CPU serving, run with CUDA hidden (CUDA_VISIBLE_DEVICES=)")
+
+    if not args.report_only:
+        calibrate(engine, load_tiles(args.calib, args.calib_tiles, args.tile_size), args.batch_size, args.tile_size)
+        engine.int8 = engine._load_int8()
+
+    if args.eval:
+        results = report(engine, load_tiles(args.eval, args.eval_tiles, args.tile_size), args.batch_size)
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(results, f, indent=2)
+            print("wrote " + args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# ============================================================
+#  Thai Mural Restoration System - Batch Scheduler
+#  🟡 Function: รวม tile ที่รอรันจากทุกงานที่กำลังทำอยู่เป็น batch เดียว
+#  (ไม่เกิน max_batch tile หรือรอไม่เกิน max_wait วินาที) → รันโมเดลครั้งเดียว
+#  → ส่งผลลัพธ์กลับไปยังงานเจ้าของ tile
+#
+#  ผู้ใช้หลายคนพร้อมกันจึงไม่ต่างคนต่างรันโมเดลทีละไม่กี่ tile แย่ง thread กัน
+#  และงานใหญ่ไม่กินคิวทั้งหมด: แต่ละงานส่ง tile ล่วงหน้าได้จำกัด แล้วสลับกันตามลำดับที่ส่ง
+#
+#  ใช้ผ่าน inpaint_origins(..., executor=scheduler) ใน tiling.py แบบเดียวกับ TileExecutor
+# ============================================================
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+
+
+class _Request:
+    """tile ของงานหนึ่งที่รอรวม batch"""
+    __slots__ = ("img_tiles", "mask_tiles", "edge_tiles", "coarse_only", "future", "queued")
+
+    def __init__(self, img_tiles, mask_tiles, edge_tiles, coarse_only):
+        self.img_tiles = img_tiles
+        self.mask_tiles = mask_tiles
+        self.edge_tiles = edge_tiles
+        self.coarse_only = coarse_only
+        self.future = Future()
+        self.queued = time.perf_counter()
+
+    @property
+    def key(self):
+        # รวม batch ได้เฉพาะ tile ขนาดเดียวกันและโหมดเดียวกัน
+        return self.coarse_only, self.img_tiles[0].shape
+
+
+class BatchScheduler:
+    """
+    🔸 ตัวจัด batch กลางสำหรับ generator forward
+    - engine: InferenceEngine
+    - max_batch: tile สูงสุดต่อการรันโมเดลหนึ่งครั้ง (None = engine.batch_size(tile))
+    - max_wait: วินาทีที่ tile แรกในคิวรอ tile อื่นมาร่วม batch ได้มากที่สุด
+    - thread ทำงานเริ่มเมื่อมี tile แรกเข้ามา (ไม่เริ่มตอนสร้าง)
+    """
+    def __init__(self, engine, max_batch=None, max_wait=0.01):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def batch_size(self, tile_size=512):
+        """tile ต่อ request ของแต่ละงาน: ทีละ tile แล้วให้ scheduler รวม batch เอง"""
+        return 1
+
+    def _max_batch(self, tile_size):
+        return self.max_batch or self.engine.batch_size(tile_size)
+
+    def submit(self, img_tiles, mask_tiles, edge_tiles, coarse_only=False):
+        """ส่ง tile เข้าคิว คืน Future ของ (tile ผลลัพธ์, เวลา forward ส่วนของ tile เหล่านี้)"""
+        request = _Request(img_tiles, mask_tiles, edge_tiles, coarse_only)
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+                self.thread.start()
+            self.queue.append(request)
+            self.cond.notify()
+        return request.future
+
+    def map(self, batches, coarse_only=False):
+        """
+        🔸 รัน batches [(img_tiles, mask_tiles, edge_tiles), ...] ของงานหนึ่ง
+        - yield (tile ผลลัพธ์, เวลา forward) ตามลำดับ batch
+        - ส่งเข้าคิวล่วงหน้าไม่เกิน max_batch tile ต่องาน (งานเดียวก็ยังได้ batch เต็ม)
+        """
+        batches = iter(batches)
+        pending = deque()
+        pending_tiles = 0
+
+        def submit():
+            nonlocal pending_tiles
+            batch = next(batches, None)
+            if batch is not None:
+                pending.append((len(batch[0]), self.submit(*batch, coarse_only=coarse_only)))
+                pending_tiles += len(batch[0])
+                return batch
+            return None
+
+        batch = submit()
+        limit = self._max_batch(batch[0][0].shape[0]) if batch is not None else 1
+        while pending_tiles < limit and submit() is not None:
+            pass
+        try:
+            while pending:
+                count, future = pending.popleft()
+                pending_tiles -= count
+                result = future.result()
+                while pending_tiles < limit and submit() is not None:
+                    pass
+                yield result
+        finally:
+            # ผู้เรียกหยุดกลางทาง → เอา tile ที่ยังไม่ได้รันออกจากคิว
+            for _, future in pending:
+                future.cancel()
+
+    def _next_batch(self):
+        """
+        รอจนได้ batch: tile แรกในคิวกำหนดชนิด batch แล้วรอ tile ชนิดเดียวกันจนครบ max_batch
+        หรือจน tile แรกรอครบ max_wait → ดึง request ตามลำดับที่เข้าคิว
+        """
+        with self.cond:
+            while True:
+                while not self.queue:
+                    self.cond.wait()
+                first = self.queue[0]
+                if first.future.cancelled():
+                    self.queue.popleft()
+                    continue
+                key = first.key
+                limit = self._max_batch(key[1][0])
+                deadline = first.queued + self.max_wait
+                while True:
+                    tiles = sum(len(r.img_tiles) for r in self.queue if r.key == key)
+                    remaining = deadline - time.perf_counter()
+                    if tiles >= limit or remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                batch, tiles, rest = [], 0, deque()
+                while self.queue:
+                    request = self.queue.popleft()
+                    n = len(request.img_tiles)
+                    if request.key != key or (batch and tiles + n > limit):
+                        rest.append(request)
+                    elif request.future.set_running_or_notify_cancel():
+                        batch.append(request)
+                        tiles += n
+                self.queue = rest
+                if batch:
+                    return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            start_time = time.perf_counter()
+            for request in batch:
+                metrics.BATCH_WAIT_SECONDS.observe(start_time - request.queued)
+            try:
+                outputs = self.engine.inpaint_tiles(
+                    [t for r in batch for t in r.img_tiles],
+                    [t for r in batch for t in r.mask_tiles],
+                    [t for r in batch for t in r.edge_tiles],
+                    coarse_only=batch[0].coarse_only)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            forward_time = time.perf_counter() - start_time
+            metrics.BATCH_SIZE.observe(len(outputs))
+
+            offset = 0
+            for request in batch:
+                n = len(request.img_tiles)
+                request.future.set_result((outputs[offset:offset + n], forward_time * n / len(outputs)))
+                offset += n
@@ -0,0 +1,101 @@
+# Import-time budget for the serving and CLI entry points.
+#
+# Runs `python -X importtime -c "<imports>"` in a fresh interpreter, reports
+# the slowest modules and fails (exit 1) if the total import time exceeds the
+# budget or if a module that should be lazy (matplotlib, scipy, ...) is
+# imported on that path.
+#
+#   python scripts/import_budget.py                  # all targets
+#   python scripts/import_budget.py serving --top 20
+#   python scripts/import_budget.py --budget-ms 2500
+
+import os
+import argparse
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules only needed for training, evaluation or plotting
+HEAVY = ('matplotlib', 'scipy', 'skimage', 'imageio', 'torchvision')
+
+# name: (import statement, budget in ms, modules that must not be imported)
+TARGETS = {
+    'serving': ('import src.engine, tiling, sessions, jobs, metrics, tile_cache, auto_mask', 4000, HEAVY),
+    'main': ('import main', 4000, HEAVY),
+}
+
+
+def measure(statement):
+    r"""runs the statement under -X importtime
+
+    Returns:
+        list: (module, self_us, cumulative_us, depth) in import order
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError('import failed:\n' + proc.stderr[-2000:])
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def check(name, statement, budget_ms, forbidden, runs=3, top=10):
+    r"""measures one target (best of `runs`) and prints its report
+
+    Returns:
+        bool: True if the target is within budget and imports nothing forbidden
+    """
+    best = None
+    for _ in range(runs):
+        rows = measure(statement)
+        total = sum(cum for _, _, cum, depth in rows if depth == 0)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+
+    loaded = {module for module, _, _, _ in rows}
+    leaked = sorted(m for m in forbidden if m in loaded)
+
+    print('== %s: %s' % (name, statement))
+    print('   total %.0f ms (budget %d ms), %d modules' % (total / 1000, budget_ms, len(rows)))
+    print('   %-40s %10s %10s' % ('slowest imports (depth <= 1)', 'self ms', 'cum ms'))
+    for module, self_us, cum_us, _ in sorted((r for r in rows if r[3] <= 1), key=lambda r: -r[2])[:top]:
+        print('   %-40s %10.1f %10.1f' % (module, self_us / 1000, cum_us / 1000))
+
+    ok = total / 1000 <= budget_ms and not leaked
+    if leaked:
+        print('   FAIL: imports %s (should be lazy on this path)' % ', '.join(leaked))
+    if total / 1000 > budget_ms:
+        print('   FAIL: over budget by %.0f ms' % (total / 1000 - budget_ms))
+    if ok:
+        print('   OK')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='check import time against a budget')
+    parser.add_argument('targets', nargs='*', choices=[[]] + list(TARGETS), help='targets to check (default: all)')
+    parser.add_argument('--budget-ms', type=int, help='override the budget of every target')
+    parser.add_argument('--runs', type=int, default=3, help='measure each target this many times and keep the best')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to list')
+    args = parser.parse_args()
+
+    ok = True
+    for name in args.targets or list(TARGETS):
+        statement, budget_ms, forbidden = TARGETS[name]
+        if args.budget_ms is not None:
+            budget_ms = args.budget_ms
+        ok &= check(name, statement, budget_ms, forbidden, args.runs, args.top)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Mask consistency checks for auto_mask.py.
+#
+# grabcut: GrabCut on the whole image (the default) against GrabCut cropped
+#          to the box plus a margin. The default must match a crop covering
+#          the whole image exactly; the IoU of the small crop is reported so
+#          a margin can be judged before passing one.
+# gigapixel: the streamed mask from gigapixel.build_mask (read window by
+#          window from a memory-mapped .npy) against multi_box_auto_mask on
+#          the whole image. Must match on an image smaller than the GrabCut
+#          window.
+#
+# Fails (exit 1) when a check that must match does not.
+#
+#   python scripts/mask_check.py                     # all checks on test.png
+#   python scripts/mask_check.py grabcut --margin 128
+#   python scripts/mask_check.py gigapixel
+#   python scripts/mask_check.py --image path/to/mural.png
+
+import os
+import argparse
+import shutil
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auto_mask import box_to_mask_grabcut_full, multi_box_auto_mask  # noqa: E402
+from gigapixel import ImageSource, build_mask  # noqa: E402
+
+# small boxes (GrabCut path in box_to_mask) on test.png
+BOXES = [(100, 100, 200, 180), (300, 200, 420, 300), (10, 10, 60, 60), (40, 60, 180, 190)]
+# large box (threshold path), overlaps the last small box
+LARGE_BOX = (150, 250, 480, 500)
+
+
+def iou(a, b):
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+def seeded(fn, *args, **kwargs):
+    r"""runs fn with OpenCV's RNG reset, GrabCut seeds its GMMs from it"""
+    cv2.setRNGSeed(0)
+    return fn(*args, **kwargs)
+
+
+def check_grabcut(img, boxes, margin):
+    r"""default GrabCut against full-image and small-margin crops
+
+    Returns:
+        bool: True if the default matches GrabCut on the whole image
+    """
+    print('== grabcut: default vs margin=%d' % margin)
+    ok = True
+    whole = max(img.shape[:2])
+    for box in boxes:
+        default = seeded(box_to_mask_grabcut_full, img, box, iters=2, min_area=5)
+        full = seeded(box_to_mask_grabcut_full, img, box, iters=2, min_area=5, margin=whole)
+        crop = seeded(box_to_mask_grabcut_full, img, box, iters=2, min_area=5, margin=margin)
+        same = np.array_equal(default, full)
+        ok &= same
+        print('   box %-22s default %6d  full %6d  margin %6d (IoU %.3f)%s' % (
+            box, np.count_nonzero(default), np.count_nonzero(full), np.count_nonzero(crop),
+            iou(default, crop), '' if same else '  FAIL'))
+    print('   OK' if ok else '   FAIL: default GrabCut does not match the full image')
+    return ok
+
+
+def check_gigapixel(img, boxes):
+    r"""streamed build_mask against multi_box_auto_mask, per box and all boxes at once
+
+    Returns:
+        bool: True if every streamed mask matches the in-memory one
+    """
+    print('== gigapixel: build_mask vs multi_box_auto_mask')
+    tmp = tempfile.mkdtemp(prefix='mask_check_')
+    try:
+        path = os.path.join(tmp, 'image.npy')
+        np.save(path, cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        source = ImageSource(path)
+        ok = True
+        for group in [[box] for box in boxes] + [boxes]:
+            reference = seeded(multi_box_auto_mask, img, group)
+            streamed, _ = seeded(build_mask, source, group, os.path.join(tmp, 'mask.u8'))
+            same = np.array_equal(reference, streamed)
+            ok &= same
+            print('   %-28s reference %6d  streamed %6d%s' % (
+                group[0] if len(group) == 1 else 'all %d boxes' % len(group),
+                np.count_nonzero(reference), np.count_nonzero(streamed), '' if same else '  FAIL'))
+            del streamed
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    print('   OK' if ok else '   FAIL: streamed mask does not match multi_box_auto_mask')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='check auto_mask and gigapixel masks against the full-image reference')
+    parser.add_argument('checks', nargs='*', choices=[[], 'grabcut', 'gigapixel'], help='checks to run (default: all)')
+    parser.add_argument('--image', default=os.path.join(ROOT, 'test.png'), help='image to test on')
+    parser.add_argument('--margin', type=int, default=64, help='crop margin reported by the grabcut check')
+    args = parser.parse_args()
+
+    img = cv2.imread(args.image)
+    if img is None:
+        raise SystemExit('cannot read ' + args.image)
+
+    ok = True
+    for name in args.checks or ['grabcut', 'gigapixel']:
+        if name == 'grabcut':
+            ok &= check_grabcut(img, BOXES, args.margin)
+        elif name == 'gigapixel':
+            ok &= check_gigapixel(img, BOXES + [LARGE_BOX])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
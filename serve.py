@@ -0,0 +1,256 @@
+# ============================================================
+#  Thai Mural Restoration System - Production Server (pre-fork)
+#  🟡 Function: โหลดโมเดลครั้งเดียวใน process หลัก (master) → warmup →
+#  ย้ายน้ำหนัก generator ไป shared memory → fork worker N ตัวที่รับ request
+#  จาก socket เดียวกัน (werkzeug make_server(fd=...)) แทน app.run(debug=True)
+#
+#  - น้ำหนักโมเดลอยู่ใน shared memory ชุดเดียว: worker เพิ่มหนึ่งตัวแทบไม่ใช้
+#    หน่วยความจำสำหรับน้ำหนักเพิ่ม (ดู --stats)
+#  - thread ทุกตัว (คิวงาน, batch scheduler) เริ่มใน worker หลัง fork เท่านั้น
+#  - worker ตาย → master fork ตัวใหม่ให้, SIGHUP → master โหลด checkpoint ใหม่
+#    แล้วเปลี่ยน worker ทีละตัว (fork ตัวใหม่ก่อน แล้วค่อยหยุดตัวเก่า)
+#  - หยุด worker (SIGHUP / SIGTERM / Ctrl+C ที่ master) = drain: หยุดรับ request ใหม่
+#    รองานในคิว/ที่กำลังรันและ request ที่ค้างอยู่ให้จบ (ไม่เกิน --graceful-timeout) แล้วจึงออก
+#
+#  ข้อควรรู้: งาน (/jobs) และ session (/sessions) เก็บในหน่วยความจำของ worker
+#  ที่สร้างมัน ถ้า --workers มากกว่า 1 ต้องให้ load balancer ส่ง client เดิม
+#  ไป worker เดิม (sticky) หรือใช้ /process แบบ synchronous
+#
+#  ใช้งาน:
+#    python serve.py --host 0.0.0.0 --port 5000 --workers 4
+# ============================================================
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+import traceback
+
+
+def private_memory(pid):
+    """หน่วยความจำที่ process ใช้คนเดียว (Private_Clean + Private_Dirty, ไบต์) จาก /proc (Linux)"""
+    try:
+        with open("/proc/%d/smaps_rollup" % pid) as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    return sum(int(fields[k].split()[0]) * 1024 for k in ("Private_Clean", "Private_Dirty") if k in fields)
+
+
+def drain(jobs, handlers, timeout):
+    """
+    🔸 รอจนไม่มีงานในคิว/ที่กำลังรัน และไม่มี thread ที่ยังตอบ request อยู่ ไม่เกิน timeout วินาที
+    (request แบบ synchronous / SSE จบเองเมื่องานของมันจบ)
+    คืนค่า True ถ้าจบครบก่อนหมดเวลา
+    """
+    deadline = time.time() + timeout
+    while jobs.count("queued") or jobs.count("running") or handlers:
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+def run_worker(app_module, sock, index, graceful_timeout):
+    """
+    🔸 ส่วนของ worker (process ลูก): รับ request จาก socket ที่ master เปิดไว้จนได้ SIGTERM
+       แล้ว drain (หยุดรับ request → รองาน/request ที่ค้าง ไม่เกิน graceful_timeout วินาที)
+    - ไม่คืนค่า: จบด้วย os._exit
+    """
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # Ctrl+C ให้ master จัดการ
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app_module.app, threaded=True, fd=sock.fileno())
+
+    # request ที่ยังตอบไม่เสร็จ (werkzeug ตอบใน daemon thread และไม่เก็บ thread ไว้ให้ join)
+    # เพิ่มใน thread ของ serve_forever ก่อนเริ่ม thread ที่ตอบ จึงไม่หลุดตอน shutdown พอดี
+    handlers = []
+    process_request, process_request_thread = server.process_request, server.process_request_thread
+
+    def track(request, client_address):
+        handlers.append(request)
+        process_request(request, client_address)
+
+    def handle(request, client_address):
+        try:
+            process_request_thread(request, client_address)
+        finally:
+            handlers.remove(request)
+    server.process_request, server.process_request_thread = track, handle
+
+    # shutdown() ต้องเรียกจาก thread อื่นที่ไม่ใช่ serve_forever
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    print("worker %d (pid %d) serving on http://%s:%d" % (index, os.getpid(), host, port))
+    code = 0
+    try:
+        server.serve_forever()
+        # หยุดรับ request แล้ว (worker อื่นยังรับจาก socket เดียวกันต่อ)
+        if not drain(app_module.jobs, handlers, graceful_timeout):
+            print("worker %d (pid %d): %d jobs / %d requests still running after %ds, exiting" % (
+                index, os.getpid(), app_module.jobs.count("queued") + app_module.jobs.count("running"),
+                len(handlers), graceful_timeout))
+            code = 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        app_module.jobs.pool.shutdown(wait=False, cancel_futures=True)
+        sys.stdout.flush()
+        os._exit(code)
+
+
+class Master:
+    """
+    🔸 process หลัก: เปิด socket, เตรียมโมเดล, fork และดูแล worker
+    - app_module: โมดูล app (โหลดโมเดลแล้ว)
+    - sock: listening socket ที่ worker ทุกตัวใช้ร่วมกัน
+    - workers: จำนวน worker
+    - graceful_timeout: วินาทีที่ worker รองานที่ค้างก่อนออก (ตอนหยุด/เปลี่ยน worker)
+    """
+    POLL_INTERVAL = 0.5             # วินาที ตรวจ worker ที่ออกแล้ว / คำสั่ง reload
+
+    def __init__(self, app_module, sock, workers, graceful_timeout=120):
+        self.app = app_module
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.children = {}          # pid → index
+        self.running = True
+        self.reload = False
+        self.pending = []           # pid ของ worker เก่าที่รอเปลี่ยนตอน reload
+        self.replacing = None       # pid ของ worker เก่าที่กำลัง drain
+
+    def prepare(self):
+        """warmup (ถ้าเปิด) แล้วย้ายน้ำหนักไป shared memory ก่อน fork"""
+        engine = self.app.engine
+        if self.app.WARMUP:
+            engine.warmup(self.app.PATCH_SIZE)
+        engine.share_memory()
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.app, self.sock, index, self.graceful_timeout)
+        self.children[pid] = index
+
+    def stop_children(self):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def on_stop(self, *_):
+        self.running = False
+        self.stop_children()
+
+    def on_reload(self, *_):
+        self.reload = True          # ทำใน loop ของ run() ไม่ทำใน signal handler
+
+    def start_reload(self):
+        """โหลด checkpoint ใหม่ (ถ้าเปลี่ยน) แล้วเริ่มเปลี่ยน worker ที่มีอยู่ทีละตัว"""
+        self.reload = False
+        print("reloading checkpoint before replacing workers...")
+        if self.app.engine.reload_if_changed():
+            self.app.engine.share_memory()
+        self.pending = sorted(self.children, key=self.children.get)
+        self.replace_next()
+
+    def replace_next(self):
+        """fork worker ใหม่แทนตัวเก่าตัวถัดไป แล้วส่ง SIGTERM ให้ตัวเก่า drain (ยังรับงานได้ครบจำนวนระหว่างนั้น)"""
+        self.replacing = None
+        while self.pending:
+            pid = self.pending.pop(0)
+            if pid not in self.children:
+                continue            # ออกไปเองแล้ว ตัวที่ fork แทนใช้ checkpoint ใหม่อยู่แล้ว
+            self.spawn(self.children[pid])
+            self.replacing = pid
+            os.kill(pid, signal.SIGTERM)
+            return
+        print("all workers replaced")
+
+    def reap(self):
+        """เก็บ worker ที่ออกแล้ว: ตัวที่ถูกเปลี่ยน → เปลี่ยนตัวถัดไป, ตัวที่ตายเอง → fork ใหม่"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            index = self.children.pop(pid, None)
+            if index is None or not self.running:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if pid == self.replacing:
+                self.replace_next()
+                continue
+            if code != 0:
+                print("worker %d (pid %d) exited with %d, restarting" % (index, pid, code))
+                time.sleep(1)
+            self.spawn(index)
+
+    def report(self):
+        """พิมพ์หน่วยความจำของ master และ private memory ของแต่ละ worker"""
+        own = private_memory(os.getpid())
+        if own is None:
+            return
+        print("master pid %d private %.0f MB, model %.0f MB shared" % (
+            os.getpid(), own / 1e6, self.app.engine.memory_bytes() / 1e6))
+        for pid, index in sorted(self.children.items(), key=lambda item: item[1]):
+            print("  worker %d pid %d private %.0f MB" % (index, pid, (private_memory(pid) or 0) / 1e6))
+
+    def run(self, stats_after=None):
+        """fork worker ครบจำนวน แล้วรอ: worker ที่ออกไปจะถูกแทนที่จนกว่าจะสั่งหยุด"""
+        self.prepare()
+        for index in range(self.workers):
+            self.spawn(index)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGHUP, self.on_reload)
+        if stats_after:
+            # ใช้ alarm แทน thread: master ไม่มี thread อื่นตอน fork worker ใหม่
+            signal.signal(signal.SIGALRM, lambda *_: self.report())
+            signal.alarm(max(1, int(stats_after)))
+
+        while self.children:
+            self.reap()
+            if self.reload and self.running and self.replacing is None:
+                self.start_reload()
+            time.sleep(self.POLL_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pre-fork production server for the restoration app")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVE_WORKERS", "2")),
+                        help="worker processes (each serves requests with threads)")
+    parser.add_argument("--backlog", type=int, default=128, help="listen backlog of the shared socket")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.environ.get("GRACEFUL_TIMEOUT", "120")),
+                        help="seconds a stopping worker waits for queued/running jobs and open requests")
+    parser.add_argument("--stats", type=int, metavar="SECONDS",
+                        help="print per-process private memory this many seconds after start")
+    args = parser.parse_args()
+
+    # เปิด socket ก่อนโหลดโมเดล: port ชนกันจะรู้ทันที
+    family = socket.AF_INET6 if ":" in args.host else socket.AF_INET
+    sock = socket.create_server((args.host, args.port), family=family, backlog=args.backlog)
+    sock.set_inheritable(True)
+
+    # app ไม่ต้องเริ่ม warmup thread ตอน import: master warmup เองก่อน fork (Master.prepare)
+    os.environ["MURAL_PREFORK"] = "1"
+    import app as app_module
+    if app_module.TILE_WORKERS > 0:
+        raise SystemExit("serve.py forks its own workers, unset TILE_WORKERS")
+
+    Master(app_module, sock, args.workers, args.graceful_timeout).run(args.stats)
+
+
+if __name__ == "__main__":
+    main()
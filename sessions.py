@@ -0,0 +1,201 @@
+# ============================================================
+#  Thai Mural Restoration System - Editing Sessions
+#  🟡 Function: เก็บภาพที่อัปโหลดครั้งเดียวไว้ฝั่ง server (LRU จำกัดจำนวน) →
+#  รับเฉพาะการเพิ่ม/ลบกรอบ → คำนวณใหม่เฉพาะ tile ที่ mask เปลี่ยน
+#  แล้วใช้ผลลัพธ์ tile เดิมซ้ำสำหรับส่วนที่เหลือ
+# ============================================================
+
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from auto_mask import box_to_mask, soften_and_expand_mask
+from tiling import create_edge_map, tile_origins, damaged_tiles, inpaint_origins, blend_tiles
+import metrics
+
+
+class Session:
+    """
+    🔸 สถานะการแก้ไขภาพหนึ่งภาพ
+    - image / edge: ภาพต้นฉบับ (BGR) และ edge map คำนวณครั้งเดียวตอนอัปโหลด
+    - boxes: กรอบที่ผู้ใช้ต้องการ {box_id: (x1, y1, x2, y2)} (แก้ได้ทันทีตอนรับ request)
+    - box_masks: mask ดิบของกรอบที่คำนวณแล้ว {box_id: (x, y, crop)} (ยังไม่ soften)
+    - tiles: ผลลัพธ์ของ tile ที่เสียหาย {(y, x): tile BGR uint8} สำหรับ mask ปัจจุบัน
+    ทุกภาพผลลัพธ์ได้จาก image ต้นฉบับ + กรอบทั้งหมด ไม่ได้ต่อยอดจากผลรอบก่อน
+    """
+    def __init__(self, img_bgr):
+        self.id = uuid.uuid4().hex
+        self.image = img_bgr
+        with metrics.stage("edge"):
+            self.edge = create_edge_map(img_bgr)
+        self.boxes = {}
+        self.box_masks = {}
+        self.mask = np.zeros(img_bgr.shape[:2], np.uint8)
+        self.tiles = {}
+        self.checkpoint_stamp = None
+        self.result = None
+        self.last_used = time.time()
+        self.lock = threading.Lock()           # ป้องกัน boxes (สั้น ๆ ตอนรับ request)
+        self.compute_lock = threading.Lock()   # ให้การคำนวณของ session เดียวกันรันทีละงาน
+        self._ids = itertools.count(1)
+
+    @property
+    def shape(self):
+        return self.image.shape[:2]
+
+    def edit(self, add=(), remove=()):
+        """
+        เพิ่ม/ลบกรอบ (ยังไม่คำนวณ) คืน id ของกรอบที่เพิ่ม
+        - remove ที่ไม่มีอยู่ → KeyError
+        """
+        with self.lock:
+            missing = [box_id for box_id in remove if box_id not in self.boxes]
+            if missing:
+                raise KeyError(f"unknown box id: {missing}")
+            for box_id in remove:
+                del self.boxes[box_id]
+            ids = []
+            for box in add:
+                box_id = next(self._ids)
+                self.boxes[box_id] = box
+                ids.append(box_id)
+            return ids
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.boxes)
+
+    def _box_mask(self, box):
+        """mask ดิบของกรอบเดียว เก็บเฉพาะกรอบสี่เหลี่ยมที่มีพิกเซล (x, y, crop)"""
+        raw = box_to_mask(self.image, box)
+        x, y, w, h = cv2.boundingRect(raw)
+        return x, y, raw[y:y+h, x:x+w].copy()
+
+    def update_mask(self, boxes):
+        """
+        🔸 ปรับ box_masks ให้ตรงกับ boxes (คำนวณ mask เฉพาะกรอบใหม่) แล้วรวมเป็น mask สุดท้าย
+        - soften ทำกับ mask รวมทั้งภาพเหมือน multi_box_auto_mask (ผลตรงกันทุกพิกเซล)
+        คืนค่า mask เดิมก่อนเปลี่ยน
+        """
+        for box_id in list(self.box_masks):
+            if box_id not in boxes:
+                del self.box_masks[box_id]
+        for box_id, box in boxes.items():
+            if box_id not in self.box_masks:
+                self.box_masks[box_id] = self._box_mask(box)
+
+        raw = np.zeros(self.shape, np.uint8)
+        for x, y, crop in self.box_masks.values():
+            region = raw[y:y+crop.shape[0], x:x+crop.shape[1]]
+            np.bitwise_or(region, crop, out=region)
+        previous, self.mask = self.mask, soften_and_expand_mask(raw, dilate_size=7, blur_size=11)
+        return previous
+
+    def restore(self, engine, size=512, overlap=64, progress=None, on_mask=None, cache=None, executor=None,
+                check=None):
+        """
+        🔸 สร้างผลลัพธ์สำหรับกรอบปัจจุบัน
+           1. คำนวณ mask ใหม่ (เฉพาะกรอบที่เพิ่ม)
+           2. เลือก tile ที่ mask เปลี่ยน (หรือยังไม่มีผลลัพธ์) → ส่งเข้าโมเดล
+           3. tile อื่นใช้ผลลัพธ์เดิม แล้ว blending ทั้งหมดลงบนภาพต้นฉบับ
+        - on_mask: callback(mask) เรียกหลังได้ mask ใหม่ ก่อนรันโมเดล (เช่น ทำ preview)
+        - cache: TileCache ที่ใช้ร่วมกันทุก request (ถ้ามี) สำหรับ tile ที่ต้องคำนวณใหม่
+        - executor: TileExecutor (ถ้ามี) รัน tile บน worker process
+        - check: callback() ระหว่าง batch (ถ้ามี) ยก exception เพื่อหยุดงาน
+          tile ที่รันเสร็จแล้วยังเก็บไว้ รอบถัดไปคำนวณเฉพาะที่ยังขาด
+        - เรียกพร้อมกันได้ งานของ session เดียวกันจะรอกันตามลำดับ (compute_lock)
+        คืนค่า stats = {"tiles", "damaged", "run", "reused"}
+        """
+        with self.compute_lock:
+            with metrics.stage("mask"):
+                previous = self.update_mask(self.snapshot())
+            if on_mask is not None:
+                on_mask(self.mask)
+
+            # โมเดลถูกโหลดใหม่ → ผลลัพธ์ tile เดิมใช้ไม่ได้
+            engine.reload_if_changed()
+            if engine.checkpoint_stamp != self.checkpoint_stamp:
+                self.tiles.clear()
+                self.checkpoint_stamp = engine.checkpoint_stamp
+
+            h, w = self.shape
+            with metrics.stage("tiling"):
+                all_origins = tile_origins(h, w, size, overlap)
+                damaged = damaged_tiles(self.mask, all_origins, size)
+                changed = set(damaged_tiles(cv2.compare(previous, self.mask, cv2.CMP_NE), damaged, size))
+                todo = [o for o in damaged if o in changed or o not in self.tiles]
+            metrics.TILES_SKIPPED.inc(len(all_origins) - len(damaged))
+            metrics.TILES_REUSED.inc(len(damaged) - len(todo))
+
+            tiles = {o: self.tiles[o] for o in damaged if o not in changed and o in self.tiles}
+            try:
+                for origin, out in inpaint_origins(engine, self.image, self.mask, self.edge, todo, size,
+                                                   progress=progress, cache=cache, executor=executor,
+                                                   check=check):
+                    tiles[origin] = out
+            finally:
+                # หยุดกลางทาง: tile ที่ยังไม่ได้รันไม่อยู่ใน self.tiles จึงถูกคำนวณในรอบถัดไป
+                self.tiles = tiles
+
+            self.result = blend_tiles(self.image.copy(), tiles, self.mask, size, overlap)
+            self.last_used = time.time()
+            return {"tiles": len(all_origins), "damaged": len(damaged), "run": len(todo),
+                    "reused": len(damaged) - len(todo)}
+
+    def to_dict(self):
+        h, w = self.shape
+        boxes = self.snapshot()
+        return {
+            "session_id": self.id,
+            "width": w,
+            "height": h,
+            "boxes": {str(box_id): {"x": x1, "y": y1, "width": x2 - x1, "height": y2 - y1}
+                      for box_id, (x1, y1, x2, y2) in boxes.items()},
+        }
+
+
+class SessionStore:
+    """
+    🔸 ที่เก็บ session แบบ LRU
+    - max_sessions: จำนวน session สูงสุด (เกินแล้วลบอันที่ไม่ได้ใช้นานที่สุด)
+    - ttl: อายุสูงสุด (วินาที) นับจากการใช้งานครั้งล่าสุด
+    """
+    def __init__(self, max_sessions=8, ttl=1800):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self, img_bgr):
+        session = Session(img_bgr)
+        with self.lock:
+            self.sessions[session.id] = session
+            self._prune()
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            self._prune()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def _prune(self):
+        """ลบ session ที่หมดอายุ หรือเกินจำนวนที่กำหนด (เรียกภายใต้ self.lock)"""
+        now = time.time()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_used > self.ttl:
+                del self.sessions[session_id]
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
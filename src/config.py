@@ -48,6 +48,10 @@ DEFAULT_CONFIG = {
     'INPUT_SIZE': 256,              # input image size for training 0 for original size
     'SIGMA': 2,                     # standard deviation of the Gaussian filter used in Canny edge detector (0: random, -1: no edge)
     'MAX_ITERS': 2e6,               # maximum number of iterations to train the model
+    'TEST_BATCH_SIZE': 0,           # tiles per generator forward in test/serving (0: choose automatically)
+    'FROZEN_GRAPH': 0,              # 1: serving uses exported frozen generator graphs when present (each keeps its own weights, benchmark with export.py first)
+    'INT8': 0,                      # serving on CPU uses the int8 generator from quantize.py when present (1: on)
+    'ATTENTION_CHUNK': 0,           # query positions per self attention chunk, bounds its memory for large tiles (0: all at once)
 
     'EDGE_THRESHOLD': 0.5,          # edge detection threshold
     'L1_LOSS_WEIGHT': 1,            # l1 loss weight
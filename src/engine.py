@@ -0,0 +1,298 @@
+import os
+import re
+import random
+import threading
+import time
+import numpy as np
+import torch
+from .config import Config
+from .muralnet import MuralNet
+from .models import inference_weights_path
+from .frozen import frozen_path, freeze_generator, save_frozen, load_frozen
+from .quantize import int8_path, quantized_backend
+
+
+class InferenceEngine():
+    r"""keeps one MuralNet in memory for serving
+
+    The model is built once and reused by every request. It is rebuilt only
+    when the generator checkpoint on disk changes (mtime or size).
+
+    With FROZEN_GRAPH, frozen generator graphs exported for fixed tile
+    shapes (see export_frozen) are used instead of the eager model for
+    batches of exactly that shape. It is off by default: each graph holds
+    its own copy of the weights and on CPU it was not faster than eager.
+
+    With INT8 on a CPU device, the int8 graphs written by quantize.py
+    replace the fp32 model for every batch.
+
+    Args:
+        config_path (str): path to config.yml, the checkpoint folder is its dirname
+    """
+
+    def __init__(self, config_path='./checkpoints/config.yml'):
+        self.config_path = config_path
+        self.lock = threading.RLock()
+        self.model = None
+        self.config = None
+        self.checkpoint_stamp = None
+        self.frozen = {}
+        self.int8 = {}
+        self.warm = False
+        self.warmup_time = None
+        self._build()
+
+    def load_config(self):
+        config = Config(self.config_path)
+        config.MODE = 2
+        config.MODEL = 2
+        config.INPUT_SIZE = 512
+
+        os.environ['CUDA_VISIBLE_DEVICES'] = ','.join(str(e) for e in config.GPU)
+        if torch.cuda.is_available():
+            config.DEVICE = torch.device("cuda:{}".format(config.GPU[0]))
+        else:
+            config.DEVICE = torch.device("cpu")
+
+        return config
+
+    def _checkpoint_stamp(self, config):
+        path = inference_weights_path(config)
+        if not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _build(self):
+        config = self.load_config()
+
+        torch.manual_seed(config.SEED)
+        torch.cuda.manual_seed_all(config.SEED)
+        np.random.seed(config.SEED)
+        random.seed(config.SEED)
+
+        stamp = self._checkpoint_stamp(config)
+        model = MuralNet(config)
+        model.load()
+        model.inpaint_model.eval()
+
+        self.config = config
+        self.model = model
+        self.checkpoint_stamp = stamp
+        self.frozen = self._load_frozen() if config.FROZEN_GRAPH else {}
+        self.int8 = self._load_int8() if config.INT8 and config.DEVICE.type == 'cpu' else {}
+        self.warm = False
+        print("inference engine ready (iteration %d)" % model.inpaint_model.iteration)
+
+    def _load_frozen(self):
+        r"""loads every frozen graph in the checkpoint folder built from the current weights
+
+        Returns:
+            dict: (batch size, tile size, coarse_only) => ScriptModule
+        """
+        frozen = {}
+        pattern = re.compile(r'InpaintingModel_frozen_b(\d+)_(\d+)_(full|coarse)\.pt$')
+        for name in sorted(os.listdir(self.config.PATH)):
+            match = pattern.match(name)
+            if match is None:
+                continue
+            module = load_frozen(os.path.join(self.config.PATH, name), self.checkpoint_stamp, self.config.DEVICE)
+            if module is None:
+                print("skipping stale frozen graph %s" % name)
+                continue
+            frozen[(int(match.group(1)), int(match.group(2)), match.group(3) == 'coarse')] = module
+        if frozen:
+            print("frozen graphs: %s" % sorted(frozen))
+        return frozen
+
+    def _load_int8(self):
+        r"""loads the int8 generator graphs (see quantize.py) built from the current weights
+
+        Returns:
+            dict: coarse_only => ScriptModule
+        """
+        torch.backends.quantized.engine = quantized_backend()
+        int8 = {}
+        for coarse in (False, True):
+            path = int8_path(self.config.PATH, coarse)
+            if not os.path.exists(path):
+                continue
+            module = load_frozen(path, self.checkpoint_stamp, self.config.DEVICE, optimize=False)
+            if module is None:
+                print("skipping stale int8 graph %s" % os.path.basename(path))
+                continue
+            int8[coarse] = module
+        if int8:
+            print("int8 graphs: %s" % ['coarse' if coarse else 'full' for coarse in sorted(int8)])
+        return int8
+
+    def export_frozen(self, batch_sizes, tile_size=512, modes=(False, True)):
+        r"""traces, freezes and saves the generator for fixed input shapes
+
+        Args:
+            batch_sizes (list): batch sizes to export (serving batches of other sizes stay eager)
+            tile_size (int): tile height and width
+            modes (tuple): coarse_only values to export
+
+        Returns:
+            list: paths of the saved graphs
+        """
+        generator = self.model.inpaint_model.generator
+        if isinstance(generator, torch.nn.DataParallel):
+            generator = generator.module
+
+        paths = []
+        with self.lock:
+            for n in batch_sizes:
+                for coarse in modes:
+                    path = frozen_path(self.config.PATH, n, tile_size, coarse)
+                    save_frozen(freeze_generator(generator, n, tile_size, coarse, self.config.DEVICE),
+                                path, self.checkpoint_stamp)
+                    paths.append(path)
+            if self.config.FROZEN_GRAPH:
+                self.frozen = self._load_frozen()
+        return paths
+
+    def reload_if_changed(self):
+        r"""rebuilds the model if the generator checkpoint was replaced
+
+        Returns:
+            bool: True if the model was reloaded
+        """
+        with self.lock:
+            if self._checkpoint_stamp(self.config) == self.checkpoint_stamp:
+                return False
+            print("checkpoint changed, reloading model...")
+            was_warm = self.warm
+            self._build()
+            if was_warm:
+                self.warmup()
+            return True
+
+    def share_memory(self):
+        r"""moves the generator weights into shared memory
+
+        Called by the pre-forking server (serve.py) before it forks: every
+        worker maps the same pages instead of holding its own copy. A reload
+        inside a worker gives that worker a private copy again.
+
+        Weights loaded in place from an mmap'd inference checkpoint are left
+        alone: forked workers already share those page cache pages, and
+        copying them to shared memory would only double the master's memory.
+        """
+        with self.lock:
+            model = self.model.inpaint_model
+            if getattr(model, 'mmap_weights', False):
+                return
+            model.share_memory()
+
+    def memory_bytes(self):
+        r"""bytes held by the resident model
+
+        Returns:
+            int: parameter and buffer bytes, or the CUDA allocator total when on GPU
+        """
+        if self.config.DEVICE.type == 'cuda':
+            return torch.cuda.memory_allocated(self.config.DEVICE)
+        module = self.model.inpaint_model
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def version(self, coarse_only=False):
+        r"""identifies what produced a tile output, used as part of tile cache keys
+
+        Returns:
+            str: generator checkpoint stamp plus the inference mode
+        """
+        mtime, size = self.checkpoint_stamp or (0, 0)
+        version = '%d-%d-%s' % (mtime, size, 'coarse' if coarse_only else 'full')
+        return version + '-int8' if coarse_only in self.int8 else version
+
+    def warmup(self, tile_size=512, batch_sizes=None, coarse_only=(False, True)):
+        r"""runs representative tile batches so the first real request is not slow
+
+        The first forward at a new shape pays one-off allocator and oneDNN
+        (or cuDNN autotune) setup costs. Inputs are a noise image with a
+        damaged square in the middle, like a real masked tile.
+
+        Args:
+            tile_size (int): tile height and width
+            batch_sizes (list): batch sizes to run, defaults to 1 and batch_size(tile_size)
+            coarse_only (tuple): generator modes to run (full and preview)
+        """
+        if batch_sizes is None:
+            batch_sizes = sorted({1, self.batch_size(tile_size)})
+
+        rng = np.random.RandomState(self.config.SEED)
+        img = rng.randint(0, 256, (tile_size, tile_size, 3), dtype=np.uint8)
+        mask = np.zeros((tile_size, tile_size), np.uint8)
+        mask[tile_size // 4:tile_size * 3 // 4, tile_size // 4:tile_size * 3 // 4] = 255
+        edge = np.zeros((tile_size, tile_size), np.uint8)
+
+        with self.lock:
+            start = time.time()
+            for n in batch_sizes:
+                for coarse in coarse_only:
+                    self.inpaint_tiles([img] * n, [mask] * n, [edge] * n, coarse_only=coarse)
+            if self.config.DEVICE.type == 'cuda':
+                torch.cuda.synchronize(self.config.DEVICE)
+            self.warmup_time = time.time() - start
+            self.warm = True
+        print("warmup done in %.2fs (batch sizes %s)" % (self.warmup_time, batch_sizes))
+
+    def batch_size(self, tile_size=512):
+        r"""tiles per forward, see MuralNet.test_batch_size"""
+        return self.model.test_batch_size(tile_size)
+
+    def to_tensors(self, img_tiles, mask_tiles, edge_tiles):
+        r"""converts BGR/mask/edge uint8 tiles to the tensors Dataset would produce
+
+        Args:
+            img_tiles (list): HxWx3 uint8 BGR tiles
+            mask_tiles (list): HxW uint8 tiles, damage > 0
+            edge_tiles (list): HxW uint8 Canny tiles, edge = 255
+        """
+        imgs = np.stack(img_tiles)[..., ::-1].astype(np.float32) / 255.0
+        masks = (np.stack(mask_tiles) > 0).astype(np.float32)
+        edges = 1.0 - np.stack(edge_tiles).astype(np.float32) / 255.0
+
+        images = torch.from_numpy(np.ascontiguousarray(imgs)).permute(0, 3, 1, 2)
+        masks = torch.from_numpy(masks).unsqueeze(1)
+        edges = torch.from_numpy(edges).unsqueeze(1)
+        return images, edges, masks
+
+    def to_bgr(self, outputs):
+        r"""[0, 1] RGB tensor batch => list of HxWx3 uint8 BGR arrays"""
+        outputs = (outputs * 255.0).int().clamp(0, 255).permute(0, 2, 3, 1)
+        outputs = outputs.to(torch.uint8).cpu().numpy()[..., ::-1]
+        return [np.ascontiguousarray(o) for o in outputs]
+
+    def inpaint(self, images, edges, masks, coarse_only=False):
+        r"""runs the generator and merges the output into the known pixels
+
+        Returns:
+            torch.Tensor: outputs_merged in [0, 1], on the model device
+        """
+        model = self.model
+        device = self.config.DEVICE
+        with torch.no_grad():
+            images = images.to(device)
+            edges = edges.to(device)
+            masks = masks.to(device)
+            if coarse_only in self.int8:
+                return self.int8[coarse_only](images, edges, masks)
+            frozen = self.frozen.get((images.shape[0], images.shape[2], coarse_only))
+            if frozen is not None and images.shape[2] == images.shape[3]:
+                return frozen(images, edges, masks)
+            outputs1, outputs2 = model.inpaint_model(images, edges, masks, returnInput=False, coarseOnly=coarse_only)
+            return (outputs2 * masks) + (images * (1 - masks))
+
+    def inpaint_tiles(self, img_tiles, mask_tiles, edge_tiles, coarse_only=False):
+        r"""numpy in, numpy out version of inpaint() used by the tiling pipeline
+
+        Returns:
+            list: HxWx3 uint8 BGR tiles
+        """
+        images, edges, masks = self.to_tensors(img_tiles, mask_tiles, edge_tiles)
+        outputs = self.inpaint(images, edges, masks, coarse_only=coarse_only)
+        return self.to_bgr(outputs)
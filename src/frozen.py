@@ -0,0 +1,75 @@
+import os
+import json
+import torch
+import torch.nn as nn
+
+
+class MergedInpaint(nn.Module):
+    r"""the whole serving forward as one module: mask the input, run the
+    generator and merge its output into the known pixels
+
+    Args:
+        generator (InpaintGenerator): generator with loaded weights
+        coarse_only (bool): skip InpaintRefineNet (preview mode)
+    """
+
+    def __init__(self, generator, coarse_only=False):
+        super(MergedInpaint, self).__init__()
+        self.generator = generator
+        self.coarse_only = coarse_only
+
+    def forward(self, images, edges, masks):
+        images_masked = images * (1 - masks)
+        inputs = torch.cat((images_masked, edges), dim=1)
+        outputs1, outputs2 = self.generator(inputs, masks, returnInput2=False, coarseOnly=self.coarse_only)
+        return (outputs2 * masks) + (images * (1 - masks))
+
+
+def frozen_path(path, batch_size, tile_size=512, coarse_only=False):
+    r"""file name of a frozen graph for one input shape and mode"""
+    mode = 'coarse' if coarse_only else 'full'
+    return os.path.join(path, 'InpaintingModel_frozen_b%d_%d_%s.pt' % (batch_size, tile_size, mode))
+
+
+def freeze_generator(generator, batch_size, tile_size=512, coarse_only=False, device=torch.device('cpu')):
+    r"""traces MergedInpaint at a fixed shape and freezes it
+
+    Tracing records the path taken for this mode, so the Python branching on
+    coarseOnly/returnInput2 disappears, and freezing inlines the weights as
+    constants. Device specific optimization happens in load_frozen, because
+    graphs with prepacked oneDNN weights cannot be serialized.
+
+    Returns:
+        torch.jit.ScriptModule: graph that only accepts (batch_size, *, tile_size, tile_size) inputs
+    """
+    module = MergedInpaint(generator, coarse_only).eval()
+    images = torch.rand(batch_size, 3, tile_size, tile_size, device=device)
+    edges = torch.rand(batch_size, 1, tile_size, tile_size, device=device)
+    masks = (torch.rand(batch_size, 1, tile_size, tile_size, device=device) > 0.5).float()
+
+    with torch.no_grad():
+        traced = torch.jit.trace(module, (images, edges, masks), check_trace=False)
+        return torch.jit.freeze(traced.eval())
+
+
+def save_frozen(module, path, checkpoint_stamp):
+    r"""saves a frozen graph together with the stamp of the weights it was built from"""
+    torch.jit.save(module, path, _extra_files={'checkpoint.json': json.dumps(list(checkpoint_stamp or ()))})
+
+
+def load_frozen(path, checkpoint_stamp, device, optimize=True):
+    r"""loads a frozen graph if it was built from the current weights
+
+    With optimize, optimize_for_inference then fuses conv/elementwise ops
+    and, on CPU, converts the graph to oneDNN (MKLDNN) with prepacked
+    weights. Quantized graphs are already prepacked and skip this.
+
+    Returns:
+        torch.jit.ScriptModule or None: None when the graph is stale
+    """
+    extra = {'checkpoint.json': ''}
+    module = torch.jit.load(path, map_location=device, _extra_files=extra)
+    if json.loads(extra['checkpoint.json'] or '[]') != list(checkpoint_stamp or ()):
+        return None
+    module = module.eval()
+    return torch.jit.optimize_for_inference(module) if optimize else module
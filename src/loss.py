@@ -4,7 +4,6 @@
 
 import torch
 import torch.nn as nn
-import torchvision.models as models
 import cv2
 import numpy as np
 import torch.nn.functional as F
@@ -119,6 +118,9 @@ class PerceptualLoss(nn.Module):
 class VGG19(torch.nn.Module):
     def __init__(self):
         super(VGG19, self).__init__()
+        # torchvision is only needed for training losses, import it when the VGG is built
+        import torchvision.models as models
+
         features = models.vgg19(pretrained=True).features
         self.relu1_1 = torch.nn.Sequential()
         self.relu1_2 = torch.nn.Sequential()
@@ -11,6 +11,61 @@ from .networks import InpaintGenerator, Discriminator
 from .loss import AdversarialLoss, PerceptualLoss, StyleLoss, HistogramLoss
 
 
+# generator-only checkpoint written by export.py, see export_inference_checkpoint
+INFERENCE_CHECKPOINT_FORMAT = 'muralnet-inference-v1'
+STORAGE_DTYPES = {
+    'float32': torch.float32,
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+}
+
+
+def strip_module_prefix(state_dict):
+    r"""removes the nn.DataParallel 'module.' prefix from state dict keys"""
+    return {(k[len('module.'):] if k.startswith('module.') else k): v for k, v in state_dict.items()}
+
+
+def inference_weights_path(config, name='InpaintingModel'):
+    r"""generator weights used for inference
+
+    Prefers the compact <name>_gen_infer.pth unless the full training
+    checkpoint <name>_gen.pth is newer (i.e. the export is stale).
+    """
+    full = os.path.join(config.PATH, name + '_gen.pth')
+    compact = os.path.join(config.PATH, name + '_gen_infer.pth')
+    if os.path.exists(compact) and (not os.path.exists(full) or os.path.getmtime(compact) >= os.path.getmtime(full)):
+        return compact
+    return full
+
+
+def export_inference_checkpoint(src_path, dst_path, dtype='float32'):
+    r"""writes a generator-only checkpoint that loads without post-processing
+
+    Keys are already stripped of 'module.', the discriminator and optimizer
+    state are dropped, and floating point weights are stored as `dtype`.
+    The file uses torch's zip format so it can be loaded with mmap=True.
+
+    Args:
+        src_path (str): full training checkpoint (<name>_gen.pth)
+        dst_path (str): output path (<name>_gen_infer.pth)
+        dtype (str): float32 | float16 | bfloat16 storage dtype
+    """
+    data = torch.load(src_path, map_location='cpu')
+    storage_dtype = STORAGE_DTYPES[dtype]
+    generator = {}
+    for k, v in strip_module_prefix(data['generator']).items():
+        if v.is_floating_point():
+            v = v.to(storage_dtype)
+        generator[k] = v.contiguous().clone()
+
+    torch.save({
+        'format': INFERENCE_CHECKPOINT_FORMAT,
+        'iteration': data['iteration'],
+        'dtype': dtype,
+        'generator': generator,
+    }, dst_path)
+
+
 class BaseModel(nn.Module):
     def __init__(self, name, config):
         super(BaseModel, self).__init__()
@@ -90,7 +145,7 @@ class InpaintingModel(BaseModel):
         self.GPU = config.GPU
         # generator input: [rgb(3) + edge(1)]
         # discriminator input: [rgb(3)]
-        generator = InpaintGenerator()
+        generator = InpaintGenerator(attention_chunk=config.ATTENTION_CHUNK)
         discriminator = Discriminator(in_channels=3, use_sigmoid=config.GAN_LOSS != 'hinge')
         if len(config.GPU) > 1:
             generator = nn.DataParallel(generator, config.GPU)
@@ -308,4 +363,62 @@ class InpaintingModel(BaseModel):
         self.gen_optimizer.step()
 
 
+class InpaintingInferenceModel(BaseModel):
+    r"""generator-only InpaintingModel for test/serving
+
+    Skips the discriminator, the VGG based losses and the optimizers, and only
+    loads the generator: InpaintingModel_gen_infer.pth (see export.py) if it
+    is up to date, InpaintingModel_gen.pth otherwise.
+
+    When a checkpoint exists the generator layers are built on the meta
+    device, so no random initialisation runs before load() overwrites it.
+    """
+
+    def __init__(self, config):
+        super(InpaintingInferenceModel, self).__init__('InpaintingModel', config)
+        self.GPU = config.GPU
+
+        if os.path.exists(inference_weights_path(config, self.name)):
+            with torch.device('meta'):
+                generator = InpaintGenerator(init_weights=False, attention_chunk=config.ATTENTION_CHUNK)
+            # uninitialised storage, every tensor is replaced or filled by load()
+            generator.to_empty(device='cpu')
+        else:
+            generator = InpaintGenerator(init_weights=False, attention_chunk=config.ATTENTION_CHUNK)
+        if len(config.GPU) > 1:
+            generator = nn.DataParallel(generator, config.GPU)
+
+        self.add_module('generator', generator)
+        self.requires_grad_(False)
+        self.mmap_weights = False   # parameters are the mmap'd checkpoint tensors (see load)
+
+    def load(self):
+        path = inference_weights_path(self.config, self.name)
+        if path == self.gen_weights_path:
+            return super(InpaintingInferenceModel, self).load()
+
+        print('Loading %s generator from %s...' % (self.name, os.path.basename(path)))
+        # mmap: tensors are backed by the file (page cache) instead of being read into private memory
+        data = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+        if data.get('format') != INFERENCE_CHECKPOINT_FORMAT:
+            raise RuntimeError('%s is not an inference checkpoint' % path)
+
+        generator = self.generator.module if isinstance(self.generator, nn.DataParallel) else self.generator
+        # float32 weights on CPU are used in place (zero-copy, shared across worker processes),
+        # anything else is copied into the module parameters (and upcast from fp16/bf16)
+        on_cpu = next(generator.parameters()).device.type == 'cpu'
+        self.mmap_weights = on_cpu and data['dtype'] == 'float32'
+        generator.load_state_dict(data['generator'], assign=self.mmap_weights)
+        self.requires_grad_(False)
+        self.iteration = data['iteration']
+
+    def save(self):
+        raise RuntimeError('InpaintingInferenceModel has no discriminator/optimizer state to save')
+
+    def forward(self, images, edges, masks, returnInput=False, coarseOnly=False):
+        images_masked = (images * (1 - masks).float())
+        inputs = torch.cat((images_masked, edges), dim=1)
+        return self.generator(inputs, masks, returnInput2=returnInput, coarseOnly=coarseOnly)
+
+
 
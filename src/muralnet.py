@@ -3,11 +3,14 @@ import numpy as np
 import torch.nn as nn
 import torch
 from torch.utils.data import DataLoader
-from .dataset import Dataset
-from .models import InpaintingModel
+from .models import InpaintingModel, InpaintingInferenceModel
 from .utils import Progbar, create_dir, stitch_images, imsave
 from .metrics import PSNR, EdgeAccuracy
 
+# rough peak memory of one 512x512 tile through InpaintGenerator, used to size batches
+TILE_MEMORY_BYTES = 512 * 1024 * 1024
+MAX_AUTO_BATCH_SIZE = 8
+
 
 class MuralNet():
     def __init__(self, config):
@@ -18,7 +21,11 @@ class MuralNet():
         self.debug = False
         self.model_name = model_name
         # self.edge_model = EdgeModel(config).to(config.DEVICE)
-        self.inpaint_model = InpaintingModel(config)
+        # test mode only needs the generator
+        if config.MODE == 2:
+            self.inpaint_model = InpaintingInferenceModel(config)
+        else:
+            self.inpaint_model = InpaintingModel(config)
         self.inpaint_model.to(self.config.DEVICE) 
         self.psnr = PSNR(255.0).to(config.DEVICE)
         self.edgeacc = EdgeAccuracy(config.EDGE_THRESHOLD).to(config.DEVICE)
@@ -31,10 +38,10 @@ class MuralNet():
         # self.inpaint_model = self.inpaint_model.cuda()
 
         print(str(self.config.MODE))
-        # test mode
-        if self.config.MODE == 2:
-            self.test_dataset = Dataset(config, config.TEST_FLIST, config.TEST_EDGE_FLIST, config.TEST_MASK_FLIST, augment=False, training=False)
-        else:
+        # .dataset pulls in scipy / skimage / imageio, import it only when a dataset is built
+        self._test_dataset = None
+        if self.config.MODE != 2:
+            from .dataset import Dataset
             self.train_dataset = Dataset(config, config.TRAIN_FLIST, config.TRAIN_EDGE_FLIST, config.TRAIN_MASK_FLIST, augment=True, training=True)
             self.val_dataset = Dataset(config, config.VAL_FLIST, config.VAL_EDGE_FLIST, config.VAL_MASK_FLIST, augment=False, training=True)
             self.sample_iterator = self.val_dataset.create_iterator(config.SAMPLE_SIZE)
@@ -168,42 +175,86 @@ class MuralNet():
             logs = [("it", iteration), ] + logs
             progbar.add(len(images), values=logs)
 
+    @property
+    def test_dataset(self):
+        r"""test Dataset from config.TEST_FLIST, built on first use
+
+        Serving never calls test(), so the flists and .dataset are not
+        loaded unless test() actually needs them.
+        """
+        if self._test_dataset is None:
+            from .dataset import Dataset
+            config = self.config
+            self._test_dataset = Dataset(config, config.TEST_FLIST, config.TEST_EDGE_FLIST, config.TEST_MASK_FLIST, augment=False, training=False)
+        return self._test_dataset
+
+    def test_batch_size(self, tile_size=512):
+        r"""number of tiles per generator forward in test mode
+
+        TEST_BATCH_SIZE from the config if set, otherwise estimated from free
+        GPU memory or the number of CPU threads.
+        """
+        if self.config.TEST_BATCH_SIZE:
+            return max(1, int(self.config.TEST_BATCH_SIZE))
+
+        device = torch.device(self.config.DEVICE)
+        if device.type == 'cuda':
+            free, _ = torch.cuda.mem_get_info(device)
+            per_tile = TILE_MEMORY_BYTES * (tile_size / 512.0) ** 2
+            return max(1, min(MAX_AUTO_BATCH_SIZE, int(free * 0.5 // per_tile)))
+
+        return max(1, min(MAX_AUTO_BATCH_SIZE, torch.get_num_threads() // 2))
+
+    def test_batches(self, batch_size):
+        r"""groups consecutive test items of the same size into batches
+
+        Yields:
+            (names, images, edges, masks) with up to batch_size items each
+        """
+        test_loader = DataLoader(
+            dataset=self.test_dataset,
+            batch_size=1,
+        )
+        names, batch = [], []
+        for index, items in enumerate(test_loader):
+            if batch and (len(batch) == batch_size or items[0].shape != batch[0][0].shape):
+                yield (names,) + tuple(torch.cat(t) for t in zip(*batch))
+                names, batch = [], []
+            names.append(self.test_dataset.load_name(index))
+            batch.append(items)
+
+        if batch:
+            yield (names,) + tuple(torch.cat(t) for t in zip(*batch))
+
     def test(self):
         self.inpaint_model.eval()
 
         create_dir(self.merged_results_path)
 
-        test_loader = DataLoader(
-            dataset=self.test_dataset,
-            batch_size=1,
-        )
+        batch_size = self.test_batch_size(self.config.INPUT_SIZE or 512)
         index = 0
-        for items in test_loader:
-            name = self.test_dataset.load_name(index)
-            images, images_gray, edges, masks = self.cuda(*items)
-            index += 1
-
-            mask1 = masks
-            images1 = images
+        for names, images, images_gray, edges, masks in self.test_batches(batch_size):
+            images, edges, masks = self.cuda(images, edges, masks)
 
             outputs1, outputs2 = self.inpaint_model(images, edges, masks, returnInput=False,coarseOnly=False)
 
-            outputs_merged = (outputs2 * mask1) + (images1 * (1 - mask1))
-
-            output_merged = self.postprocess(outputs_merged)[0]
+            outputs_merged = (outputs2 * masks) + (images * (1 - masks))
+            outputs_merged = self.postprocess(outputs_merged)
 
-            path_merged = os.path.join(self.merged_results_path, name)
-            print(index, name)
+            for i, name in enumerate(names):
+                index += 1
+                path_merged = os.path.join(self.merged_results_path, name)
+                print(index, name)
 
-            imsave(output_merged, path_merged)
+                imsave(outputs_merged[i], path_merged)
 
-            if self.debug:
-                edges = self.postprocess(1 - edges)[0]
-                masked = self.postprocess(images * (1 - masks) + masks)[0]
-                fname, fext = name.split('.')
+                if self.debug:
+                    edge = self.postprocess(1 - edges[i:i + 1])[0]
+                    masked = self.postprocess(images[i:i + 1] * (1 - masks[i:i + 1]) + masks[i:i + 1])[0]
+                    fname, fext = name.split('.')
 
-                imsave(edges, os.path.join(self.merged_results_path, fname + '_edge.' + fext))
-                imsave(masked, os.path.join(self.merged_results_path, fname + '_masked.' + fext))
+                    imsave(edge, os.path.join(self.merged_results_path, fname + '_edge.' + fext))
+                    imsave(masked, os.path.join(self.merged_results_path, fname + '_masked.' + fext))
 
         if index == 0:
             print("check the test folder to make sure the folder is not none")
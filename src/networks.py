@@ -166,12 +166,24 @@ class PSA_s(nn.Module):
 
 
 class Self_Attn(nn.Module):
-    """ Self attention Layer"""
-    def __init__(self,in_dim,activation,with_attn=False):
+    """ Self attention Layer
+
+    Unless with_attn asks for the attention map, the N x N energy matrix
+    (N = W*H, 4096 for a 512 tile) is not materialised: the attention runs
+    through scaled_dot_product_attention with scale 1 (the energy is an
+    unscaled dot product). The value channels are split into heads as wide
+    as the query/key (C/8), all sharing the same query and key, so the
+    fused (flash / memory efficient) kernels that need equal head sizes
+    apply. chunk_size > 0 additionally processes that many query positions
+    at a time, which bounds the memory of the fallback (math) kernel to
+    chunk_size x N for large tiles.
+    """
+    def __init__(self,in_dim,activation,with_attn=False,chunk_size=0):
         super(Self_Attn,self).__init__()
         self.chanel_in = in_dim
         self.activation = activation
         self.with_attn = with_attn
+        self.chunk_size = chunk_size
         self.query_conv = nn.Conv2d(in_channels = in_dim , out_channels = in_dim//8 , kernel_size= 1)
         self.key_conv = nn.Conv2d(in_channels = in_dim , out_channels = in_dim//8 , kernel_size= 1)
         self.value_conv = nn.Conv2d(in_channels = in_dim , out_channels = in_dim , kernel_size= 1)
@@ -187,6 +199,9 @@ class Self_Attn(nn.Module):
                 attention: B X N X N (N is Width*Height)
         """
         m_batchsize,C,width ,height = x.size()
+        if not self.with_attn:
+            return self.gamma*self.attention(x) + x
+
         proj_query  = self.query_conv(x).view(m_batchsize,-1,width*height).permute(0,2,1) # B X CX(N)
         proj_key =  self.key_conv(x).view(m_batchsize,-1,width*height) # B X C x (*W*H)
         energy =  torch.bmm(proj_query,proj_key) # transpose check
@@ -197,10 +212,29 @@ class Self_Attn(nn.Module):
         out = out.view(m_batchsize,C,width,height)
 
         out = self.gamma*out + x
-        if self.with_attn:
-            return out, attention
+        return out, attention
+
+    def attention(self, x):
+        """ softmax(Q^T K) V without the N x N matrix, same result as the with_attn path """
+        m_batchsize,C,width ,height = x.size()
+        N = width*height
+        # the fused kernels need the feature dimension contiguous
+        query = self.query_conv(x).flatten(2).transpose(1, 2).contiguous() # B X N X C/8
+        key = self.key_conv(x).flatten(2).transpose(1, 2).contiguous() # B X N X C/8
+        dim = query.shape[-1]
+        heads = C // dim if C % dim == 0 else 1
+        # B X heads X N X C/heads, query and key are shared by every head (expand, no copy)
+        value = self.value_conv(x).flatten(2).transpose(1, 2).contiguous()
+        value = value.view(m_batchsize, N, heads, C // heads).transpose(1, 2)
+        query = query.unsqueeze(1).expand(m_batchsize, heads, N, dim)
+        key = key.unsqueeze(1).expand(m_batchsize, heads, N, dim)
+
+        if self.chunk_size and self.chunk_size < N:
+            out = torch.cat([F.scaled_dot_product_attention(q, key, value, scale=1.0)
+                             for q in query.split(self.chunk_size, dim=2)], dim=2)
         else:
-            return out
+            out = F.scaled_dot_product_attention(query, key, value, scale=1.0)
+        return out.transpose(1, 2).reshape(m_batchsize, N, C).transpose(1, 2).reshape(m_batchsize, C, width, height)
 
 # class InpaintFineGenerator(BaseNetwork):
 #     def __init__(self, residual_blocks=8, init_weights=True):
@@ -368,7 +402,7 @@ class InpaintCoarseNet(nn.Module):
         return x
 
 class InpaintRefineNet(nn.Module):
-    def __init__(self, residual_blocks=4, init_weights=True):
+    def __init__(self, residual_blocks=4, init_weights=True, attention_chunk=0):
         super(InpaintRefineNet, self).__init__()
 
         self.res_blocks = residual_blocks
@@ -395,7 +429,7 @@ class InpaintRefineNet(nn.Module):
             block = ResnetBlock(256, 2)
             blocks.append(block)
 
-        self.refine_attn = Self_Attn(256, 'relu', with_attn=False)
+        self.refine_attn = Self_Attn(256, 'relu', with_attn=False, chunk_size=attention_chunk)
         # self.refine_attn = PSA_s(256,256)
 
         self.middle = nn.Sequential(*blocks)
@@ -480,11 +514,11 @@ class InpaintRefineNet(nn.Module):
         return x
 
 class InpaintGenerator(BaseNetwork):
-    def __init__(self, residual_blocks=4, init_weights=True):
+    def __init__(self, residual_blocks=4, init_weights=True, attention_chunk=0):
         super(InpaintGenerator, self).__init__()
 
-        self.coarsenet=InpaintCoarseNet(residual_blocks=residual_blocks,init_weights=True)
-        self.refinenet=InpaintRefineNet(residual_blocks=residual_blocks,init_weights=True)
+        self.coarsenet=InpaintCoarseNet(residual_blocks=residual_blocks,init_weights=init_weights)
+        self.refinenet=InpaintRefineNet(residual_blocks=residual_blocks,init_weights=init_weights,attention_chunk=attention_chunk)
 
         if init_weights:
             self.init_weights()
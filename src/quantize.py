@@ -0,0 +1,100 @@
+import os
+import copy
+import torch
+
+from .frozen import MergedInpaint
+from .networks import Self_Attn
+
+
+def quantized_backend():
+    r"""int8 kernel library for this CPU: x86 (fbgemm + oneDNN) or qnnpack (ARM)"""
+    engines = torch.backends.quantized.supported_engines
+    for name in ('x86', 'fbgemm', 'qnnpack'):
+        if name in engines:
+            return name
+    raise RuntimeError('this torch build has no quantized CPU engine')
+
+
+def int8_path(path, coarse_only=False):
+    r"""file name of the int8 generator graph for one mode"""
+    return os.path.join(path, 'InpaintingModel_int8_%s.pt' % ('coarse' if coarse_only else 'full'))
+
+
+class Int8Calibrator():
+    r"""post-training static quantization of InpaintGenerator
+
+    InpaintCoarseNet and InpaintRefineNet are prepared with observers
+    (FX graph mode), calibrated on representative tiles and converted to
+    int8 conv/InstanceNorm/ReLU kernels. The self attention block of the
+    refine net stays fp32 (its softmax over 4096 positions does not survive
+    8 bit activations), and so does the merge into the known pixels, which
+    happens outside the two sub-networks.
+
+    Args:
+        generator (InpaintGenerator): fp32 generator, it is copied and left untouched
+        tile_size (int): tile height and width used to trace the sub-networks
+    """
+
+    def __init__(self, generator, tile_size=512):
+        self.backend = quantized_backend()
+        torch.backends.quantized.engine = self.backend
+
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+        from torch.ao.quantization.quantize_fx import prepare_fx
+
+        qconfig = get_default_qconfig_mapping(self.backend).set_module_name('refine_attn', None)
+        # Self_Attn is kept as one fp32 module instead of being traced into (its forward branches on shapes)
+        custom = PrepareCustomConfig().set_non_traceable_module_classes([Self_Attn])
+        self.generator = copy.deepcopy(generator).cpu().eval()
+        example = torch.rand(1, 4, tile_size, tile_size)
+        self.generator.coarsenet = prepare_fx(self.generator.coarsenet, qconfig, (example,), custom)
+        self.generator.refinenet = prepare_fx(self.generator.refinenet, qconfig, (example,), custom)
+        self.batches = 0
+
+    def observe(self, images, edges, masks):
+        r"""runs one batch of tiles through both sub-networks to record activation ranges
+
+        Args:
+            images (torch.Tensor): Bx3xHxW RGB in [0, 1]
+            edges (torch.Tensor): Bx1xHxW edge map
+            masks (torch.Tensor): Bx1xHxW, damage = 1
+        """
+        with torch.no_grad():
+            MergedInpaint(self.generator, coarse_only=False)(images, edges, masks)
+        self.batches += 1
+
+    def convert(self):
+        r"""replaces the observers with int8 kernels
+
+        Returns:
+            InpaintGenerator: generator whose coarse/refine nets are quantized GraphModules
+        """
+        if self.batches == 0:
+            raise RuntimeError('run observe() on calibration tiles before convert()')
+
+        from torch.ao.quantization.quantize_fx import convert_fx
+
+        generator = self.generator
+        generator.coarsenet = convert_fx(generator.coarsenet)
+        generator.refinenet = convert_fx(generator.refinenet)
+        return generator
+
+
+def freeze_int8(generator, tile_size=512, coarse_only=False):
+    r"""traces and freezes a quantized generator like freeze_generator
+
+    Unlike the fp32 graphs the int8 graph is not specialized to one batch
+    size, int8 kernels have no shape dependent prepacking.
+
+    Returns:
+        torch.jit.ScriptModule
+    """
+    module = MergedInpaint(generator, coarse_only).eval()
+    images = torch.rand(1, 3, tile_size, tile_size)
+    edges = torch.rand(1, 1, tile_size, tile_size)
+    masks = (torch.rand(1, 1, tile_size, tile_size) > 0.5).float()
+
+    with torch.no_grad():
+        traced = torch.jit.trace(module, (images, edges, masks), check_trace=False)
+        return torch.jit.freeze(traced.eval())
@@ -7,7 +7,6 @@ import sys
 import time
 import random
 import numpy as np
-import matplotlib.pyplot as plt
 from PIL import Image
 
 
@@ -45,6 +44,9 @@ def stitch_images(inputs, *outputs, img_per_row=2):
 
 
 def imshow(img, title=''):
+    # matplotlib is only needed for interactive display, keep it off the import path
+    import matplotlib.pyplot as plt
+
     fig = plt.gcf()
     fig.canvas.set_window_title(title)
     plt.axis('off')
@@ -12,6 +12,15 @@ let isDrawing = false;
 let startX, startY;
 let currentRect = null;
 let restoredImageData = null;
+let currentImageBlob = null; // ✅ ไฟล์ภาพต้นฉบับที่อัปโหลดขึ้น server (ครั้งเดียวต่อ session)
+let sessionId = null; // ✅ session ฝั่ง server (ภาพอยู่บน server แล้ว ส่งเฉพาะกรอบที่เพิ่ม/ลบ)
+let appliedBoxIds = []; // ✅ id ของกรอบที่ server ใช้อยู่ในผลลัพธ์ล่าสุด
+
+// ✅ รูปแบบไฟล์ผลลัพธ์ที่ขอจาก server
+const RESULT_FORMAT = "png";
+const PNG_COMPRESSION = 1;
+// ✅ ขอภาพตัวอย่างแบบเร็ว (coarse net บนภาพย่อ) ก่อนผลลัพธ์เต็ม
+const REQUEST_PREVIEW = true;
 let isPanning = false;
 let lastPanX, lastPanY;
 let initialScale = 1;
@@ -77,6 +86,7 @@ function processFile(file) {
     return;
   }
   selectedFile = file;
+  currentImageBlob = file;
   loadImageToCanvas(file);// โหลดขึ้น canvas
 }
 
@@ -193,6 +203,8 @@ function drawCanvas() {
   ctx.setLineDash([5, 5]);
 
   rectangles.forEach((rect) => {
+    // กรอบที่ประมวลผลแล้วเป็นสีเขียว กรอบใหม่เป็นสีส้ม
+    ctx.strokeStyle = rect.id ? "#28a745" : "#FF6B35";
     const x = rect.x * scale + offsetX;
     const y = rect.y * scale + offsetY;
     const width = rect.width * scale;
@@ -201,6 +213,7 @@ function drawCanvas() {
   });
 
   if (currentRect) {
+    ctx.strokeStyle = "#FF6B35";
     const x = currentRect.x * scale + offsetX;
     const y = currentRect.y * scale + offsetY;
     const width = currentRect.width * scale;
@@ -355,24 +368,13 @@ function updateControlButtons() {
 // ✅ START PROCESSING
 // ================================
 async function startProcessing() {
-  if (rectangles.length === 0) {
+  const added = rectangles.filter((rect) => !rect.id);
+  const removed = appliedBoxIds.filter((id) => !rectangles.some((rect) => rect.id === id));
+  if (added.length === 0 && removed.length === 0) {
     alert("กรุณาเลือกพื้นที่ที่ต้องการฟื้นฟูก่อน");
     return;
   }
 
-  // เตรียมภาพ original (เต็มขนาดจริง)
-  const tempCanvas = document.createElement("canvas");
-  tempCanvas.width = img.width;
-  tempCanvas.height = img.height;
-  const tempCtx = tempCanvas.getContext("2d");
-  tempCtx.drawImage(img, 0, 0);
-  const originalImageDataUrl = tempCanvas.toDataURL("image/png");
-
-  const payload = {
-    image: originalImageDataUrl,
-    rectangles: rectangles,
-  };
-
   // ส่วน progress bar
   const progressSection = document.getElementById("progress-section");
   const progressFill = document.getElementById("progress-fill");
@@ -387,67 +389,129 @@ async function startProcessing() {
   progressFill.style.width = "0%";
   progressText.textContent = "กำลังประมวลผล... 0%";
 
-  // ✅ polling progress
-  let polling = true;
-
-  async function pollProgress() {
-    if (!polling) return;
-    try {
-      const res = await fetch("/status");
-      const data = await res.json();
-      let target = data.progress;
-      let message = data.message || "";
-
-      // ✅ ให้ progress วิ่งทีละ % จนถึง target
-      let step = setInterval(() => {
-        if (currentProgress >= target) {
-          clearInterval(step);
-        } else {
-          currentProgress++;
-          progressFill.style.width = currentProgress + "%";
-          progressText.textContent = `กำลังประมวลผล... ${currentProgress}% (${message})`;
-        }
-      }, 30);
-
-      if (data.progress < 100) {
-        setTimeout(pollProgress, 1000);
+  try {
+    // ✅ ส่งเฉพาะกรอบที่เพิ่ม/ลบ (ภาพอยู่บน server แล้ว) ถ้า session หมดอายุจะอัปโหลดใหม่
+    const job = await submitBoxes(added, removed);
+    if (!job.success) {
+      alert("❌ เกิดข้อผิดพลาด: " + job.message);
+      return;
+    }
+
+    // ✅ รับ progress ของงานนี้แบบ real-time (Server-Sent Events)
+    const status = await watchJob(job.job_id, (progress, message) => {
+      animateProgress(progress, message, progressFill, progressText);
+    }, () => showPreview(job.job_id));
+    if (status.status !== "done") {
+      alert("❌ เกิดข้อผิดพลาด: " + (status.error || status.message));
+      return;
+    }
+
+    // ✅ ดึงผลลัพธ์เมื่องานเสร็จเป็นไฟล์ภาพไบนารี
+    const resultRes = await fetch(`/jobs/${job.job_id}/result?format=${RESULT_FORMAT}&compression=${PNG_COMPRESSION}`);
+    if (resultRes.ok) {
+      showResultOnCanvas(await resultRes.blob());
+      if (status.time) {
+        timeInfo.textContent = `ใช้เวลา: ${status.time.toFixed(2)} วินาที`;
       }
-    } catch (err) {
-      console.error("Error polling progress:", err);
+    } else {
+      const data = await resultRes.json();
+      alert("❌ เกิดข้อผิดพลาด: " + data.message);
     }
+  } catch (err) {
+    console.error("❌ Error:", err);
+    alert("เกิดข้อผิดพลาดที่ backend");
   }
+}
 
-  pollProgress();
-
-  // ✅ ส่งข้อมูลไป backend
-  try {
-    const res = await fetch("/process", {
+// ✅ ส่งกรอบเข้า session → ได้ job id กลับมา และผูก id ของกรอบที่ server กำหนดให้
+async function submitBoxes(added, removed) {
+  let res = null;
+  if (sessionId) {
+    res = await fetch(`/sessions/${sessionId}/boxes?preview=${REQUEST_PREVIEW ? 1 : 0}`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(payload),
+      body: JSON.stringify({ add: added, remove: removed }),
     });
+    if (res.status === 404) {
+      res = null; // session ถูกลบไปแล้ว → อัปโหลดภาพใหม่พร้อมกรอบทั้งหมด
+    }
+  }
+  if (!res) {
+    rectangles.forEach((rect) => delete rect.id);
+    added = rectangles;
+    // ✅ อัปโหลดไฟล์ภาพต้นฉบับเป็นไบนารี (multipart) ครั้งเดียวต่อ session
+    const payload = new FormData();
+    payload.append("image", currentImageBlob);
+    payload.append("rectangles", JSON.stringify(added));
+    payload.append("preview", REQUEST_PREVIEW ? "1" : "0");
+    res = await fetch("/sessions", { method: "POST", body: payload });
+  }
+  const job = await res.json();
+  if (job.success) {
+    sessionId = job.session_id;
+    job.added.forEach((id, i) => (added[i].id = id));
+    appliedBoxIds = Object.keys(job.boxes).map(Number);
+  }
+  return job;
+}
 
-    const data = await res.json();
-    polling = false;
+// ✅ ฟัง event ความคืบหน้าจาก server จนกว่างานจะเสร็จ, error หรือถูกยกเลิก
+function watchJob(jobId, onProgress, onPreview) {
+  return new Promise((resolve) => {
+    const source = new EventSource(`/jobs/${jobId}/events`);
+    source.addEventListener("progress", (e) => {
+      const data = JSON.parse(e.data);
+      onProgress(data.progress, data.message || "");
+    });
+    source.addEventListener("preview", (e) => {
+      if (onPreview) onPreview(JSON.parse(e.data));
+    });
+    source.addEventListener("done", (e) => {
+      source.close();
+      resolve(JSON.parse(e.data));
+    });
+    source.addEventListener("cancelled", (e) => {
+      source.close();
+      resolve(JSON.parse(e.data)); // ถูกยกเลิก / เลย deadline (ข้อความอยู่ใน error)
+    });
+    source.addEventListener("error", (e) => {
+      source.close();
+      // event "error" จาก server มีข้อมูลงาน ส่วน error ของการเชื่อมต่อจะไม่มี e.data
+      resolve(e.data ? JSON.parse(e.data) : { status: "error", message: "connection lost" });
+    });
+  });
+}
 
-    if (data.success) {
-      showResultOnCanvas(data.result);
-      if (data.time) {
-        timeInfo.textContent = `ใช้เวลา: ${data.time.toFixed(2)} วินาที`;
-      }
+// ✅ ให้ progress วิ่งทีละ % จนถึง target
+function animateProgress(target, message, progressFill, progressText) {
+  let step = setInterval(() => {
+    if (currentProgress >= target) {
+      clearInterval(step);
     } else {
-      alert("❌ เกิดข้อผิดพลาด: " + data.message);
+      currentProgress++;
+      progressFill.style.width = currentProgress + "%";
+      progressText.textContent = `กำลังประมวลผล... ${currentProgress}% (${message})`;
     }
-  } catch (err) {
-    console.error("❌ Error:", err);
-    alert("เกิดข้อผิดพลาดที่ backend");
+  }, 30);
+}
+
+// ✅ แสดงภาพตัวอย่างระหว่างรอผลเต็ม (ไม่แทนภาพใน canvas และไม่ใช้เป็นไฟล์สำหรับรอบถัดไป)
+async function showPreview(jobId) {
+  const res = await fetch(`/jobs/${jobId}/preview?format=jpeg&quality=85`);
+  if (!res.ok) return;
+  if (restoredImageData) {
+    URL.revokeObjectURL(restoredImageData);
   }
+  restoredImageData = URL.createObjectURL(await res.blob());
+  document.getElementById("restored-result").src = restoredImageData;
+  document.querySelector("#result-section .result-title").textContent = "👀 ภาพตัวอย่าง (กำลังประมวลผลผลลัพธ์เต็ม...)";
+  document.getElementById("result-section").style.display = "block";
 }
 
 // ================================
 // ✅ SHOW RESULT ON CANVAS
 // ================================
-function showResultOnCanvas(resultUrl) {
+function showResultOnCanvas(resultBlob) {
   const progressSection = document.getElementById("progress-section");
   const resultSection = document.getElementById("result-section");
   const restoredResult = document.getElementById("restored-result");
@@ -455,10 +519,13 @@ function showResultOnCanvas(resultUrl) {
   // ซ่อน progress bar
   progressSection.style.display = "none";
 
-  // ✅ โหลดภาพที่ผ่านการฟื้นฟูมาแทนใน canvas
+  // ✅ แสดงภาพที่ผ่านการฟื้นฟูใน canvas โดยคงกรอบไว้ (แก้กรอบต่อได้ server คำนวณใหม่เฉพาะส่วนที่เปลี่ยน)
+  if (restoredImageData) {
+    URL.revokeObjectURL(restoredImageData);
+  }
+  const resultUrl = URL.createObjectURL(resultBlob);
   img = new Image();
   img.onload = function () {
-    rectangles = [];
     setupCanvas();
     updateControlButtons();
     document.getElementById("process-btn").style.display = "inline-block";
@@ -467,6 +534,7 @@ function showResultOnCanvas(resultUrl) {
 
   // ✅ แสดงผลลัพธ์
   restoredResult.src = resultUrl;
+  document.querySelector("#result-section .result-title").textContent = "✨ การฟื้นฟูเสร็จสมบูรณ์! ✨";
   resultSection.style.display = "block";
 
   // เก็บผลลัพธ์ไว้สำหรับดาวน์โหลด
@@ -482,7 +550,7 @@ function downloadResult() {
 
   const link = document.createElement("a");
   link.href = restoredResult.src;
-  link.download = "restored_mural.png";
+  link.download = `restored_mural.${RESULT_FORMAT}`;
   link.click();
 }
 
@@ -497,7 +565,16 @@ function changeImage() {
   offsetX = 0;
   offsetY = 0;
   img = null;
+  if (restoredImageData) {
+    URL.revokeObjectURL(restoredImageData);
+  }
   restoredImageData = null;
+  currentImageBlob = null;
+  if (sessionId) {
+    fetch(`/sessions/${sessionId}`, { method: "DELETE" });
+  }
+  sessionId = null;
+  appliedBoxIds = [];
 
   // Clear canvas
   if (canvas && ctx) {
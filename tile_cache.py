@@ -0,0 +1,167 @@
+# ============================================================
+#  Thai Mural Restoration System - Tile Result Cache
+#  🟡 Function: เก็บผลลัพธ์ของโมเดลราย tile โดยใช้ hash ของ
+#  (tile ภาพ, tile mask, tile edge, เวอร์ชัน checkpoint) เป็น key →
+#  tile ที่เหมือนเดิมทุกบิตไม่ต้องรันโมเดลซ้ำ (ใช้ร่วมกันทุก request)
+#  มี 2 ชั้น: หน่วยความจำ (LRU) + ดิสก์ (ไม่บังคับ, จำกัดขนาดรวม)
+# ============================================================
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def tile_key(img_tile, mask_tile, edge_tile, version):
+    """
+    🔸 key ของ tile = hash ของข้อมูลทุกอย่างที่โมเดลเห็น + เวอร์ชันโมเดล
+    - รวม shape ไว้ด้วย เพื่อไม่ให้ tile ต่างขนาดที่ไบต์เรียงเหมือนกันชนกัน
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(str(version).encode("utf-8"))
+    for arr in (img_tile, mask_tile, edge_tile):
+        arr = np.ascontiguousarray(arr)
+        h.update(repr((arr.shape, arr.dtype.str)).encode("utf-8"))
+        h.update(arr.data)
+    return h.hexdigest()
+
+
+class TileCache:
+    """
+    🔸 cache ผลลัพธ์ tile (BGR uint8)
+    - max_items: จำนวน tile สูงสุดในหน่วยความจำ (LRU, None = ไม่จำกัดจำนวน)
+    - disk_dir: โฟลเดอร์เก็บ tile บนดิสก์ (None = ใช้หน่วยความจำอย่างเดียว)
+    - disk_bytes: ขนาดรวมสูงสุดบนดิสก์ เกินแล้วลบไฟล์ที่ใช้ล่าสุดนานที่สุดก่อน
+    - max_bytes: ขนาดรวมสูงสุดของ tile ในหน่วยความจำ (None = ไม่จำกัด)
+      cache อยู่ในหน่วยความจำของแต่ละ process: ใช้หลาย worker (serve.py) คิดเป็นต่อ worker
+    """
+    def __init__(self, max_items=1024, disk_dir=None, disk_bytes=2 * 1024 ** 3, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.memory_used = 0
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.disk = OrderedDict()      # key → ขนาดไฟล์ เรียงจากใช้ล่าสุดนานที่สุด
+        self.disk_used = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    # ---------- ดิสก์ ----------
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".npy")
+
+    def _scan_disk(self):
+        """โหลดรายการไฟล์ที่มีอยู่แล้ว (เรียงตามเวลาแก้ไข) เพื่อให้ cache บนดิสก์ใช้ต่อได้หลังรีสตาร์ท"""
+        entries = []
+        for sub in os.listdir(self.disk_dir):
+            folder = os.path.join(self.disk_dir, sub)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.endswith(".npy"):
+                    st = os.stat(os.path.join(folder, name))
+                    entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_used += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """ลบไฟล์เก่าจนขนาดรวมไม่เกิน disk_bytes (เรียกภายใต้ self.lock)"""
+        while self.disk and self.disk_used > self.disk_bytes:
+            key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _read_disk(self, key):
+        try:
+            tile = np.load(self._path(key))
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            return None
+        return tile
+
+    def _write_disk(self, key, tile):
+        """เขียนไฟล์ชั่วคราวแล้ว rename เพื่อไม่ให้ process อื่นอ่านไฟล์ที่เขียนไม่ครบ"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as f:
+            np.save(f, tile)
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    # ---------- API ----------
+    def get(self, key):
+        """คืน tile ที่เคยเก็บไว้ (หน่วยความจำก่อน แล้วดิสก์) หรือ None"""
+        with self.lock:
+            tile = self.memory.get(key)
+            if tile is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return tile
+            on_disk = key in self.disk
+            if on_disk:
+                self.disk.move_to_end(key)
+        if on_disk:
+            tile = self._read_disk(key)
+            if tile is not None:
+                tile.setflags(write=False)
+                with self.lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._remember(key, tile)
+                return tile
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, tile):
+        """เก็บ tile ผลลัพธ์ (ต้องไม่ถูกแก้ไขภายหลัง)"""
+        tile = np.ascontiguousarray(tile)
+        tile.setflags(write=False)
+        with self.lock:
+            self._remember(key, tile)
+            if not self.disk_dir or key in self.disk:
+                return
+        size = self._write_disk(key, tile)
+        with self.lock:
+            if key not in self.disk:
+                self.disk[key] = size
+                self.disk_used += size
+                self._evict_disk()
+
+    def _remember(self, key, tile):
+        """เพิ่มเข้าชั้นหน่วยความจำแล้วตัดอันที่ใช้นานที่สุดออก (เรียกภายใต้ self.lock)"""
+        old = self.memory.pop(key, None)
+        if old is not None:
+            self.memory_used -= old.nbytes
+        self.memory[key] = tile
+        self.memory_used += tile.nbytes
+        while self.memory and ((self.max_items is not None and len(self.memory) > self.max_items)
+                               or (self.max_bytes is not None and self.memory_used > self.max_bytes)):
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= evicted.nbytes
+
+    def stats(self):
+        with self.lock:
+            return {
+                "items": len(self.memory),
+                "bytes": self.memory_used,
+                "disk_items": len(self.disk),
+                "disk_bytes": self.disk_used,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
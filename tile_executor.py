@@ -0,0 +1,146 @@
+# ============================================================
+#  Thai Mural Restoration System - Tile Executor
+#  🟡 Function: กระจาย batch ของ tile ไปยัง worker process หลายตัว
+#  แต่ละ worker มี generator ของตัวเอง (fork จาก process หลัก จึงใช้หน้าหน่วยความจำ
+#  ของน้ำหนักร่วมกันแบบ copy-on-write จนกว่าจะโหลด checkpoint ใหม่) และจำกัดจำนวน
+#  torch thread ต่อ worker (เลือก pin กับ core ได้) เพื่อไม่ให้ thread แย่ง core กัน
+#  เมื่อมีหลายงานรันพร้อมกัน
+#
+#  ใช้ผ่าน inpaint_origins(..., executor=...) ใน tiling.py: ผลลัพธ์ออกมาตามลำดับ
+#  batch เหมือนรันใน process เดียว แล้วส่งต่อไปที่ TileBlender ตามเดิม
+# ============================================================
+
+import os
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+# engine ของ process หลัก: ตั้งก่อน fork แล้ว worker ได้สำเนาไปใช้
+_engine = None
+
+
+def _init_worker(threads, cores, warmup_size, ready):
+    """
+    🔸 ตั้งค่า worker ตอนเริ่ม process (ครั้งเดียวต่อ worker)
+    - threads: จำนวน intra-op thread ของ torch, inter-op = 1
+    - cores: queue ของชุด core (ถ้า pin) worker หยิบไปหนึ่งชุด
+    - warmup_size: ขนาด tile สำหรับ warmup (None = ไม่ warmup) แล้ว release ready
+    """
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass    # process หลักใช้ inter-op pool ไปแล้ว (ค่าติดมากับ fork)
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores.get())
+    try:
+        if warmup_size:
+            _engine.warmup(warmup_size)
+    finally:
+        ready.release()
+
+
+def _inpaint_batch(img_tiles, mask_tiles, edge_tiles, coarse_only):
+    """รัน batch หนึ่งใน worker คืน (tile ผลลัพธ์, เวลา forward)"""
+    _engine.reload_if_changed()
+    start_time = time.perf_counter()
+    outputs = _engine.inpaint_tiles(img_tiles, mask_tiles, edge_tiles, coarse_only=coarse_only)
+    return outputs, time.perf_counter() - start_time
+
+
+def _worker_info(_):
+    """(pid, torch threads, cores) ของ worker ที่รับงานนี้"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    return os.getpid(), torch.get_num_threads(), cores
+
+
+def core_groups(workers, threads):
+    """แบ่ง core ที่ process นี้ใช้ได้เป็นกลุ่มติดกัน กลุ่มละ threads core (วนซ้ำถ้า core ไม่พอ)"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    return [[cores[(i * threads + j) % len(cores)] for j in range(threads)] for i in range(workers)]
+
+
+class TileExecutor:
+    """
+    🔸 pool ของ worker process สำหรับรัน tile batch
+    - engine: InferenceEngine ที่โหลดแล้ว (ต้องสร้าง executor ก่อนเริ่ม thread อื่น เพราะใช้ fork)
+    - workers: จำนวน process
+    - threads: torch thread ต่อ worker (None = แบ่ง core เท่า ๆ กัน)
+    - pin: ผูกแต่ละ worker กับกลุ่ม core ของตัวเอง (Linux)
+    - warmup_size: ขนาด tile ที่ worker warmup ตอนเริ่ม (None = ไม่ warmup)
+    - max_pending: จำนวน batch ที่ส่งไปรอใน pool ต่อหนึ่งงาน (None = 2 เท่าของ workers)
+    """
+    def __init__(self, engine, workers, threads=None, pin=False, warmup_size=None, max_pending=None):
+        global _engine
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        self.engine = engine
+        self.workers = workers
+        self.threads = threads or max(1, cpus // workers)
+        self.max_pending = max_pending or 2 * workers
+        self.warm = False
+        self.warmup_time = None
+
+        context = multiprocessing.get_context("fork")
+        cores = None
+        if pin:
+            cores = context.Queue()
+            for group in core_groups(workers, self.threads):
+                cores.put(group)
+        self._ready = context.Semaphore(0)
+        self._warmup = bool(warmup_size)
+        self._start_time = time.time()
+
+        _engine = engine
+        self.pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                        initargs=(self.threads, cores, warmup_size, self._ready))
+        # fork ทุก worker ทันที (ตอนนี้ยังไม่มี thread อื่นที่อาจถือ lock อยู่)
+        self._started = self.pool.submit(_worker_info, None)
+
+    def wait_ready(self):
+        """รอจน worker ทุกตัวเริ่มเสร็จ (รวม warmup) แล้วคืนเวลาที่ใช้"""
+        for _ in range(self.workers):
+            self._ready.acquire()
+        self._started.result()
+        self.warmup_time = time.time() - self._start_time
+        self.warm = self._warmup
+        print("tile executor ready: %d workers x %d threads (%.2fs)" % (self.workers, self.threads, self.warmup_time))
+        return self.warmup_time
+
+    def batch_size(self, tile_size=512):
+        """tile ต่อ batch ของแต่ละ worker: TEST_BATCH_SIZE ถ้าตั้งไว้ ไม่งั้นตามจำนวน thread ของ worker"""
+        config = self.engine.config
+        if config.TEST_BATCH_SIZE:
+            return max(1, int(config.TEST_BATCH_SIZE))
+        return max(1, self.threads // 2)
+
+    def map(self, batches, coarse_only=False):
+        """
+        🔸 รัน batches [(img_tiles, mask_tiles, edge_tiles), ...] บน worker
+        - yield (tile ผลลัพธ์, เวลา forward) ตามลำดับ batch
+        - ส่งล่วงหน้าไม่เกิน max_pending batch (ไม่ถือ tile ของทั้งภาพไว้ในคิวทีเดียว)
+        """
+        batches = iter(batches)
+        pending = deque()
+
+        def submit():
+            batch = next(batches, None)
+            if batch is not None:
+                pending.append(self.pool.submit(_inpaint_batch, *batch, coarse_only))
+
+        for _ in range(self.max_pending):
+            submit()
+        try:
+            while pending:
+                result = pending.popleft().result()
+                submit()
+                yield result
+        finally:
+            # ผู้เรียกหยุดกลางทาง (error / ยกเลิก) → ไม่ต้องรัน batch ที่ยังค้างในคิว
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
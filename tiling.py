@@ -0,0 +1,307 @@
+# ============================================================
+#  Thai Mural Restoration System - In-memory Tiling Pipeline
+#  🟡 Function: แบ่งภาพ/mask/edge (numpy) เป็น tile → ส่งเข้าโมเดล →
+#  รวมผลลัพธ์กลับด้วย blending ทั้งหมดในหน่วยความจำ (ไม่เขียนไฟล์ PNG)
+# ============================================================
+
+import functools
+import time
+import numpy as np
+import cv2
+from tile_cache import tile_key
+import metrics
+
+
+# ============================================================
+#  🔹 Edge map
+# ============================================================
+
+def create_edge_map(img_np):
+    """สร้าง edge map ด้วย Canny edge detection"""
+    gray = cv2.cvtColor(img_np, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, 100, 200)
+    edge_white = np.zeros_like(edges)
+    edge_white[edges > 0] = 255     # พื้นหลังขาว เส้นขอบดำ
+    return edge_white
+
+
+# ============================================================
+#  🔹 แบ่ง tile
+# ============================================================
+
+def _axis_origins(n, size, stride):
+    """ตำแหน่งเริ่มของ tile บนแกนเดียว tile สุดท้ายชิดขอบภาพพอดี (ไม่ต้อง padding ถ้าภาพใหญ่กว่า tile)"""
+    if n <= size:
+        return [0]
+    origins = list(range(0, n - size + 1, stride))
+    if origins[-1] != n - size:
+        origins.append(n - size)
+    return origins
+
+def tile_origins(h, w, size=512, overlap=64):
+    """
+    คืนตำแหน่งมุมซ้ายบน (y, x) ของทุก tile
+    - tile ติดกันซ้อนทับกัน overlap พิกเซล (stride = size - overlap)
+    """
+    stride = size - overlap
+    if stride <= 0:
+        raise ValueError("overlap must be smaller than the tile size")
+    return [(y, x) for y in _axis_origins(h, size, stride) for x in _axis_origins(w, size, stride)]
+
+def extract_tile(arr, y, x, size=512):
+    """ตัด tile ขนาด size x size ที่ (y, x) ถ้าเกินขอบภาพให้เติมศูนย์ (padding)"""
+    patch = arr[y:y+size, x:x+size]
+    ph, pw = patch.shape[:2]
+    if ph == size and pw == size:
+        return patch
+    padded = np.zeros((size, size) + arr.shape[2:], dtype=arr.dtype)
+    padded[:ph, :pw] = patch
+    return padded
+
+def damaged_tiles(mask_np, origins, size=512, margin=0):
+    """
+    🔸 เลือกเฉพาะ tile ที่มีพิกเซลเสียหาย (mask > 0) อยู่ในกรอบ tile ขยายออกไป margin พิกเซล
+    - tile ที่ไม่มี mask เลย ผลลัพธ์จะเท่ากับภาพเดิมทุกพิกเซล จึงไม่ต้องส่งเข้าโมเดล
+    - ใช้ integral image นับพิกเซลในแต่ละกรอบแบบ O(1) ต่อ tile
+    """
+    h, w = mask_np.shape[:2]
+    integral = cv2.integral((mask_np > 0).astype(np.uint8))
+    selected = []
+    for y, x in origins:
+        y1, x1 = max(0, y - margin), max(0, x - margin)
+        y2, x2 = min(h, y + size + margin), min(w, x + size + margin)
+        count = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        if count > 0:
+            selected.append((y, x))
+    return selected
+
+
+# ============================================================
+#  🔹 รวม tile กลับเป็นภาพเต็ม
+# ============================================================
+
+@functools.lru_cache(maxsize=8)
+def blend_window(size=512, overlap=64):
+    """
+    🔸 น้ำหนัก 2 มิติของ tile (คำนวณครั้งเดียวแล้ว cache)
+    - กลาง tile = 1, ขอบแต่ละด้านลดลงแบบ cosine (Hann) ในช่วง overlap พิกเซล
+    - ทางลงของ tile หนึ่งกับทางขึ้นของ tile ถัดไปรวมกันได้ 1 พอดี จึงไม่มีรอยต่อ
+    """
+    ramp = np.ones(size, dtype=np.float32)
+    if overlap > 0:
+        t = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+        up = 0.5 - 0.5 * np.cos(np.pi * t)
+        ramp[:overlap] = up
+        ramp[size - overlap:] = up[::-1]
+    window = np.outer(ramp, ramp)
+    window.setflags(write=False)
+    return window
+
+def tiles_region(origins, full_size, size=512):
+    """กรอบ (y0, x0, y1, x1) ที่ครอบคลุมทุก tile ใน origins (ตัดให้อยู่ในภาพ)"""
+    h, w = full_size
+    ys = [y for y, _ in origins]
+    xs = [x for _, x in origins]
+    return min(ys), min(xs), min(h, max(ys) + size), min(w, max(xs) + size)
+
+
+class TileBlender:
+    """
+    🔸 สะสมผลลัพธ์ของแต่ละ tile ลงใน canvas แบบถ่วงน้ำหนักด้วย blend_window
+    - จอง canvas (3 ช่อง) + weight (1 ช่อง) เฉพาะกรอบ region ที่มี tile ถูกประมวลผล
+    - ใช้ buffer ชั่วคราวขนาด tile ที่จองไว้ล่วงหน้า ไม่สร้าง array ใหม่ทุก tile
+    """
+    def __init__(self, region, size=512, overlap=64, canvas=None, weight=None):
+        self.y0, self.x0, self.y1, self.x1 = region
+        h, w = self.y1 - self.y0, self.x1 - self.x0
+        # canvas / weight ส่งเข้ามาเองได้ (เช่น np.memmap บนดิสก์สำหรับภาพขนาดใหญ่มาก) ต้องเป็นศูนย์ทั้งหมด
+        self.canvas = np.zeros((h, w, 3), dtype=np.float32) if canvas is None else canvas
+        self.weight = np.zeros((h, w), dtype=np.float32) if weight is None else weight
+        self.band = size
+        self.window = blend_window(size, overlap)
+        self._scratch = np.empty((size, size, 3), dtype=np.float32)
+
+    def add(self, patch, y, x):
+        ph = min(patch.shape[0], self.y1 - y)
+        pw = min(patch.shape[1], self.x1 - x)
+        ys, xs = y - self.y0, x - self.x0
+        win = self.window[:ph, :pw]
+        scratch = self._scratch[:ph, :pw]
+        np.multiply(patch[:ph, :pw], win[..., None], out=scratch)
+        self.canvas[ys:ys+ph, xs:xs+pw] += scratch
+        self.weight[ys:ys+ph, xs:xs+pw] += win
+
+    def paste_into(self, out, mask=None):
+        """
+        เฉลี่ย canvas แล้ววางลงใน out (BGR uint8 ขนาดเต็มภาพ)
+        - ถ้าให้ mask มา จะวางเฉพาะพิกเซลที่เสียหาย พิกเซลอื่นคงค่าเดิมของ out ไว้ทุกบิต
+        - ทำทีละแถบ (band) สูง size แถว เพื่อให้ array ชั่วคราวมีขนาดไม่เกินแถบเดียว
+        """
+        for top in range(0, self.y1 - self.y0, self.band):
+            bottom = min(top + self.band, self.y1 - self.y0)
+            canvas = np.asarray(self.canvas[top:bottom])
+            weight = np.asarray(self.weight[top:bottom])
+            covered = weight > 0
+            blended = np.divide(canvas, weight[..., None], where=covered[..., None], out=np.zeros_like(canvas))
+            np.add(blended, 0.5, out=blended)
+            blended = blended.astype(np.uint8)
+            if mask is not None:
+                covered &= np.asarray(mask[self.y0 + top:self.y0 + bottom, self.x0:self.x1]) > 0
+            out[self.y0 + top:self.y0 + bottom, self.x0:self.x1][covered] = blended[covered]
+        return out
+
+
+# ============================================================
+#  🔹 Pipeline หลัก
+# ============================================================
+
+def inpaint_origins(engine, img_bgr, mask_np, edge_np, origins, size=512, batch_size=None,
+                    progress=None, coarse_only=False, cache=None, stats=None, executor=None, check=None):
+    """
+    🔸 ส่ง tile ที่ตำแหน่ง origins เข้า engine.inpaint_tiles ทีละ batch
+    - yield ((y, x), tile ผลลัพธ์ BGR uint8) tile ที่มีใน cache ออกมาก่อน แล้วตามด้วยที่รันโมเดล
+    - cache: TileCache (ถ้ามี) ค้นด้วย hash ของ tile ก่อนรันโมเดล และเก็บผลลัพธ์ใหม่ลงไป
+    - stats: dict (ถ้ามี) เพิ่มจำนวน tile ที่ได้จาก cache ใน stats["cached"]
+    - progress: callback(done, total) เรียกหลังประมวลผลแต่ละ batch (ถ้ามี)
+    - executor: TileExecutor (ถ้ามี) รันหลาย batch พร้อมกันบน worker process แทน process นี้
+    - check: callback() เรียกก่อนเริ่มและหลังแต่ละ batch (ถ้ามี) ยก exception เพื่อหยุดงาน
+      (เช่น Job.check) แล้ว batch ที่ส่งล่วงหน้าไว้ใน executor จะถูกยกเลิก
+    """
+    engine.reload_if_changed()
+    if batch_size is None:
+        batch_size = (executor or engine).batch_size(size)
+
+    def tiles(y, x):
+        return extract_tile(img_bgr, y, x, size), extract_tile(mask_np, y, x, size), extract_tile(edge_np, y, x, size)
+
+    keys = {}
+    if cache is not None:
+        version = engine.version(coarse_only)
+        missing = []
+        for origin in origins:
+            key = tile_key(*tiles(*origin), version)
+            out = cache.get(key)
+            if out is None:
+                keys[origin] = key
+                missing.append(origin)
+            else:
+                yield origin, out
+        cached = len(origins) - len(missing)
+        metrics.CACHE_HITS.inc(cached)
+        metrics.CACHE_MISSES.inc(len(missing))
+        if stats is not None:
+            stats["cached"] = stats.get("cached", 0) + cached
+        if progress is not None and cached:
+            progress(cached, len(origins))
+        origins, done = missing, cached
+    else:
+        done = 0
+
+    batches = [origins[start:start + batch_size] for start in range(0, len(origins), batch_size)]
+
+    def inputs(batch):
+        return [list(t) for t in zip(*(tiles(y, x) for y, x in batch))]
+
+    def run_local():
+        for batch in batches:
+            start_time = time.perf_counter()
+            outputs = engine.inpaint_tiles(*inputs(batch), coarse_only=coarse_only)
+            yield outputs, time.perf_counter() - start_time
+
+    if check is not None:
+        check()
+    if executor is None:
+        results = run_local()
+    else:
+        results = executor.map((inputs(batch) for batch in batches), coarse_only)
+
+    total = done + len(origins)
+    try:
+        for batch, (outputs, forward_time) in zip(batches, results):
+            per_tile = forward_time / len(batch)
+            for _ in batch:
+                metrics.FORWARD_SECONDS.observe(per_tile)
+            metrics.TILES_PROCESSED.inc(len(batch))
+            for origin, out in zip(batch, outputs):
+                if cache is not None:
+                    cache.put(keys[origin], out)
+                yield origin, out
+            done += len(batch)
+            if progress is not None:
+                progress(done, total)
+            if check is not None:
+                check()
+    finally:
+        # หยุดกลางทาง → ปิด generator ของ executor ทันที (ยกเลิก batch ที่ยังค้างในคิว)
+        results.close()
+
+def blend_tiles(result, tiles, mask_np, size=512, overlap=64):
+    """
+    รวม tile ผลลัพธ์ {(y, x): tile} ลงใน result (แก้ไขในที่) เฉพาะพิกเซลที่ mask เสียหาย
+    """
+    if not tiles:
+        return result
+    with metrics.stage("blend"):
+        blender = TileBlender(tiles_region(list(tiles), result.shape[:2], size), size, overlap)
+        for (y, x), out in tiles.items():
+            blender.add(out, y, x)
+        return blender.paste_into(result, mask_np)
+
+def restore_image(engine, img_bgr, mask_np, edge_np, size=512, overlap=64, batch_size=None,
+                  margin=0, progress=None, coarse_only=False, cache=None, executor=None, check=None):
+    """
+    🔸 ฟื้นฟูภาพทั้งภาพในหน่วยความจำ
+       1. แบ่ง img / mask / edge เป็น tile และเลือกเฉพาะ tile ที่มีบริเวณเสียหาย
+       2. ส่ง tile เข้า engine.inpaint_tiles ทีละ batch (หลาย tile ต่อการรันโมเดลหนึ่งครั้ง)
+       3. รวมผลลัพธ์ด้วย TileBlender (window แบบ cosine) เฉพาะพิกเซลที่เสียหาย ส่วนที่เหลือคัดลอกจากภาพต้นฉบับ
+    - overlap: จำนวนพิกเซลที่ tile ติดกันซ้อนทับกัน
+    - batch_size: จำนวน tile ต่อ batch (None = ให้ engine เลือกอัตโนมัติ)
+    - margin: ขยายกรอบตรวจ mask ของแต่ละ tile (พิกเซล)
+    - progress: callback(done, total) เรียกหลังประมวลผลแต่ละ batch (ถ้ามี)
+    - coarse_only: รันเฉพาะ InpaintCoarseNet (ข้าม refine net + Self_Attn) เร็วกว่าแต่หยาบกว่า
+    - cache: TileCache (ถ้ามี) tile ที่เคยรันแล้วไม่ต้องรันโมเดลซ้ำ
+    - executor: TileExecutor (ถ้ามี) รัน batch บน worker process หลายตัวพร้อมกัน
+    - check: callback() ระหว่าง batch (ถ้ามี) ยก exception เพื่อหยุดงาน เช่น Job.check
+    คืนค่า (ภาพผลลัพธ์ BGR uint8, stats = {"tiles", "run", "skipped", "cached"})
+    """
+    h, w = img_bgr.shape[:2]
+    with metrics.stage("tiling"):
+        all_origins = tile_origins(h, w, size, overlap)
+        origins = damaged_tiles(mask_np, all_origins, size, margin)
+    stats = {"tiles": len(all_origins), "run": len(origins), "skipped": len(all_origins) - len(origins),
+             "cached": 0}
+    metrics.TILES_SKIPPED.inc(stats["skipped"])
+    result = img_bgr.copy()
+    if not origins:
+        return result, stats
+    blender = TileBlender(tiles_region(origins, (h, w), size), size, overlap)
+
+    # เวลา blending = เวลา add ทุก tile + paste_into (ไม่รวมเวลาที่รอโมเดล)
+    blend_time = 0.0
+    for (y, x), out in inpaint_origins(engine, img_bgr, mask_np, edge_np, origins, size, batch_size,
+                                       progress, coarse_only, cache, stats, executor, check):
+        start_time = time.perf_counter()
+        blender.add(out, y, x)
+        blend_time += time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    blender.paste_into(result, mask_np)
+    metrics.STAGE_SECONDS.labels(stage="blend").observe(blend_time + time.perf_counter() - start_time)
+    return result, stats
+
+def preview_image(engine, img_bgr, mask_np, scale=0.5, size=512, overlap=64, progress=None, cache=None,
+                  executor=None, check=None):
+    """
+    🔸 ภาพตัวอย่างแบบเร็ว: ย่อภาพลงตาม scale แล้วรันเฉพาะ coarse net
+    - mask ย่อด้วย INTER_AREA แล้วถือว่าเสียหายถ้ามีพิกเซลเสียหายใดๆ ในช่วงนั้น (รอยแตกเส้นเล็กไม่หายไป)
+    - edge map คำนวณใหม่จากภาพที่ย่อแล้ว (ไม่ย่อจาก edge เดิม เพื่อให้เส้นขอบยังบาง 1 พิกเซล)
+    คืนค่า (ภาพตัวอย่าง BGR uint8 ขนาดที่ย่อแล้ว, stats แบบเดียวกับ restore_image)
+    """
+    h, w = img_bgr.shape[:2]
+    if scale < 1:
+        dsize = (max(1, round(w * scale)), max(1, round(h * scale)))
+        img_bgr = cv2.resize(img_bgr, dsize, interpolation=cv2.INTER_AREA)
+        mask_np = (cv2.resize(mask_np, dsize, interpolation=cv2.INTER_AREA) > 0).astype(np.uint8) * 255
+    edge_np = create_edge_map(img_bgr)
+    return restore_image(engine, img_bgr, mask_np, edge_np, size, overlap,
+                         progress=progress, coarse_only=True, cache=cache, executor=executor, check=check)